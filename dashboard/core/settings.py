@@ -4,11 +4,17 @@ Django settings for core project.
 
 from pathlib import Path
 import os
+import sys
 from datetime import timedelta
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# The ops package (runner + client) is a sibling of the dashboard
+GRIDOPS_ROOT = BASE_DIR.parent
+if str(GRIDOPS_ROOT) not in sys.path:
+    sys.path.append(str(GRIDOPS_ROOT))
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.0/howto/deployment/checklist/
 
@@ -188,3 +194,16 @@ CELERY_RESULT_BACKEND = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
 
 # GridOps
 OPS_SOCKET_PATH = "/srv/gridops/ops/runner.sock"
+# True when the proxy shares the runner's "gridops" Docker network with the apps:
+# it then dials replicas by container name instead of their published host ports
+PROXY_ON_APP_NETWORK = os.environ.get('GRIDOPS_PROXY_ON_APP_NETWORK', 'False') == 'True'
+
+# Shared by all workers, e.g. for the SystemSettings version key; without
+# Redis (development) each process keeps its own local-memory cache
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
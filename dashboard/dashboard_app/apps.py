@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class DashboardAppConfig(AppConfig):
     name = "dashboard_app"
+
+    def ready(self):
+        # Connects the signals that invalidate cached SystemSettings and the catalog index
+        from . import catalog, site_settings  # noqa: F401
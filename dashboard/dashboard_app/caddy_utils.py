@@ -1,68 +1,305 @@
+import json
+import re
+import threading
+from collections import OrderedDict
+
 from django.template.loader import render_to_string
 from django.conf import settings
-from .models import App, SystemSettings
+from .compose import fixed_host_port, parse_port
+from .models import App
+from . import site_settings
 
-def generate_caddyfile():
-    apps = App.objects.all()
-    system_settings = SystemSettings.objects.first()
-    domain = system_settings.domain if system_settings else "localhost"
+VPN_RANGES = ["10.0.0.0/8", "172.16.0.0/12", "192.168.0.0/16", "10.8.0.0/24"]
 
-    # Base Caddyfile content
-    caddy_content = f"""
-{{
-    email {getattr(system_settings, 'email', 'admin@localhost')}
-}}
+# App fields the proxy config is generated from
+ROUTING_FIELDS = ('slug', 'status', 'domain_prefix', 'ports', 'expose_public', 'expose_vpn',
+                  'web_service', 'web_port', 'replicas', 'health_path', 'edge_profile')
 
-# Dashboard
-{domain} {{
-    reverse_proxy 127.0.0.1:8000
-}}
-"""
+# Load balancing across replicas; a replica failing its health probe is taken
+# out of rotation until it passes again
+LB_POLICY = "least_conn"
+HEALTH_INTERVAL = "10s"
+HEALTH_TIMEOUT = "5s"
+FAIL_DURATION = "30s"
 
-    # Append App routes
-    for app in apps:
-        if app.status != 'running':
-            continue
+# Edge profile settings (App.edge_profile):
+#   encode          response encodings, in order of preference
+#   static_paths    path patterns whose responses get static_max_age caching
+#   static_max_age  Cache-Control max-age in seconds for static_paths
+#   keepalive_conns idle upstream connections kept open per replica
+#   flush_interval  "-1" flushes every write (streaming apps), or a duration
+EDGE_ENCODINGS = ("zstd", "gzip")
+UPSTREAM_KEEPALIVE = "2m"
+EDGE_PRESETS = {
+    "none": {},
+    "web": {
+        "encode": ["zstd", "gzip"],
+        "static_paths": ["/static/*", "/assets/*", "*.css", "*.js", "*.png", "*.jpg", "*.svg", "*.woff2"],
+        "static_max_age": 86400,
+        "keepalive_conns": 32,
+    },
+    # Compressing would buffer event streams and long polls
+    "streaming": {
+        "flush_interval": "-1",
+        "keepalive_conns": 32,
+    },
+}
 
-        app_domain = f"{app.domain_prefix}.{domain}"
+# Rendered app blocks keyed by routing state, least recently used evicted first
+FRAGMENT_CACHE_SIZE = 4096
+_fragments = OrderedDict()
+_fragments_lock = threading.Lock()
 
-        if not app.ports:
-            continue
+def upstream_port(app):
+    # Host port the first published mapping binds
+    if not app.ports:
+        return None
+    return parse_port(app.ports[0])[0]
 
-        # Naive port selection: first port.
-        # In production, we'd store "web_port" explicitly in App model.
-        upstream_port = app.ports[0]
-        if ":" in str(upstream_port):
-             upstream_port = str(upstream_port).split(":")[0]
+def host_ports(app, replicas=None):
+    """
+    Host ports the app binds: each fixed published port, with the web port
+    taken once per replica.
+    """
+    ports = {fixed_host_port(spec) for spec in app.ports or []} - {None}
+    first = upstream_port(app)
+    if first is not None and first in ports:
+        ports.update(range(first, first + max(replicas or app.replicas, 1)))
+    return ports
 
-        route_block = f"""
-{app_domain} {{
-"""
-        # Exposure Logic
-        if app.expose_vpn and not app.expose_public:
-            # VPN Only: Restrict to private ranges
-            route_block += """
-    @vpn {
-        remote_ip 10.0.0.0/8 172.16.0.0/12 192.168.0.0/16 10.8.0.0/24
+def app_upstreams(app):
+    """Dial address of every replica of the app's web service."""
+    replicas = max(app.replicas, 1)
+    if app.web_service and app.web_port and settings.PROXY_ON_APP_NETWORK:
+        # Compose names replicas <project>-<service>-<n>; the project is the slug
+        return [f"{app.slug}-{app.web_service}-{i}:{app.web_port}" for i in range(1, replicas + 1)]
+    port = upstream_port(app)
+    if port is None:
+        return []
+    # The runner publishes replicas on consecutive host ports
+    return [f"localhost:{port + i}" for i in range(replicas)]
+
+def _positive_int(value):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return 0
+    return max(value, 0)
+
+def edge_profile(app):
+    """The app's edge profile, with unknown or malformed settings dropped."""
+    profile = app.edge_profile if isinstance(app.edge_profile, dict) else {}
+    clean = {}
+    encode = [e for e in profile.get("encode") or [] if e in EDGE_ENCODINGS]
+    if encode:
+        clean["encode"] = list(dict.fromkeys(encode))
+    paths = [p for p in profile.get("static_paths") or []
+             if isinstance(p, str) and re.fullmatch(r"[\w./*-]+", p)]
+    max_age = _positive_int(profile.get("static_max_age"))
+    if paths and max_age:
+        clean["static_paths"] = paths
+        clean["static_max_age"] = max_age
+    keepalive = _positive_int(profile.get("keepalive_conns"))
+    if keepalive:
+        clean["keepalive_conns"] = keepalive
+    flush = str(profile.get("flush_interval", ""))
+    if re.fullmatch(r"-1|\d+(ms|s)", flush):
+        clean["flush_interval"] = flush
+    return clean
+
+def edge_preset(app):
+    """Name of the preset the app's profile matches, or "custom"."""
+    profile = edge_profile(app)
+    for name, preset in EDGE_PRESETS.items():
+        if profile == preset:
+            return name
+    return "custom"
+
+def edge_directives(profile, indent):
+    # Site-level directives: Caddy orders them before reverse_proxy
+    lines = []
+    if "encode" in profile:
+        lines.append(f"encode {' '.join(profile['encode'])}")
+    if "static_paths" in profile:
+        lines += [
+            f"@static path {' '.join(profile['static_paths'])}",
+            "header @static {",
+            f'    Cache-Control "public, max-age={profile["static_max_age"]}"',
+            "    defer",
+            "}",
+        ]
+    return "".join(f"{indent}{line}\n" for line in lines)
+
+def reverse_proxy_directive(upstreams, health_path, profile, indent):
+    directive = f"reverse_proxy {' '.join(upstreams)}"
+    options = []
+    if len(upstreams) > 1:
+        options += [
+            f"lb_policy {LB_POLICY}",
+            f"health_uri {health_path or '/'}",
+            f"health_interval {HEALTH_INTERVAL}",
+            f"health_timeout {HEALTH_TIMEOUT}",
+            f"fail_duration {FAIL_DURATION}",
+        ]
+    if "flush_interval" in profile:
+        options.append(f"flush_interval {profile['flush_interval']}")
+    if "keepalive_conns" in profile:
+        options += [
+            "transport http {",
+            f"    keepalive {UPSTREAM_KEEPALIVE}",
+            f"    keepalive_idle_conns_per_host {profile['keepalive_conns']}",
+            "}",
+        ]
+    if not options:
+        return directive
+    inner = "\n".join(indent + "    " + option for option in options)
+    return f"{directive} {{\n{inner}\n{indent}}}"
+
+def routing_key(app, domain):
+    # Everything an app's Caddyfile block depends on
+    return (domain, app.slug, app.status, app.domain_prefix, tuple(app.ports),
+            app.expose_public, app.expose_vpn, app.web_service, app.web_port,
+            app.replicas, app.health_path, json.dumps(app.edge_profile, sort_keys=True))
+
+def render_app_block(app, domain):
+    if app.status != 'running':
+        return ""
+
+    app_domain = f"{app.domain_prefix}.{domain}"
+
+    upstreams = app_upstreams(app)
+    if not upstreams:
+        return ""
+
+    profile = edge_profile(app)
+    edge = edge_directives(profile, "    ")
+
+    # Exposure Logic
+    if app.expose_vpn and not app.expose_public:
+        # VPN Only: Restrict to private ranges
+        body = """
+%s    @vpn {
+        remote_ip %s
     }
     handle @vpn {
-        reverse_proxy localhost:%s
+        %s
     }
     respond 403
-""" % upstream_port
+""" % (edge, " ".join(VPN_RANGES), reverse_proxy_directive(upstreams, app.health_path, profile, "        "))
 
-        elif app.expose_public:
-             # Public Internet
-             route_block += f"""
-    reverse_proxy localhost:{upstream_port}
+    elif app.expose_public:
+        # Public Internet
+        body = f"""
+{edge}    {reverse_proxy_directive(upstreams, app.health_path, profile, "    ")}
 """
-        else:
-             # Internal only (no route exposed via Caddy, or explicit deny)
-             route_block += """
+    else:
+        # Internal only (no route exposed via Caddy, or explicit deny)
+        body = """
     respond 403
 """
 
-        route_block += "}\n"
-        caddy_content += route_block
+    return f"""
+{app_domain} {{
+{body}}}
+"""
+
+def app_block(app, domain):
+    """The app's Caddyfile block, rendered once per distinct routing state."""
+    key = routing_key(app, domain)
+    with _fragments_lock:
+        fragment = _fragments.get(key)
+        if fragment is not None:
+            _fragments.move_to_end(key)
+            return fragment
+    fragment = render_app_block(app, domain)
+    with _fragments_lock:
+        _fragments[key] = fragment
+        if len(_fragments) > FRAGMENT_CACHE_SIZE:
+            _fragments.popitem(last=False)
+    return fragment
+
+def generate_caddyfile(apps=None):
+    # Plain rows: no model instances for what is mostly a cache lookup per app.
+    # Anything with the ROUTING_FIELDS attributes can be passed instead.
+    if apps is None:
+        apps = App.objects.order_by('pk').values_list(*ROUTING_FIELDS, named=True)
+    system_settings = site_settings.get()
+    domain = system_settings.domain if system_settings else "localhost"
+
+    # Base Caddyfile content
+    parts = [f"""
+{{
+    email {getattr(system_settings, 'email', 'admin@localhost')}
+}}
+
+# Dashboard
+{domain} {{
+    reverse_proxy 127.0.0.1:8000
+}}
+"""]
+
+    # App routes, joined once
+    parts.extend(app_block(app, domain) for app in apps)
+    return "".join(parts)
 
-    return caddy_content
+def app_route(app, domain=None):
+    """
+    The app's route in Caddy's JSON config, the same routing as its Caddyfile
+    block. Returns (host, route); route is None when the app gets no route.
+    """
+    host = f"{app.domain_prefix}.{domain or site_settings.base_domain()}"
+    upstreams = app_upstreams(app)
+    if app.status != 'running' or not upstreams:
+        return host, None
+
+    proxy = {"handler": "reverse_proxy", "upstreams": [{"dial": dial} for dial in upstreams]}
+    if len(upstreams) > 1:
+        proxy["load_balancing"] = {"selection_policy": {"policy": LB_POLICY}}
+        proxy["health_checks"] = {
+            "active": {"uri": app.health_path or "/", "interval": HEALTH_INTERVAL, "timeout": HEALTH_TIMEOUT},
+            "passive": {"fail_duration": FAIL_DURATION},
+        }
+    profile = edge_profile(app)
+    if "flush_interval" in profile:
+        flush = profile["flush_interval"]
+        proxy["flush_interval"] = -1 if flush == "-1" else flush
+    if "keepalive_conns" in profile:
+        proxy["transport"] = {"protocol": "http", "keep_alive": {
+            "enabled": True,
+            "idle_timeout": UPSTREAM_KEEPALIVE,
+            "max_idle_conns_per_host": profile["keepalive_conns"],
+        }}
+    deny = {"handler": "static_response", "status_code": 403}
+
+    # Edge handlers run first and fall through to the routing below
+    edge = []
+    if "encode" in profile:
+        edge.append({"handle": [{
+            "handler": "encode",
+            "encodings": {name: {} for name in profile["encode"]},
+            "prefer": profile["encode"],
+        }]})
+    if "static_paths" in profile:
+        edge.append({"match": [{"path": profile["static_paths"]}], "handle": [{
+            "handler": "headers",
+            "response": {
+                "set": {"Cache-Control": [f"public, max-age={profile['static_max_age']}"]},
+                "deferred": True,
+            },
+        }]})
+
+    if app.expose_vpn and not app.expose_public:
+        routes = edge + [
+            {"match": [{"remote_ip": {"ranges": VPN_RANGES}}], "handle": [proxy], "terminal": True},
+            {"handle": [deny]},
+        ]
+    elif app.expose_public:
+        routes = edge + [{"handle": [proxy]}]
+    else:
+        routes = [{"handle": [deny]}]
+
+    return host, {
+        "match": [{"host": [host]}],
+        "handle": [{"handler": "subroute", "routes": routes}],
+        "terminal": True,
+    }
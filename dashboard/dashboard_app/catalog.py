@@ -0,0 +1,283 @@
+"""
+Syncing the app catalog from its YAML source, and searching it.
+
+Each entry is hashed; a sync reads the stored hashes in one query and
+writes only the rows that were added, changed or dropped, in bulk and in one
+transaction.
+
+Search is served from an in-memory inverted index per worker. A sync (or
+an admin edit) bumps a version key in the shared cache; workers then compare
+content hashes and reload only the entries that changed.
+"""
+import base64
+import bisect
+import hashlib
+import json
+import re
+import threading
+import uuid
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .compose import TemplateError, template_metadata
+from .models import CatalogItem
+
+SOURCE_FIELDS = ('name', 'description', 'category', 'icon', 'docker_compose_template', 'form_schema',
+                 'web_service', 'web_port')
+# Derived from the template at import, as are web_service and web_port when
+# the entry leaves them out
+METADATA_FIELDS = ('images', 'ports', 'volumes', 'required_vars')
+CATALOG_FIELDS = SOURCE_FIELDS + METADATA_FIELDS
+# Part of every content hash: bump it when template_metadata() changes so
+# the next import parses every entry again
+METADATA_FORMAT = 2
+BATCH_SIZE = 500
+
+VERSION_KEY = "gridops:catalog:version"
+# What the catalog page shows; the template columns are never loaded for it
+CARD_FIELDS = ('slug', 'name', 'description', 'category', 'icon')
+PAGE_SIZE = 24
+TOKEN_RE = re.compile(r"\w+")
+
+
+def catalog_fields(entry):
+    return {
+        'name': entry['name'],
+        'description': entry['description'],
+        'category': entry.get('category', 'General'),
+        'icon': entry.get('icon', '📦'),
+        'docker_compose_template': entry['docker_compose_template'],
+        'form_schema': entry.get('form_schema', []),
+        'web_service': entry.get('web_service', ''),
+        'web_port': entry.get('web_port'),
+    }
+
+
+def content_hash(fields):
+    """Hash of an entry's source fields."""
+    source = [METADATA_FORMAT] + [fields[name] for name in SOURCE_FIELDS]
+    canonical = json.dumps(source, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def changed_fields(items):
+    """The catalog fields that differ from the stored rows in any of items.
+
+    bulk_update() builds a CASE per field per row, so it is only handed the
+    columns an edit actually touched (usually one or two)."""
+    stored = {}
+    pks = [item.pk for item in items]
+    for start in range(0, len(pks), BATCH_SIZE):
+        for row in CatalogItem.objects.filter(pk__in=pks[start:start + BATCH_SIZE]).values('pk', *CATALOG_FIELDS):
+            stored[row.pop('pk')] = row
+    fields = [name for name in CATALOG_FIELDS
+              if any(getattr(item, name) != stored[item.pk][name] for item in items)]
+    return fields + ['content_hash']
+
+
+def sync_catalog(entries):
+    """
+    Make the CatalogItem table match `entries`. Returns the slugs that were
+    created, updated and deleted, how many were unchanged, and the entries
+    whose template is invalid (slug -> error), which are left as they were.
+    """
+    incoming = {}
+    for entry in entries:
+        fields = catalog_fields(entry)
+        # A slug listed twice: the later entry wins, as it did row by row
+        incoming[entry['slug']] = (content_hash(fields), fields)
+
+    with transaction.atomic():
+        existing = {slug: (pk, digest) for slug, pk, digest in
+                    CatalogItem.objects.values_list('slug', 'pk', 'content_hash')}
+        created, updated, invalid = [], [], {}
+        for slug, (digest, fields) in incoming.items():
+            if slug in existing and existing[slug][1] == digest:
+                continue
+            # Templates are only parsed when their entry is new or changed
+            try:
+                fields.update(template_metadata(fields['docker_compose_template'], fields['form_schema'],
+                                                fields['web_service'], fields['web_port']))
+            except TemplateError as e:
+                invalid[slug] = str(e)
+                continue
+            if slug not in existing:
+                created.append(CatalogItem(slug=slug, content_hash=digest, **fields))
+            else:
+                updated.append(CatalogItem(pk=existing[slug][0], slug=slug, content_hash=digest, **fields))
+        deleted = [slug for slug in existing if slug not in incoming]
+
+        CatalogItem.objects.bulk_create(created, batch_size=BATCH_SIZE)
+        if updated:
+            CatalogItem.objects.bulk_update(updated, changed_fields(updated), batch_size=BATCH_SIZE)
+        stale = [existing[slug][0] for slug in deleted]
+        for start in range(0, len(stale), BATCH_SIZE):
+            CatalogItem.objects.filter(pk__in=stale[start:start + BATCH_SIZE]).delete()
+
+    if created or updated or deleted:
+        bump_version()
+    return {
+        'created': [item.slug for item in created],
+        'updated': [item.slug for item in updated],
+        'deleted': deleted,
+        'unchanged': len(incoming) - len(created) - len(updated) - len(invalid),
+        'invalid': invalid,
+    }
+
+
+def tokens(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def bump_version():
+    cache.set(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+class CatalogIndex:
+    """
+    Inverted index over name, description and category. Query words match
+    indexed words by prefix and all of them have to match.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.cards = {}     # pk -> card dict
+        self.hashes = {}    # pk -> content hash the card was loaded at
+        self.postings = {}  # word -> set of pks
+        self.words = []     # sorted postings keys, for prefix lookups
+        self.order = []     # (sort key, pk), sorted: the listing order
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def sort_key(card):
+        return (card['name'].lower(), card['slug'])
+
+    def _add(self, pk, card):
+        self.cards[pk] = card
+        for word in set(tokens(f"{card['name']} {card['description']} {card['category']}")):
+            self.postings.setdefault(word, set()).add(pk)
+
+    def _remove(self, pk):
+        card = self.cards.pop(pk)
+        self.hashes.pop(pk, None)
+        for word in set(tokens(f"{card['name']} {card['description']} {card['category']}")):
+            pks = self.postings.get(word)
+            if pks is not None:
+                pks.discard(pk)
+                if not pks:
+                    del self.postings[word]
+
+    def refresh(self):
+        """Bring the index up to date when the catalog version moved."""
+        version = cache.get(VERSION_KEY)
+        if version is not None and version == self.version:
+            return
+        with self.lock:
+            if version is not None and version == self.version:
+                return
+            if version is None:
+                version = uuid.uuid4().hex
+                if not cache.add(VERSION_KEY, version, timeout=None):
+                    version = None  # someone else just set it: check again next time
+            current = dict(CatalogItem.objects.values_list('pk', 'content_hash'))
+            for pk in [pk for pk in self.cards if pk not in current]:
+                self._remove(pk)
+            # Rows from before content hashes existed have none: always reload those
+            stale = [pk for pk, digest in current.items() if not digest or self.hashes.get(pk) != digest]
+            for start in range(0, len(stale), BATCH_SIZE):
+                rows = CatalogItem.objects.filter(pk__in=stale[start:start + BATCH_SIZE]).values('pk', *CARD_FIELDS)
+                for row in rows:
+                    pk = row.pop('pk')
+                    if pk in self.cards:
+                        self._remove(pk)
+                    self._add(pk, row)
+                    self.hashes[pk] = current[pk]
+            if stale or len(self.order) != len(self.cards):
+                self.words = sorted(self.postings)
+                self.order = sorted((self.sort_key(card), pk) for pk, card in self.cards.items())
+            self.version = version
+
+    def matches(self, query):
+        """pks matching every word of `query`, or None for no query (everything)."""
+        words = tokens(query)
+        if not words:
+            return None
+        result = None
+        for word in words:
+            start = bisect.bisect_left(self.words, word)
+            pks = set()
+            for indexed in self.words[start:]:
+                if not indexed.startswith(word):
+                    break
+                pks |= self.postings[indexed]
+            result = pks if result is None else result & pks
+            if not result:
+                return set()
+        return result
+
+    def search(self, query="", category="", cursor="", limit=PAGE_SIZE):
+        """
+        One page of cards in name order, the category facet counts of all
+        matches, and the cursor of the next page (None on the last one).
+        """
+        self.refresh()
+        with self.lock:
+            matched = self.matches(query)
+            facets = Counter(card['category'] for pk, card in self.cards.items() if matched is None or pk in matched)
+            after = decode_cursor(cursor)
+            position = bisect.bisect_right(self.order, (after, float('inf'))) if after else 0
+            page = []
+            for key, pk in self.order[position:]:
+                if matched is not None and pk not in matched:
+                    continue
+                card = self.cards[pk]
+                if category and card['category'] != category:
+                    continue
+                if len(page) == limit:
+                    return page, sorted(facets.items()), encode_cursor(self.sort_key(page[-1]))
+                page.append(card)
+        return page, sorted(facets.items()), None
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor):
+    # The sort key of the last card shown; anything unreadable starts over
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
+    if isinstance(key, list) and len(key) == 2 and all(isinstance(part, str) for part in key):
+        return tuple(key)
+    return None
+
+
+index = CatalogIndex()
+
+
+@receiver(post_save, sender=CatalogItem)
+def catalog_item_saved(sender, instance, **kwargs):
+    # Saved outside a sync (admin, shell): keep hash and metadata true to the row
+    digest = content_hash({field: getattr(instance, field) for field in SOURCE_FIELDS})
+    if digest != instance.content_hash:
+        changes = {'content_hash': digest}
+        try:
+            changes.update(template_metadata(instance.docker_compose_template, instance.form_schema,
+                                             instance.web_service, instance.web_port))
+        except TemplateError:
+            pass
+        for field, value in changes.items():
+            setattr(instance, field, value)
+        CatalogItem.objects.filter(pk=instance.pk).update(**changes)
+    bump_version()
+
+
+@receiver(post_delete, sender=CatalogItem)
+def catalog_item_deleted(sender, **kwargs):
+    bump_version()
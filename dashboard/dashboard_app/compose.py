@@ -0,0 +1,313 @@
+"""
+Compose templates of catalog apps.
+
+A template is parsed and validated once, when the catalog is imported: the
+images, ports, volumes and variables found are stored on the CatalogItem.
+Installing ships the template unchanged with a .env of the values, so
+compose substitutes them after parsing the YAML and a value can never change
+its structure. The dashboard only substitutes variables into the metadata it
+records (image, ports, volumes), through a renderer compiled once per
+template and cached by its hash.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+import yaml
+
+# $$ (a literal $), ${VAR}, ${VAR-default}, ${VAR:-default}, ${VAR?error}, ${VAR:?error}, $VAR
+VARIABLE_RE = re.compile(r"\$(?:(\$)|\{(\w+)(?:(:?[-?])([^}]*))?\}|(\w+))")
+NAME_RE = re.compile(r"\w+")
+NULL_TAG = "tag:yaml.org,2002:null"
+MERGE_TAG = "tag:yaml.org,2002:merge"
+NULLS = {"", "~", "null", "Null", "NULL"}
+RENDERER_CACHE_SIZE = 256
+_renderers = OrderedDict()
+_renderers_lock = threading.Lock()
+
+
+class TemplateError(ValueError):
+    pass
+
+
+def parse_port(spec):
+    """
+    (host port, container port) of a compose short-syntax port mapping:
+    "8080:80", "127.0.0.1:8080:80", "8080:80/tcp" or a bare "80".
+    """
+    spec = str(spec).split("/", 1)[0]
+    parts = spec.split(":")
+    container = parts[-1]
+    host = parts[-2] if len(parts) > 1 else container
+    try:
+        return int(host), int(container)
+    except ValueError:
+        return None, None
+
+
+def container_port(spec):
+    """The container port of a mapping, or None when it is left to a variable."""
+    port = str(spec).split("/", 1)[0].rsplit(":", 1)[-1]
+    return int(port) if port.isdigit() else None
+
+
+def fixed_host_port(spec):
+    """The host port a mapping binds, or None when the host side is left to Docker."""
+    if ":" not in str(spec).split("/", 1)[0]:
+        return None
+    return parse_port(spec)[0]
+
+
+class Renderer:
+    """A template split once into literal text and variable references."""
+
+    def __init__(self, template):
+        self.parts = []  # literal strings and (name, operator, argument) tuples
+        self.variables = {}  # name -> inline default, or None when it has none
+        position = 0
+        for match in VARIABLE_RE.finditer(template):
+            self.parts.append(template[position:match.start()])
+            position = match.end()
+            if match.group(1):
+                self.parts.append("$")
+                continue
+            name = match.group(2) or match.group(5)
+            operator, argument = match.group(3) or "", match.group(4) or ""
+            self.parts.append((name, operator, argument))
+            default = argument if operator.endswith("-") else None
+            # Optional only if every reference has a default
+            if name not in self.variables or default is None:
+                self.variables[name] = default
+        self.parts.append(template[position:])
+        self.parts = [part for part in self.parts if part != ""]
+
+    def substitute(self, part, values):
+        name, operator, argument = part
+        value = values.get(name)
+        unset = value is None or (operator.startswith(":") and value == "")
+        if unset and operator.endswith("-"):
+            value = argument
+        elif unset and operator.endswith("?"):
+            raise TemplateError(argument or f"{name} is required")
+        elif value is None:
+            value = ""
+        value = str(value)
+        if "\n" in value or "\r" in value:
+            raise TemplateError(f"{name} must be a single line")
+        return value
+
+    def check(self, values):
+        """Raise TemplateError where compose would refuse to interpolate `values`."""
+        for part in self.parts:
+            if not isinstance(part, str):
+                self.substitute(part, values)
+
+    def render(self, values):
+        return "".join(part if isinstance(part, str) else self.substitute(part, values) for part in self.parts)
+
+
+def template_hash(template):
+    return hashlib.sha256(template.encode()).hexdigest()
+
+
+def renderer(template):
+    """The compiled renderer of `template`, cached by its hash."""
+    key = template_hash(template)
+    with _renderers_lock:
+        compiled = _renderers.get(key)
+        if compiled is not None:
+            _renderers.move_to_end(key)
+            return compiled
+    compiled = Renderer(template)
+    with _renderers_lock:
+        _renderers[key] = compiled
+        if len(_renderers) > RENDERER_CACHE_SIZE:
+            _renderers.popitem(last=False)
+    return compiled
+
+
+def render_template(template, values):
+    return renderer(template).render(values)
+
+
+def env_file(values):
+    """
+    The .env compose interpolates a template from. Values are double-quoted
+    with backslashes, quotes and $ escaped, so compose reads them verbatim.
+    """
+    lines = []
+    for name, value in values.items():
+        if not NAME_RE.fullmatch(name):
+            raise TemplateError(f"Invalid variable name {name!r}")
+        value = str(value)
+        if "\n" in value or "\r" in value:
+            raise TemplateError(f"{name} must be a single line")
+        value = value.replace("\\", "\\\\").replace('"', '\\"').replace("$", "\\$")
+        lines.append(f'{name}="{value}"\n')
+    return "".join(lines)
+
+
+def image_version(image):
+    """The tag of an image reference ("latest" when it has none)."""
+    name, _, digest = image.partition("@")
+    if digest:
+        return digest[:19]
+    _, colon, tag = name.rpartition(":")
+    return tag if colon and "/" not in tag else "latest"
+
+
+def port_spec(port):
+    if isinstance(port, dict):
+        # Long syntax: {target, published, protocol}
+        if "target" not in port:
+            raise TemplateError(f"Port {port!r} has no target")
+        published = port.get("published")
+        spec = f"{published}:{port['target']}" if published else str(port["target"])
+        return f"{spec}/{port['protocol']}" if port.get("protocol") else spec
+    return str(port)
+
+
+def volume_spec(volume):
+    if isinstance(volume, dict):
+        if "target" not in volume:
+            raise TemplateError(f"Volume {volume!r} has no target")
+        return f"{volume['source']}:{volume['target']}" if volume.get("source") else str(volume["target"])
+    return str(volume)
+
+
+class TemplateLoader(getattr(yaml, 'CSafeLoader', yaml.SafeLoader)):
+    """
+    The C parser when PyYAML was built with libyaml, resolving only the tags
+    node_data() looks at: each plain scalar otherwise went through every
+    implicit resolver's regex.
+    """
+
+    def resolve(self, kind, value, implicit):
+        if kind is yaml.ScalarNode:
+            if implicit[0] and value in NULLS:
+                return NULL_TAG
+            if implicit[0] and value == "<<":
+                return MERGE_TAG
+            return "tag:yaml.org,2002:str"
+        return "tag:yaml.org,2002:seq" if kind is yaml.SequenceNode else "tag:yaml.org,2002:map"
+
+    def descend_resolver(self, *args):
+        pass
+
+    def ascend_resolver(self, *args):
+        pass
+
+
+def mapping_nodes(node):
+    """Key -> value node of a mapping node, merge keys applied; None for any other node."""
+    if not isinstance(node, yaml.MappingNode):
+        return None
+    items, merged = {}, {}
+    for key, value in node.value:
+        if key.tag != MERGE_TAG:
+            items[node_data(key, {})] = value
+            continue
+        # <<: *base or <<: [*first, *second]; earlier sources and own keys win
+        for source in reversed(value.value if isinstance(value, yaml.SequenceNode) else [value]):
+            source = mapping_nodes(source)
+            if source is None:
+                raise TemplateError("Merge key needs a mapping")
+            merged.update(source)
+    merged.update(items)
+    return merged
+
+
+def node_data(node, memo):
+    """The data of a composed YAML node, with scalars left as strings (null as None)."""
+    if node is None or isinstance(node, yaml.ScalarNode):
+        return None if node is None or node.tag == NULL_TAG else node.value
+    if id(node) in memo:
+        # An alias: the same object, as the constructor would give
+        return memo[id(node)]
+    if isinstance(node, yaml.SequenceNode):
+        data = memo[id(node)] = []
+        data.extend([node_data(item, memo) for item in node.value])
+        return data
+    data = memo[id(node)] = {}
+    for key, value in mapping_nodes(node).items():
+        data[key] = node_data(value, memo)
+    return data
+
+
+def template_services(template):
+    """
+    Image, ports and volumes of each service of a template. Only those nodes
+    become data: PyYAML's constructor would build the whole document and
+    type every scalar in it, most of the cost of an import.
+    """
+    loader = TemplateLoader(template)
+    try:
+        document = mapping_nodes(loader.get_single_node())
+        services = mapping_nodes(document.get("services")) if document else None
+        if not services:
+            raise TemplateError("Template defines no services")
+        memo = {}
+        return {
+            name: {field: node_data(service.get(field), memo) for field in ("image", "ports", "volumes")}
+            for name, service in ((name, mapping_nodes(node) or {}) for name, node in services.items())
+        }
+    except yaml.YAMLError as e:
+        raise TemplateError(f"Invalid YAML: {e}")
+    except (TypeError, RecursionError):
+        # A mapping or sequence as a key, or nesting too deep to walk
+        raise TemplateError("Invalid YAML: unsupported structure")
+    finally:
+        loader.dispose()
+
+
+def template_metadata(template, form_schema=(), web_service="", web_port=None):
+    """
+    Validate a catalog template and extract what the App record needs:
+    images per service, the web service and its published ports, volumes,
+    and the variables an install has to supply. Raises TemplateError.
+
+    The catalog entry names its web service and port; without them the
+    first service publishing ports is taken, and the container port of its
+    first mapping.
+    """
+    services = template_services(template)
+    if web_service and web_service not in services:
+        raise TemplateError(f"Web service {web_service!r} is not in the template")
+    if web_port is not None and (not isinstance(web_port, int) or not 0 < web_port < 65536):
+        raise TemplateError(f"Invalid web port {web_port!r}")
+
+    images = {}
+    volumes = []
+    ports = []
+    for name, service in services.items():
+        if not service["image"]:
+            raise TemplateError(f"Service {name!r} has no image")
+        images[name] = str(service["image"])
+        volumes += [volume_spec(v) for v in service["volumes"] or []]
+        published = [port_spec(p) for p in service["ports"] or []]
+        if name == web_service or (published and not web_service):
+            web_service, ports = name, published
+
+    defaults = {field.get("name"): field.get("default") for field in form_schema or [] if isinstance(field, dict)}
+    required = []
+    # Not through the cache: an import would evict the renderers installs use
+    for name, default in Renderer(template).variables.items():
+        if default is not None:
+            continue
+        if name not in defaults:
+            raise TemplateError(f"Variable {name} has no default and no form field")
+        required.append(name)
+
+    # The container port of the web service, for proxying on the app network;
+    # one left to a variable is known once the install supplies it
+    if web_port is None and ports:
+        web_port = container_port(ports[0])
+    return {
+        "images": images,
+        "ports": ports,
+        "volumes": volumes,
+        "required_vars": required,
+        "web_service": web_service,
+        "web_port": web_port,
+    }
@@ -0,0 +1,109 @@
+"""
+Live dashboard updates pushed over Server-Sent Events.
+
+Each worker process runs one producer that samples host stats and app
+states and publishes only the values that changed. Every connected client
+has a pending dict that deltas are merged into: a slow client just gets the
+latest values once it catches up, so memory per client stays bounded by the
+number of keys and the producer never waits on anyone.
+"""
+import asyncio
+import json
+
+from .metrics import host_stats
+from .ops import aops
+
+LIVE_INTERVAL = 2
+# A comment line this often keeps proxies from closing an idle stream
+HEARTBEAT = 15
+# Browsers reconnect after this many milliseconds when the stream drops
+RETRY_MS = 3000
+
+
+class Subscription:
+    def __init__(self, snapshot):
+        self.pending = dict(snapshot)
+        self.ready = asyncio.Event()
+        if self.pending:
+            self.ready.set()
+
+    def offer(self, delta):
+        # Coalesce: newer values replace whatever the client hasn't read yet
+        self.pending.update(delta)
+        self.ready.set()
+
+    def take(self):
+        delta, self.pending = self.pending, {}
+        self.ready.clear()
+        return delta
+
+
+class Broadcaster:
+    """Runs one producer while anyone listens and fans its deltas out."""
+
+    def __init__(self, interval=LIVE_INTERVAL):
+        self.interval = interval
+        self.state = {}
+        self.clients = set()
+        self.task = None
+
+    def subscribe(self):
+        subscription = Subscription(self.state)
+        self.clients.add(subscription)
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run())
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.clients.discard(subscription)
+        if not self.clients and self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def publish(self, values):
+        delta = {key: value for key, value in values.items() if self.state.get(key) != value}
+        if not delta:
+            return delta
+        self.state.update(delta)
+        for client in self.clients:
+            client.offer(delta)
+        return delta
+
+    async def collect(self):
+        values = {f"host.{key}": value for key, value in host_stats().items()}
+        res = await aops.list_status()
+        if res.get("status") == "success" and res.get("synced"):
+            for slug, summary in (res.get("apps") or {}).items():
+                values[f"app.{slug}"] = {"state": summary["state"], "restarts": summary["restarts"]}
+        return values
+
+    async def run(self):
+        while self.clients:
+            try:
+                self.publish(await self.collect())
+            except Exception:
+                # A failed sample must not end the stream for everyone
+                pass
+            await asyncio.sleep(self.interval)
+
+
+broadcaster = Broadcaster()
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def event_stream(broadcaster=broadcaster, heartbeat=HEARTBEAT):
+    subscription = broadcaster.subscribe()
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        while True:
+            try:
+                await asyncio.wait_for(subscription.ready.wait(), heartbeat)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield sse("update", subscription.take())
+    finally:
+        broadcaster.unsubscribe(subscription)
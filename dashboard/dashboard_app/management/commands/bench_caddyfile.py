@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from dashboard_app import caddy_utils
+from dashboard_app.models import App
+
+
+class Command(BaseCommand):
+    help = 'Benchmark Caddyfile generation with many installed apps (unsaved, nothing is written)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--apps', type=int, default=1000)
+        parser.add_argument('--rounds', type=int, default=20)
+
+    def timed(self, apps, rounds, before=None):
+        total = 0
+        for i in range(rounds):
+            if before:
+                before(i)
+            started = time.perf_counter()
+            content = caddy_utils.generate_caddyfile(apps)
+            total += time.perf_counter() - started
+        return total / rounds * 1000, content
+
+    def handle(self, *args, **options):
+        count, rounds = options['apps'], options['rounds']
+        # The renderer only reads their fields, so the apps never touch the database
+        apps = [
+            App(
+                name=f"Bench {i}", slug=f"bench-{i}", icon="", version="1", image="nginx",
+                status="running", domain_prefix=f"bench-{i}", ports=[f"{10000 + i}:80"],
+                expose_public=i % 3 != 0, expose_vpn=i % 3 == 0,
+            )
+            for i in range(count)
+        ]
+
+        cold, content = self.timed(apps, rounds, lambda i: caddy_utils._fragments.clear())
+        warm, _ = self.timed(apps, rounds)
+
+        # One app changes per round: only its block is rendered again
+        def change_one(i):
+            apps[0].domain_prefix = f"bench-0-{i}"
+        changed, _ = self.timed(apps, rounds, change_one)
+
+        self.stdout.write(f"{count} apps, {len(content) / 1024:.0f} KiB Caddyfile")
+        self.stdout.write(f"  cold cache:   {cold:8.2f} ms (mean of {rounds})")
+        self.stdout.write(f"  warm cache:   {warm:8.2f} ms (mean of {rounds})")
+        self.stdout.write(f"  one changed:  {changed:8.2f} ms (mean of {rounds})")
@@ -1,6 +1,6 @@
 from django.core.management.base import BaseCommand
 import yaml
-from dashboard_app.models import CatalogItem
+from dashboard_app.catalog import sync_catalog
 
 class Command(BaseCommand):
     help = 'Import apps from catalog yaml'
@@ -29,18 +29,17 @@ class Command(BaseCommand):
             return
 
         with open(path, 'r') as f:
-            data = yaml.safe_load(f)
-
-        for entry in data:
-            CatalogItem.objects.update_or_create(
-                slug=entry['slug'],
-                defaults={
-                    'name': entry['name'],
-                    'description': entry['description'],
-                    'category': entry.get('category', 'General'),
-                    'icon': entry.get('icon', '📦'),
-                    'docker_compose_template': entry['docker_compose_template'],
-                    'form_schema': entry.get('form_schema', [])
-                }
-            )
-        self.stdout.write(self.style.SUCCESS('Successfully imported catalog'))
+            # libyaml's loader when available: several times faster on large catalogs
+            data = yaml.load(f, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+
+        changes = sync_catalog(data or [])
+        if options['verbosity'] > 1:
+            for kind in ('created', 'updated', 'deleted'):
+                for slug in changes[kind]:
+                    self.stdout.write(f'  {kind}: {slug}')
+        for slug, error in changes['invalid'].items():
+            self.stdout.write(self.style.WARNING(f'  skipped {slug}: {error}'))
+        self.stdout.write(self.style.SUCCESS(
+            f"Successfully imported catalog: {len(changes['created'])} added, {len(changes['updated'])} updated, "
+            f"{len(changes['deleted'])} removed, {changes['unchanged']} unchanged, {len(changes['invalid'])} invalid"
+        ))
@@ -0,0 +1,78 @@
+import psutil
+
+try:
+    from ops.container_stats import APP_LAYOUT, APP_METRICS_FILE
+    from ops.metrics import RINGS, MetricsReader
+except ImportError:
+    # The Docker image only ships the dashboard, without the ops package
+    RINGS = ()
+    MetricsReader = None
+
+# One mapping of the sampler's ring buffer per worker process
+reader = MetricsReader() if MetricsReader else None
+# Per-app container stats, written by the runner
+app_reader = MetricsReader(APP_METRICS_FILE, layout=APP_LAYOUT) if MetricsReader else None
+
+RESOLUTIONS = [name for name, _, _ in RINGS]
+
+def host_stats():
+    """Latest host CPU/RAM/disk percentages, from the sampler when it runs."""
+    sample = reader.latest() if reader else None
+    if sample is None:
+        # No sampler (dev server, Docker image): measure in-process
+        return {
+            'cpu': psutil.cpu_percent(),
+            'ram': psutil.virtual_memory().percent,
+            'disk': psutil.disk_usage('/').percent,
+        }
+    return {key: round(sample[key], 1) for key in ('cpu', 'ram', 'disk')}
+
+def host_history(resolution="raw", limit=None):
+    if not reader or resolution not in RESOLUTIONS:
+        return []
+    return reader.history(resolution, limit)
+
+def sparkline(values, width=100, height=24, top=100.0):
+    """SVG polyline points for values between 0 and `top`."""
+    if len(values) < 2:
+        return ""
+    step = width / (len(values) - 1)
+    return " ".join(
+        f"{i * step:.1f},{height - min(max(v, 0), top) / top * height:.1f}"
+        for i, v in enumerate(values)
+    )
+
+def host_trends(points=60):
+    """Sparklines of the last hour (1m rollups), or of raw samples until there are some."""
+    history = host_history("1m", points)
+    if len(history) < 2:
+        history = host_history("raw", points)
+    return {
+        f'{key}_trend': sparkline([sample[key] for sample in history])
+        for key in ('cpu', 'ram', 'disk')
+    }
+
+def app_trends(slug, points=60):
+    """
+    Current value and sparkline of the app's CPU (share of the host),
+    memory, network and disk throughput; empty until the runner has stats.
+    """
+    index = app_reader.series().get(slug) if app_reader else None
+    if index is None:
+        return {}
+    history = app_reader.history("1m", points, index)
+    if len(history) < 2:
+        history = app_reader.history("raw", points, index)
+    if not history:
+        return {}
+    values = {
+        'cpu': [sample['cpu'] for sample in history],
+        'mem': [sample['mem'] for sample in history],
+        'net': [sample['net_rx'] + sample['net_tx'] for sample in history],
+        'disk': [sample['blk_read'] + sample['blk_write'] for sample in history],
+    }
+    return {
+        # Byte series are scaled to their own peak
+        key: {'now': series[-1], 'trend': sparkline(series, top=100.0 if key == 'cpu' else max(max(series), 1.0))}
+        for key, series in values.items()
+    }
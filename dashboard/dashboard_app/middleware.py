@@ -1,22 +1,27 @@
 from django.shortcuts import redirect
 from django.urls import reverse
-from .models import SystemSettings
+from .site_settings import is_configured
 
 class OnboardingMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
+        self.onboarding_path = None
 
     def __call__(self, request):
         # Exclude static/media/admin
         if request.path.startswith('/static/') or request.path.startswith('/admin/'):
             return self.get_response(request)
 
-        settings_exist = SystemSettings.objects.exists()
+        if self.onboarding_path is None:
+            self.onboarding_path = reverse('onboarding')
 
-        if not settings_exist and request.path != reverse('onboarding'):
+        # Cached settings: after onboarding this is a flag check, not a query
+        settings_exist = is_configured()
+
+        if not settings_exist and request.path != self.onboarding_path:
             return redirect('onboarding')
 
-        if settings_exist and request.path == reverse('onboarding'):
+        if settings_exist and request.path == self.onboarding_path:
              return redirect('overview')
 
         response = self.get_response(request)
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dashboard_app", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="app",
+            name="current_job",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard_app', '0002_app_current_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='app',
+            name='health_path',
+            field=models.CharField(default='/', help_text='Probed by the proxy when running several replicas', max_length=200),
+        ),
+        migrations.AddField(
+            model_name='app',
+            name='replicas',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='app',
+            name='web_port',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='app',
+            name='web_service',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard_app', '0003_app_replicas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='app',
+            name='edge_profile',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard_app', '0004_app_edge_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='catalogitem',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
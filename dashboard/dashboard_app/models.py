@@ -15,14 +15,23 @@ class App(models.Model):
     ports = models.JSONField(default=list) # [8080]
     volumes = models.JSONField(default=list) # ["/data"]
 
+    # Web traffic: compose service the proxy targets, its container port, and
+    # how many replicas of it run on the shared gridops network
+    web_service = models.CharField(max_length=100, blank=True)
+    web_port = models.PositiveIntegerField(null=True, blank=True)
+    replicas = models.PositiveSmallIntegerField(default=1)
+    health_path = models.CharField(max_length=200, default="/", help_text="Probed by the proxy when running several replicas")
+
     # Installation State
     installed_version = models.CharField(max_length=50, blank=True, null=True)
     status = models.CharField(max_length=20, default="stopped") # running, stopped, error
+    current_job = models.CharField(max_length=64, blank=True) # Ops runner job in flight
 
     # Exposure
     expose_public = models.BooleanField(default=False)
     expose_vpn = models.BooleanField(default=False)
     domain_prefix = models.CharField(max_length=100, blank=True) # app.domain.tld
+    edge_profile = models.JSONField(default=dict, blank=True) # compression, caching, upstream tuning
 
     # Security
     auth_protected = models.BooleanField(default=False, help_text="Enable Anubis protection")
@@ -48,6 +57,17 @@ class CatalogItem(models.Model):
     docker_compose_template = models.TextField()
     form_schema = models.JSONField(default=dict) # JSON schema for installation form
 
+    # Parsed from the template when the catalog is imported
+    images = models.JSONField(default=dict, blank=True) # {service: image}
+    ports = models.JSONField(default=list, blank=True) # published ports of the web service
+    volumes = models.JSONField(default=list, blank=True)
+    required_vars = models.JSONField(default=list, blank=True) # variables without an inline default
+    web_service = models.CharField(max_length=100, blank=True)
+    web_port = models.PositiveIntegerField(null=True, blank=True)
+
+    # Hash of the catalog entry this row was imported from; unchanged entries are skipped
+    content_hash = models.CharField(max_length=64, blank=True)
+
     def __str__(self):
         return self.name
 
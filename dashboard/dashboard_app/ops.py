@@ -0,0 +1,26 @@
+from django.conf import settings
+
+try:
+    from ops.client import AsyncOpsClient, OpsClient
+except ImportError:
+    # The Docker image only ships the dashboard, without the ops package
+    SIMULATED = {"status": "success", "message": "Dev mode: Ops command simulated"}
+
+    class OpsClient:
+        def __init__(self, socket_path=None):
+            self.socket_path = socket_path
+
+        def __getattr__(self, name):
+            def simulated(*args, **kwargs):
+                return dict(SIMULATED)
+            return simulated
+
+    class AsyncOpsClient(OpsClient):
+        def __getattr__(self, name):
+            async def simulated(*args, **kwargs):
+                return dict(SIMULATED)
+            return simulated
+
+# Blocking client for sync views, asyncio client for async views
+ops = OpsClient(settings.OPS_SOCKET_PATH)
+aops = AsyncOpsClient(settings.OPS_SOCKET_PATH)
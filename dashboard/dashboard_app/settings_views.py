@@ -1,19 +1,8 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-# from ops.client import OpsClient  # TODO: Implement ops client
-
-class OpsClient:
-    def save_rclone_config(self, content):
-        return {"status": "success"}
-    
-    def mount_rclone(self, remote):
-        return {"status": "success"}
-    
-    def self_update(self):
-        return {"status": "success"}
-
-ops = OpsClient()
+from .ops import ops
+import datetime
 
 @login_required
 def system_settings(request):
@@ -29,19 +18,49 @@ def system_settings(request):
         elif 'mount_remote' in request.POST:
             remote = request.POST['mount_remote']
             res = ops.mount_rclone(remote)
-            if res.get('status') == 'success':
+            if res.get('status') in ('success', 'accepted'):
                  messages.success(request, f"Mounted remote {remote}.")
             else:
                  messages.error(request, f"Error mounting: {res.get('message')}")
 
-    return render(request, 'dashboard/settings.html')
+    res = ops.list_releases()
+    releases = res.get('releases', []) if res.get('status') == 'success' else []
+    res = ops.list_checkpoints()
+    checkpoints = res.get('checkpoints', []) if res.get('status') == 'success' else []
+    for checkpoint in checkpoints:
+        checkpoint['created'] = datetime.datetime.fromtimestamp(checkpoint['created_at'])
+    return render(request, 'dashboard/settings.html', {
+        'current_release': next((r for r in releases if r['current']), None),
+        'previous_release': next((r for r in releases if r['previous']), None),
+        'checkpoints': list(reversed(checkpoints)),
+    })
 
 @login_required
 def system_update(request):
     if request.method == "POST":
         res = ops.self_update()
-        if res.get('status') == 'success':
+        if res.get('status') in ('success', 'accepted'):
             messages.info(request, "System update initiated. The service will restart shortly.")
         else:
             messages.error(request, f"Update failed: {res.get('message')}")
     return redirect('settings')
+
+@login_required
+def system_restore_checkpoint(request):
+    if request.method == "POST":
+        res = ops.restore_checkpoint(request.POST.get('checkpoint'))
+        if res.get('status') in ('success', 'accepted'):
+            messages.info(request, "Restoring the pre-update checkpoint.")
+        else:
+            messages.error(request, f"Restore failed: {res.get('message')}")
+    return redirect('settings')
+
+@login_required
+def system_rollback(request):
+    if request.method == "POST":
+        res = ops.rollback_release()
+        if res.get('status') in ('success', 'accepted'):
+            messages.info(request, "Rolling back to the previous release.")
+        else:
+            messages.error(request, f"Rollback failed: {res.get('message')}")
+    return redirect('settings')
@@ -0,0 +1,68 @@
+"""
+Process-wide cache of the SystemSettings singleton.
+
+Saving or deleting the settings bumps a version key in the shared cache, so
+other workers reload them on their next lookup instead of querying the table
+on every request.
+"""
+import threading
+import uuid
+
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import SystemSettings
+
+VERSION_KEY = "gridops:system-settings:version"
+
+_lock = threading.Lock()
+_version = None
+_settings = None
+# Sticky once onboarding is done: settings only go away with the whole
+# database (a checkpoint restore), which restarts the workers
+_configured = False
+
+
+def get():
+    """The SystemSettings row, or None before onboarding."""
+    global _version, _settings, _configured
+    version = cache.get(VERSION_KEY)
+    with _lock:
+        if version is not None and version == _version:
+            return _settings
+    settings = SystemSettings.objects.first()
+    if version is None:
+        # Cold shared cache (first worker up, or the cache was cleared)
+        version = uuid.uuid4().hex
+        if not cache.add(VERSION_KEY, version, timeout=None):
+            # Another worker got there first; its version may be newer than this read
+            return settings
+    with _lock:
+        _version, _settings = version, settings
+        _configured = _configured or settings is not None
+    return settings
+
+
+def is_configured():
+    """Whether onboarding has run; a memory lookup once it has."""
+    return _configured or get() is not None
+
+
+def base_domain():
+    settings = get()
+    return settings.domain if settings else "localhost"
+
+
+def invalidate():
+    global _version, _settings, _configured
+    cache.set(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+    with _lock:
+        _version = _settings = None
+        _configured = False
+
+
+@receiver(post_save, sender=SystemSettings)
+@receiver(post_delete, sender=SystemSettings)
+def settings_changed(sender, **kwargs):
+    invalidate()
@@ -1,7 +1,7 @@
 from django.test import TestCase, Client
 from django.contrib.auth import get_user_model
-from dashboard_app.models import App, CatalogItem
-from unittest.mock import patch, MagicMock
+from dashboard_app.models import App, AuditLog, CatalogItem
+from unittest.mock import patch, MagicMock, AsyncMock
 
 User = get_user_model()
 
@@ -38,7 +38,7 @@ class DashboardTests(TestCase):
         self.assertTemplateUsed(response, 'dashboard/catalog.html')
         self.assertContains(response, "Test App")
 
-    @patch('dashboard_app.views.ops')
+    @patch('dashboard_app.views.aops', new_callable=AsyncMock)
     def test_install_app(self, mock_ops):
         mock_ops.install_app.return_value = {"status": "success"}
 
@@ -57,3 +57,551 @@ class DashboardTests(TestCase):
 
         # Check if ops was called
         mock_ops.install_app.assert_called_once()
+
+    @patch('dashboard_app.views.ops')
+    @patch('dashboard_app.views.aops', new_callable=AsyncMock)
+    def test_install_app_runs_as_job(self, mock_aops, mock_ops):
+        mock_aops.install_app.return_value = {"status": "accepted", "job_id": "abc123"}
+
+        response = self.client.post(f'/install/{self.catalog_item.slug}/', {
+            'exposure': 'internal',
+            'domain_prefix': 'test-app'
+        })
+        self.assertRedirects(response, f'/app/{self.catalog_item.slug}/')
+        app = App.objects.get(slug=self.catalog_item.slug)
+        self.assertEqual(app.status, "installing")
+        self.assertEqual(app.current_job, "abc123")
+
+        # Still running: the progress partial keeps polling
+        mock_ops.job_output.return_value = {"status": "success", "next": 1, "job": {
+            "id": "abc123", "command": "install_app", "state": "running", "result": None},
+            "chunks": [{"seq": 0, "stream": "stdout", "data": "Pulling web\n"}]}
+        response = self.client.get(f'/app/{app.slug}/job/?since=0')
+        self.assertTemplateUsed(response, 'dashboard/partials/job_output.html')
+        self.assertContains(response, "Pulling web")
+        self.assertContains(response, "since=1")
+
+        # Finished: the App record is updated and the page refreshed
+        mock_ops.job_output.return_value = {"status": "success", "next": 1, "chunks": [], "job": {
+            "id": "abc123", "command": "install_app", "state": "succeeded", "result": {"status": "success"}}}
+        response = self.client.get(f'/app/{app.slug}/job/?since=1')
+        self.assertEqual(response['HX-Refresh'], 'true')
+        app.refresh_from_db()
+        self.assertEqual(app.status, "running")
+        self.assertEqual(app.current_job, "")
+        # Only this app's route is pushed, with the full Caddyfile as the snapshot
+        slug, host, route, caddyfile = mock_ops.update_route.call_args[0]
+        self.assertEqual((slug, host), (app.slug, "test-app.example.com"))
+        self.assertIn("example.com", caddyfile)
+        mock_ops.reload_proxy.assert_not_called()
+
+    @patch('dashboard_app.views.ops')
+    def test_job_outcome_does_not_depend_on_polling(self, mock_ops):
+        app = App.objects.create(name="Blog", slug="blog", icon="", version="1", image="ghost",
+                                 status="installing", current_job="job1")
+        # A transport error is not a lost job: keep polling
+        mock_ops.job_output.return_value = {"status": "error", "message": "Connection refused"}
+        response = self.client.get('/app/blog/job/?since=3')
+        self.assertTemplateUsed(response, 'dashboard/partials/job_output.html')
+        self.assertContains(response, "since=3")
+        app.refresh_from_db()
+        self.assertEqual((app.current_job, app.status), ("job1", "installing"))
+
+        # No tab polled it: the next page load applies the finished job
+        mock_ops.list_status.return_value = {"status": "error"}
+        mock_ops.list_jobs.return_value = {"status": "success", "jobs": [{
+            "id": "job1", "command": "install_app", "state": "succeeded", "result": {"status": "success"}}]}
+        self.client.get('/')
+        app.refresh_from_db()
+        self.assertEqual((app.current_job, app.status), ("", "running"))
+        mock_ops.update_route.assert_called_once()
+        self.assertEqual(AuditLog.objects.filter(action="install_app").count(), 1)
+
+        # A job the runner no longer knows fails the install instead of leaving it "installing"
+        App.objects.filter(pk=app.pk).update(status="installing", current_job="job2")
+        mock_ops.job_output.return_value = {"status": "error", "message": "Unknown job"}
+        response = self.client.get('/app/blog/job/?since=0')
+        self.assertEqual(response['HX-Refresh'], 'true')
+        app.refresh_from_db()
+        self.assertEqual((app.current_job, app.status), ("", "error"))
+
+    @patch('dashboard_app.views.ops')
+    def test_overview_syncs_live_status(self, mock_ops):
+        App.objects.create(name="Blog", slug="blog", icon="", version="1", image="ghost", status="running")
+        App.objects.create(name="Wiki", slug="wiki", icon="", version="1", image="wiki", status="stopped")
+        mock_ops.list_status.return_value = {"status": "success", "synced": True, "apps": {
+            "wiki": {"state": "running", "restarts": 2, "containers": [{"name": "wiki-web-1"}]},
+        }}
+
+        response = self.client.get('/')
+        self.assertContains(response, "2 restarts")
+        mock_ops.list_status.assert_called_once()
+        self.assertEqual(App.objects.get(slug="wiki").status, "running")
+        # No containers at all means the app is down
+        self.assertEqual(App.objects.get(slug="blog").status, "stopped")
+
+    @patch('dashboard_app.views.ops')
+    def test_bulk_restart(self, mock_ops):
+        App.objects.create(name="Blog", slug="blog", icon="", version="1", image="ghost", status="stopped")
+        App.objects.create(name="Wiki", slug="wiki", icon="", version="1", image="wiki", status="stopped")
+        mock_ops.batch.return_value = {"status": "accepted", "job_id": "batch1"}
+
+        response = self.client.post('/apps/bulk/restart/')
+        self.assertRedirects(response, '/', fetch_redirect_response=False)
+        items = mock_ops.batch.call_args[0][0]
+        self.assertEqual(sorted(items), [("blog", "restart"), ("wiki", "restart")])
+
+        mock_ops.job_output.return_value = {"status": "success", "next": 2, "chunks": [], "job": {
+            "id": "batch1", "command": "batch", "state": "failed", "result": {
+                "status": "error", "message": "1/2 succeeded", "results": [
+                    {"app_slug": "blog", "action": "restart", "status": "success"},
+                    {"app_slug": "wiki", "action": "restart", "status": "error"},
+                ]}}}
+        response = self.client.get('/apps/bulk/job/?since=2')
+        self.assertEqual(response['HX-Refresh'], 'true')
+        self.assertEqual(App.objects.get(slug="blog").status, "running")
+        self.assertEqual(App.objects.get(slug="wiki").status, "stopped")
+        self.assertNotIn('batch_job', self.client.session)
+
+    @patch('dashboard_app.views.ops')
+    @patch('dashboard_app.views.aops', new_callable=AsyncMock)
+    def test_restore_snapshot(self, mock_aops, mock_ops):
+        App.objects.create(name="Blog", slug="blog", icon="", version="1", image="ghost", status="running")
+        mock_ops.list_backups.return_value = {"status": "success", "snapshots": [
+            {"id": "20261018T120000-ab12", "created_at": 1792324800, "stats": {"bytes_total": 2048}},
+        ]}
+        response = self.client.get('/app/blog/')
+        self.assertContains(response, 'value="20261018T120000-ab12"')
+
+        mock_aops.restore_app.return_value = {"status": "accepted", "job_id": "job9"}
+        response = self.client.post('/app/blog/restore/', {'snapshot': '20261018T120000-ab12'})
+        self.assertRedirects(response, '/app/blog/', fetch_redirect_response=False)
+        mock_aops.restore_app.assert_awaited_once_with("blog", "20261018T120000-ab12")
+        self.assertEqual(App.objects.get(slug="blog").current_job, "job9")
+
+    def test_app_route_matches_exposure(self):
+        from dashboard_app.caddy_utils import app_route
+        app = App.objects.create(name="Wiki", slug="wiki", icon="", version="1", image="wiki", status="running",
+                                 domain_prefix="wiki", ports=["3000:3000"], expose_vpn=True)
+        host, route = app_route(app)
+        self.assertEqual(host, "wiki.example.com")
+        vpn, deny = route["handle"][0]["routes"]
+        self.assertIn("remote_ip", vpn["match"][0])
+        self.assertEqual(vpn["handle"][0]["upstreams"], [{"dial": "localhost:3000"}])
+        self.assertEqual(deny["handle"][0]["status_code"], 403)
+
+        app.status = "stopped"
+        self.assertEqual(app_route(app), ("wiki.example.com", None))
+
+    def test_caddyfile_fragments_are_cached(self):
+        from dashboard_app import caddy_utils
+        App.objects.create(name="Wiki", slug="wiki", icon="", version="1", image="wiki", status="running",
+                           domain_prefix="wiki", ports=["3000:3000"], expose_public=True)
+        caddy_utils._fragments.clear()
+        with patch.object(caddy_utils, 'render_app_block', wraps=caddy_utils.render_app_block) as render:
+            first = caddy_utils.generate_caddyfile()
+            self.assertEqual(caddy_utils.generate_caddyfile(), first)
+            self.assertEqual(render.call_count, 1)
+        self.assertIn("wiki.example.com {\n\n    reverse_proxy localhost:3000\n}\n", first)
+
+    def test_replicas_are_load_balanced(self):
+        from dashboard_app import caddy_utils
+        app = App.objects.create(name="Wiki", slug="wiki", icon="", version="1", image="wiki", status="running",
+                                 domain_prefix="wiki", ports=["127.0.0.1:3000:80/tcp"], expose_public=True,
+                                 web_service="web", web_port=80, replicas=3, health_path="/healthz")
+        # Host proxy: one published port per replica
+        self.assertEqual(caddy_utils.app_upstreams(app), ["localhost:3000", "localhost:3001", "localhost:3002"])
+        with self.settings(PROXY_ON_APP_NETWORK=True):
+            self.assertEqual(caddy_utils.app_upstreams(app), ["wiki-web-1:80", "wiki-web-2:80", "wiki-web-3:80"])
+            _, route = caddy_utils.app_route(app)
+            proxy = route["handle"][0]["routes"][0]["handle"][0]
+            self.assertEqual(len(proxy["upstreams"]), 3)
+            self.assertEqual(proxy["load_balancing"]["selection_policy"]["policy"], "least_conn")
+            self.assertEqual(proxy["health_checks"]["active"]["uri"], "/healthz")
+            caddyfile = caddy_utils.generate_caddyfile()
+        self.assertIn("reverse_proxy wiki-web-1:80 wiki-web-2:80 wiki-web-3:80 {\n"
+                      "        lb_policy least_conn\n        health_uri /healthz\n", caddyfile)
+
+    @patch('dashboard_app.views.ops')
+    @patch('dashboard_app.views.aops', new_callable=AsyncMock)
+    def test_scale_app(self, mock_aops, mock_ops):
+        self.catalog_item.docker_compose_template = (
+            "services:\n  db:\n    image: postgres\n  web:\n    image: nginx\n    ports:\n      - \"8080:80\"\n")
+        self.catalog_item.save()
+        mock_aops.install_app.return_value = {"status": "success"}
+        self.client.post(f'/install/{self.catalog_item.slug}/', {'exposure': 'public'})
+        app = App.objects.get(slug=self.catalog_item.slug)
+        self.assertEqual((app.web_service, app.web_port, app.ports), ("web", 80, ["8080:80"]))
+        web = mock_aops.install_app.call_args[0][3]
+        self.assertEqual(web, {"service": "web", "port": 80, "host_port": 8080, "replicas": 1, "ports": ["8080:80"]})
+
+        mock_aops.scale_app.return_value = {"status": "success", "replicas": 4}
+        response = self.client.post(f'/app/{app.slug}/scale/', {'replicas': '4'})
+        self.assertRedirects(response, f'/app/{app.slug}/')
+        self.assertEqual(mock_aops.scale_app.call_args[0][1]["replicas"], 4)
+        app.refresh_from_db()
+        self.assertEqual(app.replicas, 4)
+        _, _, route, _ = mock_ops.update_route.call_args[0]
+        self.assertEqual(len(route["handle"][0]["routes"][-1]["handle"][0]["upstreams"]), 4)
+
+        self.client.post(f'/app/{app.slug}/scale/', {'replicas': '99'})
+        self.assertEqual(mock_aops.scale_app.call_count, 1)
+
+        # Replicas take 8080-8085: another app on 8085 is in the way
+        App.objects.create(name="Other", slug="other", icon="", version="1", image="x", status="running",
+                           domain_prefix="other", ports=["8085:80"])
+        response = self.client.post(f'/app/{app.slug}/scale/', {'replicas': '6'}, follow=True)
+        self.assertContains(response, "Host port(s) 8085 are already used by Other.")
+        self.assertEqual(mock_aops.scale_app.call_count, 1)
+        # A web service with other fixed host ports can't be replicated at all
+        app.ports = ["8080:80", "8443:443"]
+        app.save()
+        response = self.client.post(f'/app/{app.slug}/scale/', {'replicas': '2'}, follow=True)
+        self.assertContains(response, "publishes fixed host port(s) 8443 besides its web port")
+        self.assertEqual(mock_aops.scale_app.call_count, 1)
+
+    @patch('dashboard_app.views.ops')
+    def test_edge_profile_rendered_into_route(self, mock_ops):
+        from dashboard_app import caddy_utils
+        mock_ops.update_route.return_value = {"status": "success"}
+        app = App.objects.create(name="Wiki", slug="wiki", icon="", version="1", image="wiki", status="running",
+                                 domain_prefix="wiki", ports=["3000:3000"], expose_public=True)
+        response = self.client.post(f'/app/{app.slug}/edge/', {'preset': 'web'})
+        self.assertRedirects(response, f'/app/{app.slug}/')
+        app.refresh_from_db()
+        self.assertEqual(caddy_utils.edge_preset(app), "web")
+
+        _, _, route, caddyfile = mock_ops.update_route.call_args[0]
+        encode, static, proxy = route["handle"][0]["routes"]
+        self.assertEqual(encode["handle"][0]["prefer"], ["zstd", "gzip"])
+        self.assertIn("/static/*", static["match"][0]["path"])
+        self.assertEqual(proxy["handle"][0]["transport"]["keep_alive"]["max_idle_conns_per_host"], 32)
+        self.assertIn("    encode zstd gzip\n    @static path /static/*", caddyfile)
+        self.assertIn('Cache-Control "public, max-age=86400"', caddyfile)
+        self.assertIn("keepalive_idle_conns_per_host 32", caddyfile)
+
+        # Malformed settings never reach the proxy config
+        app.edge_profile = {"encode": ["br", "gzip"], "static_paths": ["/x {"], "flush_interval": "soon"}
+        self.assertEqual(caddy_utils.edge_profile(app), {"encode": ["gzip"]})
+        app.edge_profile = {"flush_interval": "-1"}
+        _, route = caddy_utils.app_route(app)
+        self.assertEqual(route["handle"][0]["routes"][0]["handle"][0]["flush_interval"], -1)
+
+    def test_stats_read_from_sampler(self):
+        import tempfile, time
+        from ops import metrics
+        from dashboard_app import metrics as dashboard_metrics
+        with tempfile.TemporaryDirectory() as tmp:
+            path = f"{tmp}/metrics"
+            writer = metrics.MetricsWriter(path)
+            now = time.time()
+            for i in range(10):
+                writer.write(now - (9 - i) * 5, [10.0 + i, 40.0, 60.0, 0.5])
+            with patch.object(dashboard_metrics, 'reader', metrics.MetricsReader(path)), \
+                    patch('dashboard_app.metrics.psutil') as psutil:
+                response = self.client.get('/stats/')
+                self.assertEqual(response.context['cpu'], 19.0)
+                self.assertEqual(response.context['ram'], 40.0)
+                self.assertTrue(response.context['cpu_trend'])
+                psutil.cpu_percent.assert_not_called()
+
+                response = self.client.get('/stats/history/?resolution=raw&limit=3')
+                self.assertEqual([s['cpu'] for s in response.json()['samples']], [17.0, 18.0, 19.0])
+            self.assertEqual(self.client.get('/stats/history/?resolution=2m').status_code, 400)
+
+    def test_live_stream_pushes_deltas(self):
+        import asyncio, json
+        from dashboard_app import live
+
+        samples = [
+            {"host.cpu": 10.0, "host.ram": 40.0, "app.test-app": {"state": "running", "restarts": 0}},
+            {"host.cpu": 10.0, "host.ram": 40.0, "app.test-app": {"state": "running", "restarts": 0}},
+            {"host.cpu": 12.0, "host.ram": 40.0, "app.test-app": {"state": "restarting", "restarts": 1}},
+        ]
+
+        async def scenario():
+            broadcaster = live.Broadcaster(interval=3600)
+            broadcaster.collect = AsyncMock(return_value=samples[0])
+            stream = live.event_stream(broadcaster, heartbeat=1)
+            self.assertTrue((await anext(stream)).startswith("retry:"))
+            first = await anext(stream)
+            broadcaster.publish(samples[1])
+            broadcaster.publish(samples[2])
+            second = await anext(stream)
+            await stream.aclose()
+            return broadcaster, first, second
+
+        broadcaster, first, second = asyncio.run(scenario())
+        self.assertTrue(first.startswith("event: update\n"))
+        self.assertEqual(json.loads(first.split("data: ")[1])["host.cpu"], 10.0)
+        # Unchanged values are not resent
+        self.assertEqual(json.loads(second.split("data: ")[1]),
+                         {"host.cpu": 12.0, "app.test-app": {"state": "restarting", "restarts": 1}})
+        # The producer stops with its last listener
+        self.assertFalse(broadcaster.clients)
+        self.assertIsNone(broadcaster.task)
+
+        # A client that falls behind gets the latest value per key, not a backlog
+        subscription = live.Subscription({})
+        for cpu in (1.0, 2.0, 3.0):
+            subscription.offer({"host.cpu": cpu})
+        self.assertEqual(subscription.take(), {"host.cpu": 3.0})
+        self.assertFalse(subscription.ready.is_set())
+
+        response = self.client.get('/live/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertTrue(response.streaming)
+
+    @patch('dashboard_app.views.ops')
+    def test_app_details_shows_container_usage(self, mock_ops):
+        import tempfile
+        from ops import container_stats, metrics
+        from dashboard_app import metrics as dashboard_metrics
+        App.objects.create(name="Blog", slug="blog", icon="", version="1", image="ghost", status="running")
+        mock_ops.list_backups.return_value = {"status": "success", "snapshots": []}
+        with tempfile.TemporaryDirectory() as tmp:
+            path = f"{tmp}/app-metrics"
+            writer = metrics.MetricsWriter(path, container_stats.APP_LAYOUT)
+            writer.write(1000, [1.0, 1.0, 0, 0, 0, 0], writer.assign("wiki"))
+            for i in range(5):
+                writer.write(1000 + i * 5, [12.5, 64 << 20, 2048, 0, 0, 0], writer.assign("blog"))
+            reader = metrics.MetricsReader(path, layout=container_stats.APP_LAYOUT)
+            with patch.object(dashboard_metrics, 'app_reader', reader):
+                response = self.client.get('/app/blog/')
+                self.assertContains(response, "Resource Usage")
+                self.assertEqual(response.context['usage']['cpu']['now'], 12.5)
+                self.assertContains(response, "64.0\xa0MB")
+                self.assertEqual(self.client.get('/app/wiki/').status_code, 404)
+        response = self.client.get('/app/blog/')
+        self.assertNotContains(response, "Resource Usage")
+
+    def test_system_settings_are_cached(self):
+        from django.core.cache import cache
+        from dashboard_app import site_settings
+        from dashboard_app.models import SystemSettings
+        self.assertEqual(site_settings.get().domain, "example.com")
+        with self.assertNumQueries(0):
+            self.assertTrue(site_settings.is_configured())
+            self.assertEqual(site_settings.base_domain(), "example.com")
+
+        settings = SystemSettings.objects.get()
+        settings.domain = "new.example.com"
+        settings.save()
+        self.assertEqual(site_settings.base_domain(), "new.example.com")
+
+        # Another worker's save only reaches this one through the version key
+        SystemSettings.objects.update(domain="other.example.com")
+        self.assertEqual(site_settings.base_domain(), "new.example.com")
+        cache.set(site_settings.VERSION_KEY, "bumped-elsewhere")
+        self.assertEqual(site_settings.base_domain(), "other.example.com")
+
+        SystemSettings.objects.all().delete()
+        self.assertRedirects(self.client.get('/'), '/onboarding/', fetch_redirect_response=False)
+
+    def test_catalog_sync_writes_only_changes(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from dashboard_app.catalog import sync_catalog
+        entries = [{
+            "name": f"App {i}", "slug": f"app-{i}", "description": "An app",
+            "docker_compose_template": f"services:\n  web:\n    image: app{i}",
+        } for i in range(5000)]
+        changes = sync_catalog(entries)
+        self.assertEqual(len(changes['created']), 5000)
+        self.assertEqual(changes['deleted'], ["test-app"])
+
+        entries[1]["description"] = "A better app"
+        del entries[2]
+        entries.append({"name": "New", "slug": "new", "description": "",
+                        "docker_compose_template": "services:\n  web:\n    image: new"})
+        entries.append({"name": "Broken", "slug": "broken", "description": "", "docker_compose_template": "x: ["})
+        with CaptureQueriesContext(connection) as queries:
+            changes = sync_catalog(entries)
+        invalid = changes.pop('invalid')
+        self.assertEqual(changes, {'created': ["new"], 'updated': ["app-1"], 'deleted': ["app-2"], 'unchanged': 4998})
+        self.assertIn("Invalid YAML", invalid["broken"])
+        # Read hashes, insert, update, delete: not a round-trip per entry
+        self.assertLess(len(queries), 10)
+        self.assertEqual(CatalogItem.objects.get(slug="app-1").description, "A better app")
+        self.assertEqual(CatalogItem.objects.count(), 5000)
+
+        with self.assertNumQueries(3):  # savepoint, hash read, release
+            self.assertEqual(sync_catalog(entries)['unchanged'], 5000)
+        self.assertEqual(CatalogItem.objects.get(slug="new").images, {"web": "new"})
+
+    def test_catalog_web_service_fields(self):
+        from dashboard_app.catalog import sync_catalog
+        template = (
+            "services:\n  db:\n    image: postgres:16\n    ports:\n      - \"5432:5432\"\n"
+            "  proxy:\n    image: npm\n    ports:\n      - \"80:80\"\n      - \"81:81\"\n"
+        )
+        entries = [
+            {"name": "Guessed", "slug": "guessed", "description": "", "docker_compose_template": template},
+            {"name": "Named", "slug": "named", "description": "", "docker_compose_template": template,
+             "web_service": "proxy", "web_port": 81},
+            {"name": "Unknown", "slug": "unknown", "description": "", "docker_compose_template": template,
+             "web_service": "web"},
+        ]
+        changes = sync_catalog(entries)
+        # Without the fields: the first service publishing ports
+        guessed = CatalogItem.objects.get(slug="guessed")
+        self.assertEqual((guessed.web_service, guessed.web_port, guessed.ports), ("db", 5432, ["5432:5432"]))
+        named = CatalogItem.objects.get(slug="named")
+        self.assertEqual((named.web_service, named.web_port, named.ports), ("proxy", 81, ["80:80", "81:81"]))
+        self.assertIn("'web' is not in the template", changes['invalid']['unknown'])
+
+        entries[1]["web_port"] = 80
+        self.assertEqual(sync_catalog(entries)['updated'], ["named"])
+        self.assertEqual(CatalogItem.objects.get(slug="named").web_port, 80)
+
+    def test_catalog_search_facets_and_pages(self):
+        from dashboard_app import catalog
+        entries = [{
+            "name": f"App {i:03}", "slug": f"app-{i}", "category": "Media" if i % 3 else "Dev",
+            "description": "Photo gallery" if i % 10 == 0 else "Something else",
+            "docker_compose_template": "services:\n  web:\n    image: app\n# " + "x" * 10_000,
+        } for i in range(60)]
+        catalog.sync_catalog(entries)
+
+        response = self.client.get('/catalog/')
+        self.assertEqual(len(response.context['catalog']), catalog.PAGE_SIZE)
+        self.assertEqual(dict(response.context['facets']), {"Dev": 20, "Media": 40})
+        self.assertNotIn('docker_compose_template', response.context['catalog'][0])
+
+        # Prefix search over description, facets follow the matches
+        response = self.client.get('/catalog/?q=phot')
+        self.assertEqual([c['slug'] for c in response.context['catalog']], [f"app-{i}" for i in range(0, 60, 10)])
+        self.assertEqual(dict(response.context['facets']), {"Dev": 2, "Media": 4})
+        response = self.client.get('/catalog/?q=gallery&category=Dev')
+        self.assertEqual([c['slug'] for c in response.context['catalog']], ["app-0", "app-30"])
+
+        # Cursor pages cover everything once, in name order
+        seen, cursor = [], ""
+        while True:
+            response = self.client.get(f'/catalog/?cursor={cursor}', HTTP_HX_REQUEST='true')
+            seen += [c['slug'] for c in response.context['catalog']]
+            cursor = response.context['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(seen, [f"app-{i}" for i in range(60)])
+        self.assertTemplateUsed(response, 'dashboard/partials/catalog_page.html')
+
+        # A re-import reloads only what changed, without a full rebuild
+        entries[5]["name"] = "Zebra"
+        with patch.object(catalog.index, '_add', wraps=catalog.index._add) as add:
+            catalog.sync_catalog(entries[:50])
+            response = self.client.get('/catalog/?q=zebra')
+            self.assertEqual(add.call_count, 1)
+        self.assertEqual([c['slug'] for c in response.context['catalog']], ["app-5"])
+        self.assertEqual(sum(count for _, count in response.context['facets']), 1)
+        self.assertEqual(len(catalog.index.cards), 50)
+
+    @patch('dashboard_app.views.aops', new_callable=AsyncMock)
+    def test_install_renders_parsed_template(self, mock_aops):
+        from dashboard_app import compose
+        mock_aops.install_app.return_value = {"status": "accepted", "job_id": "job1"}
+        template = (
+            "services:\n"
+            "  db:\n    image: postgres:16\n    volumes:\n      - ./db:/var/lib/postgresql/data\n"
+            "  web:\n    image: ghcr.io/acme/wiki:${TAG:-2.5}\n"
+            "    environment:\n      - ADMIN_PASSWORD=${ADMIN_PASSWORD:?set a password}\n      - HOME=$$HOME\n"
+            "    ports:\n      - \"${PORT:-8080}:3000\"\n"
+        )
+        item = CatalogItem.objects.create(
+            name="Wiki", slug="wiki", description="", docker_compose_template=template,
+            form_schema=[{"name": "ADMIN_PASSWORD", "label": "Password"}, {"name": "PORT", "default": "9000"}],
+        )
+        # Parsed when saved, as on import
+        self.assertEqual(item.images, {"db": "postgres:16", "web": "ghcr.io/acme/wiki:${TAG:-2.5}"})
+        self.assertEqual((item.web_service, item.web_port), ("web", 3000))
+        self.assertEqual(item.required_vars, ["ADMIN_PASSWORD"])
+
+        response = self.client.post('/install/wiki/', {'exposure': 'public'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(App.objects.filter(slug="wiki").exists())
+
+        self.client.post('/install/wiki/', {'exposure': 'public', 'env_ADMIN_PASSWORD': 'pa$s'})
+        # Compose interpolates the unchanged template from the .env
+        compose_content, env_content = mock_aops.install_app.call_args[0][1:3]
+        self.assertEqual(compose_content, template)
+        self.assertEqual(env_content, 'ADMIN_PASSWORD="pa\\$s"\nPORT="9000"\n')
+        app = App.objects.get(slug="wiki")
+        self.assertEqual((app.image, app.version), ("ghcr.io/acme/wiki:2.5", "2.5"))
+        self.assertEqual(app.ports, ["9000:3000"])
+        self.assertEqual(app.volumes, ["./db:/var/lib/postgresql/data"])
+        self.assertEqual((app.web_service, app.web_port), ("web", 3000))
+        self.assertIs(compose.renderer(template), compose.renderer(template))
+
+        with self.assertRaises(compose.TemplateError):
+            compose.template_metadata("services:\n  web:\n    image: x\n    command: ${SECRET}\n")
+
+    def test_template_metadata_reads_anchors_and_tags(self):
+        from dashboard_app import compose
+        template = (
+            "x-base: &base\n  image: nginx:1\n  ports: [\"8080:80\"]\n"
+            "services:\n"
+            "  web:\n    <<: *base\n    volumes:\n      - {type: bind, source: ./data, target: /data}\n"
+            "  worker:\n    <<: [*base]\n    image: ~\n"
+        )
+        with self.assertRaisesMessage(compose.TemplateError, "'worker' has no image"):
+            compose.template_metadata(template)
+        metadata = compose.template_metadata(template.replace("image: ~", "image: worker:2\n    ports: !reset []"))
+        self.assertEqual(metadata['images'], {"web": "nginx:1", "worker": "worker:2"})
+        self.assertEqual((metadata['web_service'], metadata['web_port'], metadata['ports']), ("web", 80, ["8080:80"]))
+        self.assertEqual(metadata['volumes'], ["./data:/data"])
+        for broken in ("services: [", "services:\n  ? [a]\n  : {image: x}\n", "services:\n  web:\n    <<: 1\n"):
+            with self.assertRaises(compose.TemplateError):
+                compose.template_metadata(broken)
+
+    def test_template_loader_resolves_like_safe_loader(self):
+        import yaml
+        from dashboard_app import compose
+        template = (
+            "services:\n"
+            "  web: &web\n    image: \"null\"\n"
+            "  api:\n    <<: *web\n    ports: ['~', \"\", null, ~, Null, NULL, '<<', 8080]\n"
+            "    volumes:\n      \"<<\": {image: x}\n"
+            "  db:\n    <<: [*web]\n    image: ''\n"
+            "  cache:\n    image:\n"
+        )
+        services = compose.template_services(template)
+        self.assertEqual(services, {
+            "web": {"image": "null", "ports": None, "volumes": None},
+            "api": {"image": "null", "ports": ["~", "", None, None, None, None, "<<", "8080"],
+                    "volumes": {"<<": {"image": "x"}}},
+            "db": {"image": "", "ports": None, "volumes": None},
+            "cache": {"image": None, "ports": None, "volumes": None},
+        })
+        # The trimmed resolver gives the same nodes as PyYAML's own
+        with patch('dashboard_app.compose.TemplateLoader', yaml.SafeLoader):
+            self.assertEqual(compose.template_services(template), services)
+
+    @patch('dashboard_app.views.aops', new_callable=AsyncMock)
+    def test_install_values_stay_data(self, mock_aops):
+        from dashboard_app import compose
+        mock_aops.install_app.return_value = {"status": "accepted", "job_id": "job1"}
+        template = (
+            "services:\n  web:\n    image: ghcr.io/acme/wiki:2.5\n"
+            "    environment:\n      - TITLE=${TITLE}\n      - NOTE=${NOTE}\n"
+            "    command: ${FLAG}\n    ports:\n      - \"8080:3000\"\n"
+        )
+        CatalogItem.objects.create(
+            name="Wiki", slug="wiki", description="", docker_compose_template=template,
+            form_schema=[{"name": "TITLE"}, {"name": "NOTE"}, {"name": "FLAG"}],
+        )
+        values = {'TITLE': 'a: b # not a comment', 'NOTE': 'say "hi" it\'s \\ $HOME', 'FLAG': '!x'}
+        self.client.post('/install/wiki/', {'exposure': 'internal', **{f'env_{k}': v for k, v in values.items()}})
+        compose_content, env_content = mock_aops.install_app.call_args[0][1:3]
+        # None of the values is pasted into the YAML
+        self.assertEqual(compose_content, template)
+        self.assertEqual(env_content.splitlines(), [
+            'TITLE="a: b # not a comment"',
+            'NOTE="say \\"hi\\" it\'s \\\\ \\$HOME"',
+            'FLAG="!x"',
+        ])
+        self.assertEqual(App.objects.get(slug="wiki").env_vars, values)
+
+        with self.assertRaises(compose.TemplateError):
+            compose.env_file({'BAD\nNAME': 'x'})
+        with self.assertRaises(compose.TemplateError):
+            compose.env_file({'TITLE': 'two\nlines'})
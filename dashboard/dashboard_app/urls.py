@@ -8,8 +8,18 @@ urlpatterns = [
     path('catalog/', views.app_catalog, name='catalog'),
     path('install/<slug:slug>/', views.install_app, name='install_app'),
     path('app/<slug:slug>/', views.app_details, name='app_details'),
+    path('app/<slug:slug>/job/', views.app_job, name='app_job'),
+    path('app/<slug:slug>/restore/', views.app_restore, name='app_restore'),
+    path('app/<slug:slug>/scale/', views.app_scale, name='app_scale'),
+    path('app/<slug:slug>/edge/', views.app_edge, name='app_edge'),
     path('app/<slug:slug>/<str:action>/', views.app_control, name='app_control'),
+    path('apps/bulk/job/', views.batch_job, name='batch_job'),
+    path('apps/bulk/<str:action>/', views.bulk_control, name='bulk_control'),
     path('stats/', views.system_stats, name='system_stats'),
+    path('stats/history/', views.system_history, name='system_history'),
+    path('live/', views.live_stream, name='live_stream'),
     path('settings/', settings_views.system_settings, name='settings'),
     path('settings/update/', settings_views.system_update, name='system_update'),
+    path('settings/rollback/', settings_views.system_rollback, name='system_rollback'),
+    path('settings/checkpoint/restore/', settings_views.system_restore_checkpoint, name='system_restore_checkpoint'),
 ]
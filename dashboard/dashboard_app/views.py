@@ -1,31 +1,81 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
-from django.http import HttpResponse, JsonResponse
-from .models import App, CatalogItem, SystemSettings, AuditLog
-# from ops.client import OpsClient  # TODO: Implement ops client
-
-class OpsClient:
-    def reload_proxy(self, caddyfile):
-        return {"status": "success"}
-    
-    def install_app(self, slug, compose_content, env_str):
-        return {"status": "success"}
-    
-    def control_app(self, slug, action):
-        return {"status": "success"}
-from .caddy_utils import generate_caddyfile
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from .models import App, CatalogItem, AuditLog
+from .ops import aops, ops
+from . import catalog, site_settings
+from .caddy_utils import EDGE_PRESETS, app_route, edge_preset, generate_caddyfile, host_ports, upstream_port
+from .compose import (TemplateError, env_file, fixed_host_port, image_version, parse_port, render_template,
+                      renderer, template_metadata)
+from .live import event_stream
+from .metrics import RESOLUTIONS, app_trends, host_history, host_stats, host_trends
 from .forms import OnboardingForm
 from django.contrib.auth.models import User
 from django.contrib.auth import login
 import json
-import psutil
 import datetime
 
-ops = OpsClient()
+# App.status for each aggregate container state reported by the runner
+LIVE_STATUS = {
+    "running": "running",
+    "stopped": "stopped",
+    "partial": "error",
+    "restarting": "error",
+    "unhealthy": "error",
+}
+
+BULK_ACTIONS = ['restart', 'pull', 'stop']
+
+# Matches the runner's limit
+MAX_REPLICAS = 16
+
+# Templates read request.user lazily, which must not happen on the event loop
+arender = sync_to_async(render)
+
+# App status once a runner job for that command has succeeded
+JOB_SUCCESS_STATUS = {
+    "install_app": "running",
+    "start_app": "running",
+    "restart_app": "running",
+    "stop_app": "stopped",
+    "restore_app": "running",
+    "scale_app": "running",
+}
+FINISHED_STATES = ("succeeded", "failed", "cancelled")
+
+def app_web(app, replicas=None):
+    """The app's web service as the runner takes it; None for apps without one."""
+    if not app.web_service:
+        return None
+    return {
+        "service": app.web_service,
+        "port": app.web_port,
+        "host_port": upstream_port(app),
+        "replicas": replicas or app.replicas,
+        "ports": list(app.ports or []),
+    }
+
+async def replica_port_error(app, replicas):
+    """Why the app can't run `replicas` replicas on its host ports; None if it can."""
+    if replicas < 2 or upstream_port(app) is None:
+        return None
+    others = sorted({fixed_host_port(spec) for spec in app.ports[1:]} - {None})
+    if others:
+        # Every replica would need the same fixed port
+        return (f"{app.name} publishes fixed host port(s) {', '.join(map(str, others))} "
+                f"besides its web port, so it can't run more than one replica.")
+    wanted = host_ports(app, replicas)
+    async for other in App.objects.exclude(pk=app.pk).only('name', 'ports', 'replicas'):
+        clash = wanted & host_ports(other)
+        if clash:
+            return f"Host port(s) {', '.join(map(str, sorted(clash)))} are already used by {other.name}."
+    return None
 
 def onboarding(request):
-    if SystemSettings.objects.exists():
+    if site_settings.is_configured():
         return redirect('overview')
 
     if request.method == "POST":
@@ -55,33 +105,105 @@ def onboarding(request):
 
     return render(request, 'dashboard/onboarding.html', {'form': form})
 
+def sync_live_status(apps):
+    """
+    Attach runner-reported container state to each app (as `app.live`) and
+    persist status changes. One runner call covers every app.
+    """
+    res = ops.list_status()
+    live = res.get("apps") if res.get("status") == "success" and res.get("synced") else None
+    if live is None:
+        return
+
+    changed = []
+    for app in apps:
+        app.live = live.get(app.slug)
+        # Installs and in-flight commands own the status until they finish
+        if app.current_job or app.status == "installing":
+            continue
+        status = LIVE_STATUS.get(app.live["state"]) if app.live else "stopped"
+        if status and status != app.status:
+            app.status = status
+            changed.append(app)
+    if changed:
+        App.objects.bulk_update(changed, ["status"])
+
+def finish_app_job(request, app, job):
+    """
+    Apply the app's finished job, or None for one the runner lost. Only the
+    request that clears current_job applies it, so a polling tab and a page
+    load never apply the same job twice.
+    """
+    if not App.objects.filter(pk=app.pk, current_job=app.current_job).update(current_job=""):
+        return
+    app.current_job = ""
+    if job is not None:
+        complete_job(request, app, job["command"], job["result"] or {})
+        return
+    if app.status == "installing":
+        # Nothing else moves an app out of "installing"
+        app.status = "error"
+        app.save(update_fields=["status"])
+    messages.warning(request, f"Lost track of the running command for {app.name}.")
+
+def reconcile_jobs(request, apps):
+    """
+    Apply the jobs that finished, or that the runner lost, while no tab was
+    polling them: one runner call for every app with a job in flight.
+    """
+    pending = [app for app in apps if app.current_job]
+    if not pending:
+        return
+    res = ops.list_jobs()
+    if res.get("status") != "success":
+        # Runner unreachable: the jobs may still be running
+        return
+    known = {job["id"]: job for job in res.get("jobs", [])}
+    for app in pending:
+        job = known.get(app.current_job)
+        if job is None or job["state"] in FINISHED_STATES:
+            finish_app_job(request, app, job)
+
 @login_required
 def dashboard_overview(request):
-    apps = App.objects.all()
-    # Mock system stats for now, real implementation would polling or websocket
-    cpu_usage = psutil.cpu_percent()
-    ram_usage = psutil.virtual_memory().percent
-    disk_usage = psutil.disk_usage('/').percent
+    apps = list(App.objects.all())
+    reconcile_jobs(request, apps)
+    sync_live_status(apps)
 
     return render(request, 'dashboard/overview.html', {
         'apps': apps,
-        'cpu': cpu_usage,
-        'ram': ram_usage,
-        'disk': disk_usage,
+        'batch_job': request.session.get('batch_job'),
+        'bulk_actions': BULK_ACTIONS,
+        **host_stats(),
     })
 
 @login_required
 def app_catalog(request):
-    catalog = CatalogItem.objects.all()
-    return render(request, 'dashboard/catalog.html', {'catalog': catalog})
+    # Served from the in-memory index: no rows (or templates) loaded per view
+    query = request.GET.get('q', '').strip()
+    category = request.GET.get('category', '')
+    cards, facets, next_cursor = catalog.index.search(query, category, request.GET.get('cursor', ''))
+    context = {
+        'catalog': cards,
+        'facets': facets,
+        'query': query,
+        'category': category,
+        'next_cursor': next_cursor,
+    }
+    if request.headers.get('HX-Request'):
+        # Search box and "Load more" only swap the results
+        template = 'dashboard/partials/catalog_page.html' if request.GET.get('cursor') else 'dashboard/partials/catalog_results.html'
+        return render(request, template, context)
+    return render(request, 'dashboard/catalog.html', context)
 
 @login_required
-def install_app(request, slug):
-    item = get_object_or_404(CatalogItem, slug=slug)
+async def install_app(request, slug):
+    item = await aget_object_or_404(CatalogItem, slug=slug)
 
     if request.method == "POST":
-        # Process installation
-        env_vars = {}
+        # Process installation: form defaults, then what was submitted
+        env_vars = {field["name"]: "" if field.get("default") is None else str(field["default"])
+                    for field in item.form_schema or [] if isinstance(field, dict) and field.get("name")}
         for key in request.POST:
             if key.startswith("env_"):
                 env_vars[key[4:]] = request.POST[key]
@@ -90,84 +212,348 @@ def install_app(request, slug):
         exposure = request.POST.get("exposure", "internal")
         domain_prefix = request.POST.get("domain_prefix", slug)
 
-        # Generate Compose
-        compose_content = item.docker_compose_template # Simple for now, needs templating engine
+        if not item.images:
+            # Imported before templates were parsed at import time
+            try:
+                metadata = template_metadata(item.docker_compose_template, item.form_schema,
+                                             item.web_service, item.web_port)
+            except TemplateError as e:
+                messages.error(request, f"Invalid app template: {e}")
+                return await arender(request, 'dashboard/install.html', {'item': item})
+            await CatalogItem.objects.filter(pk=item.pk).aupdate(**metadata)
+            for field, value in metadata.items():
+                setattr(item, field, value)
 
-        # In a real scenario, we would replace ${VAR} in compose with env_vars
+        # Compose gets the template as is and interpolates it from the .env;
+        # the record's metadata goes through the template's compiled renderer
+        missing = [name for name in item.required_vars if not env_vars.get(name)]
+        try:
+            if missing:
+                raise TemplateError(f"Missing value for {', '.join(missing)}")
+            renderer(item.docker_compose_template).check(env_vars)
+            env_content = env_file(env_vars)
+            ports = [render_template(port, env_vars) for port in item.ports]
+            volumes = [render_template(volume, env_vars) for volume in item.volumes]
+            image = render_template(item.images.get(item.web_service) or next(iter(item.images.values())), env_vars)
+        except TemplateError as e:
+            messages.error(request, str(e))
+            return await arender(request, 'dashboard/install.html', {'item': item})
 
         # Create App record
-        app = App.objects.create(
+        app = await App.objects.acreate(
             name=item.name,
             slug=slug,
             icon=item.icon,
-            version="latest",
-            image="unknown", # parse from compose
+            version=image_version(image),
+            image=image,
             env_vars=env_vars,
             expose_public=(exposure == 'public'),
             expose_vpn=(exposure == 'vpn'),
             domain_prefix=domain_prefix,
+            ports=ports,
+            volumes=volumes,
+            web_service=item.web_service,
+            web_port=item.web_port or (parse_port(ports[0])[1] if ports else None),
+            edge_profile=dict(EDGE_PRESETS["web"]),
             status="installing"
         )
 
         # Trigger Install via Ops
-        env_str = "\n".join([f"{k}={v}" for k,v in env_vars.items()])
-        result = ops.install_app(slug, compose_content, env_str)
-
-        if result.get("status") == "success":
-            app.status = "running"
-            app.save()
-
-            # Update Proxy
-            caddyfile = generate_caddyfile()
-            ops.reload_proxy(caddyfile)
-
-            messages.success(request, f"{app.name} installed successfully!")
-
-            # Audit log
-            AuditLog.objects.create(
-                user=request.user,
-                action="install_app",
-                details=f"Installed {slug}",
-                ip_address=request.META.get('REMOTE_ADDR')
-            )
+        result = await aops.install_app(slug, item.docker_compose_template, env_content, app_web(app))
 
+        if result.get("status") == "accepted":
+            # Runner works in the background; app_details polls the job
+            app.current_job = result["job_id"]
+            await app.asave()
+            messages.info(request, f"Installing {app.name}...")
+            return redirect('app_details', slug=slug)
+        elif result.get("status") == "success":
+            await sync_to_async(complete_job)(request, app, "install_app", result)
             return redirect('app_details', slug=slug)
         else:
             app.status = "error"
-            app.save()
+            await app.asave()
             messages.error(request, f"Installation failed: {result.get('message')}")
 
-    return render(request, 'dashboard/install.html', {'item': item})
+    return await arender(request, 'dashboard/install.html', {'item': item})
 
 @login_required
 def app_details(request, slug):
     app = get_object_or_404(App, slug=slug)
-    return render(request, 'dashboard/app_details.html', {'app': app})
+    reconcile_jobs(request, [app])
+    # Snapshots live in the runner's backup store
+    result = ops.list_backups(slug)
+    snapshots = result.get("snapshots", []) if result.get("status") == "success" else []
+    for snapshot in snapshots:
+        snapshot["created"] = datetime.datetime.fromtimestamp(snapshot["created_at"])
+    return render(request, 'dashboard/app_details.html', {
+        'app': app,
+        'snapshots': list(reversed(snapshots)),
+        'edge_presets': list(EDGE_PRESETS),
+        'edge_preset': edge_preset(app),
+        'usage': app_trends(app.slug),
+    })
+
+def complete_job(request, app, command, result):
+    """Apply the outcome of a finished runner command to the App record."""
+    app.current_job = ""
+    if result.get("status") != "success":
+        if command == "install_app":
+            app.status = "error"
+        app.save()
+        messages.error(request, f"Command failed: {result.get('message') or result.get('stderr', '')}")
+        return
+
+    app.status = JOB_SUCCESS_STATUS.get(command, app.status)
+    if command == "scale_app":
+        app.replicas = result.get("replicas", app.replicas)
+    app.save()
+
+    if command in ("install_app", "scale_app"):
+        # Update Proxy: only this app's route changes, the Caddyfile is kept as a snapshot
+        host, route = app_route(app)
+        ops.update_route(app.slug, host, route, generate_caddyfile())
+    if command == "install_app":
+        messages.success(request, f"{app.name} installed successfully!")
+        details = f"Installed {app.slug}"
+    elif command == "scale_app":
+        messages.success(request, f"{app.name} now runs {app.replicas} replica(s).")
+        details = f"Scaled {app.slug} to {app.replicas}"
+    else:
+        action = command.split('_')[0]
+        stats = result.get("stats") or {}
+        if command == "restore_app":
+            messages.success(request, f"Restored snapshot {result.get('snapshot')}: "
+                                      f"{stats.get('bytes_written', 0) / 1e6:.1f} MB at "
+                                      f"{stats.get('throughput', 0) / 1e6:.1f} MB/s.")
+        else:
+            messages.success(request, f"{action.capitalize()} completed.")
+        details = f"{action} {app.slug}"
+
+    # Audit log
+    AuditLog.objects.create(
+        user=request.user,
+        action=command,
+        details=details,
+        ip_address=request.META.get('REMOTE_ADDR')
+    )
 
 @login_required
-def app_control(request, slug, action):
-    app = get_object_or_404(App, slug=slug)
-    if action in ['start', 'stop', 'restart', 'pull']:
-        result = ops.control_app(slug, action)
-        if result.get("status") == "success":
-            messages.success(request, f"{action.capitalize()} command sent.")
-            AuditLog.objects.create(
-                user=request.user,
-                action=f"{action}_app",
-                details=f"{action} {slug}",
-                ip_address=request.META.get('REMOTE_ADDR')
-            )
+async def app_control(request, slug, action):
+    app = await aget_object_or_404(App, slug=slug)
+    if action in ['start', 'stop', 'restart', 'pull', 'backup']:
+        if action == 'backup':
+            result = await aops.backup_app(slug)
+        else:
+            result = await aops.control_app(slug, action)
+        if result.get("status") == "accepted":
+            app.current_job = result["job_id"]
+            await app.asave()
+            messages.info(request, f"{action.capitalize()} command queued.")
+        elif result.get("status") == "success":
+            await sync_to_async(complete_job)(request, app, f"{action}_app", result)
         else:
              messages.error(request, f"Command failed: {result.get('message')}")
     return redirect('app_details', slug=slug)
 
 @login_required
-def system_stats(request):
-    # HTMX endpoint
-    cpu = psutil.cpu_percent()
-    ram = psutil.virtual_memory().percent
-    disk = psutil.disk_usage('/').percent
-
-    return render(request, 'dashboard/partials/stats.html', {
-        'cpu': cpu, 'ram': ram, 'disk': disk
+async def app_restore(request, slug):
+    app = await aget_object_or_404(App, slug=slug)
+    if request.method != "POST":
+        return redirect('app_details', slug=slug)
+    # The runner stops the app, restores the snapshot and starts it again
+    result = await aops.restore_app(slug, request.POST.get('snapshot'))
+    if result.get("status") == "accepted":
+        app.current_job = result["job_id"]
+        await app.asave()
+        messages.info(request, "Restore queued.")
+    elif result.get("status") == "success":
+        await sync_to_async(complete_job)(request, app, "restore_app", result)
+    else:
+        messages.error(request, f"Command failed: {result.get('message')}")
+    return redirect('app_details', slug=slug)
+
+@login_required
+async def app_scale(request, slug):
+    app = await aget_object_or_404(App, slug=slug)
+    if request.method != "POST":
+        return redirect('app_details', slug=slug)
+    try:
+        replicas = int(request.POST.get('replicas', ''))
+    except ValueError:
+        replicas = 0
+    if not 1 <= replicas <= MAX_REPLICAS:
+        messages.error(request, f"Replicas must be between 1 and {MAX_REPLICAS}.")
+        return redirect('app_details', slug=slug)
+    if not app.web_service:
+        messages.error(request, f"{app.name} has no web service to scale.")
+        return redirect('app_details', slug=slug)
+    error = await replica_port_error(app, replicas)
+    if error:
+        messages.error(request, error)
+        return redirect('app_details', slug=slug)
+
+    result = await aops.scale_app(slug, app_web(app, replicas))
+    if result.get("status") == "accepted":
+        app.current_job = result["job_id"]
+        await app.asave()
+        messages.info(request, f"Scaling to {replicas} replica(s)...")
+    elif result.get("status") == "success":
+        result.setdefault("replicas", replicas)
+        await sync_to_async(complete_job)(request, app, "scale_app", result)
+    else:
+        messages.error(request, f"Command failed: {result.get('message')}")
+    return redirect('app_details', slug=slug)
+
+@login_required
+def app_edge(request, slug):
+    app = get_object_or_404(App, slug=slug)
+    preset = request.POST.get('preset')
+    if request.method != "POST" or preset not in EDGE_PRESETS:
+        return redirect('app_details', slug=slug)
+    app.edge_profile = dict(EDGE_PRESETS[preset])
+    app.save()
+    host, route = app_route(app)
+    result = ops.update_route(app.slug, host, route, generate_caddyfile())
+    if result.get("status") in ("success", "accepted"):
+        messages.success(request, f"Edge profile set to {preset}.")
+    else:
+        messages.error(request, f"Proxy update failed: {result.get('message')}")
+    return redirect('app_details', slug=slug)
+
+def refresh_page():
+    response = HttpResponse()
+    response['HX-Refresh'] = 'true'
+    return response
+
+def job_progress(request, job_id, job_url, on_finish):
+    """
+    HTMX poll for a runner job: renders output since the `since` cursor, and
+    once the job has finished and its output is drained, hands the job to
+    on_finish and refreshes the page.
+    """
+    if request.method == "POST":
+        ops.cancel_job(job_id)
+
+    try:
+        since = int(request.GET.get('since', 0))
+    except ValueError:
+        since = 0
+
+    res = ops.job_output(job_id, since)
+    job = res.get("job")
+    if res.get("status") == "error" and res.get("message") == "Unknown job":
+        # Runner restarted or evicted the job; don't poll forever
+        on_finish(None)
+        return refresh_page()
+    if res.get("status") != "success" or job is None:
+        # Runner briefly unreachable: the job may still run, keep polling
+        return render(request, 'dashboard/partials/job_output.html', {
+            'job': {'state': 'unreachable'}, 'job_url': job_url, 'next': since,
+        })
+
+    finished = job["state"] in FINISHED_STATES
+    if finished and not res.get("chunks"):
+        on_finish(job)
+        return refresh_page()
+
+    return render(request, 'dashboard/partials/job_output.html', {
+        'job': job,
+        'job_url': job_url,
+        'output': "".join(chunk["data"] for chunk in res.get("chunks", [])),
+        'next': res.get("next", since),
+        'truncated': res.get("truncated") and since > 0,
     })
+
+@login_required
+def app_job(request, slug):
+    # HTMX endpoint: output and state of the app's in-flight runner job
+    app = get_object_or_404(App, slug=slug)
+    if not app.current_job:
+        return refresh_page()
+
+    return job_progress(request, app.current_job, reverse('app_job', args=[slug]),
+                        lambda job: finish_app_job(request, app, job))
+
+@login_required
+def bulk_control(request, action):
+    # Restart/pull/stop every installed app in one runner round-trip
+    if request.method != "POST" or action not in BULK_ACTIONS:
+        return redirect('overview')
+    slugs = list(App.objects.exclude(status="installing").values_list('slug', flat=True))
+    if not slugs:
+        messages.info(request, "No apps installed.")
+        return redirect('overview')
+
+    result = ops.batch([(slug, action) for slug in slugs])
+    if result.get("status") == "accepted":
+        request.session['batch_job'] = result["job_id"]
+        messages.info(request, f"{action.capitalize()} queued for {len(slugs)} apps.")
+    elif result.get("status") == "success":
+        complete_batch(request, action, result)
+    else:
+        messages.error(request, f"Command failed: {result.get('message')}")
+    return redirect('overview')
+
+def complete_batch(request, action, result):
+    succeeded = [r["app_slug"] for r in result.get("results", []) if r["status"] == "success"]
+    status = JOB_SUCCESS_STATUS.get(f"{action}_app")
+    if status and succeeded:
+        App.objects.filter(slug__in=succeeded).update(status=status)
+
+    if result.get("status") == "success":
+        messages.success(request, f"{action.capitalize()} completed for all apps.")
+    else:
+        messages.error(request, f"{action.capitalize()}: {result.get('message')}")
+
+    AuditLog.objects.create(
+        user=request.user,
+        action=f"batch_{action}",
+        details=f"{action} {', '.join(succeeded) or 'no apps'}",
+        ip_address=request.META.get('REMOTE_ADDR')
+    )
+
+@login_required
+def batch_job(request):
+    # HTMX endpoint: progress of the overview's bulk action
+    job_id = request.session.get('batch_job')
+    if not job_id:
+        return refresh_page()
+
+    def finish(job):
+        request.session.pop('batch_job', None)
+        if job is None:
+            messages.warning(request, "Lost track of the running command.")
+        else:
+            items = (job["result"] or {}).get("results") or [{}]
+            action = items[0].get("action", "batch")
+            complete_batch(request, action, job["result"] or {})
+
+    return job_progress(request, job_id, reverse('batch_job'), finish)
+
+@login_required
+async def system_stats(request):
+    # HTMX endpoint: read from the sampler's shared ring buffer
+    return await arender(request, 'dashboard/partials/stats.html', {**host_stats(), **host_trends()})
+
+@login_required
+async def live_stream(request):
+    # Server-Sent Events: host stats and app states, pushed only when they change
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx-style proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@login_required
+def system_history(request):
+    # Samples for history charts: raw, or 1m/5m/1h rollups
+    resolution = request.GET.get('resolution', '5m')
+    if resolution not in RESOLUTIONS:
+        return JsonResponse({"status": "error", "message": f"Unknown resolution {resolution!r}"}, status=400)
+    try:
+        limit = int(request.GET.get('limit', 0)) or None
+    except ValueError:
+        limit = None
+    return JsonResponse({"status": "success", "resolution": resolution,
+                         "samples": host_history(resolution, limit)})
@@ -126,6 +126,9 @@ services:
       - ./Caddyfile:/etc/caddy/Caddyfile
       - caddy_data:/data
       - caddy_config:/config
+    networks:
+      - default
+      - gridops
     restart: unless-stopped
 
   dashboard:
@@ -138,10 +141,11 @@ services:
       - REDIS_URL=redis://redis:6379/0
       - GRIDOPS_DOMAIN=$DOMAIN
       - GRIDOPS_EMAIL=$EMAIL
+      - GRIDOPS_PROXY_ON_APP_NETWORK=True
     depends_on:
       - postgres
       - redis
-    command: sh -c "python manage.py migrate && python manage.py collectstatic --noinput && gunicorn core.wsgi:application --bind 0.0.0.0:8000 --workers 3"
+    command: sh -c "python manage.py migrate && python manage.py collectstatic --noinput && gunicorn core.asgi:application -k uvicorn.workers.UvicornWorker --bind 0.0.0.0:8000 --workers 3"
     restart: unless-stopped
 
   postgres:
@@ -165,6 +169,11 @@ volumes:
   caddy_config:
   postgres_data:
   redis_data:
+
+networks:
+  # Shared with app containers, so Caddy reaches every replica by name
+  gridops:
+    external: true
 EOF
 
 # Create Caddyfile
@@ -195,7 +204,7 @@ COPY . .
 
 EXPOSE 8000
 
-CMD ["gunicorn", "core.wsgi:application", "--bind", "0.0.0.0:8000", "--workers", "3"]
+CMD ["gunicorn", "core.asgi:application", "-k", "uvicorn.workers.UvicornWorker", "--bind", "0.0.0.0:8000", "--workers", "3"]
 EOF
 
 # Setup firewall
@@ -210,6 +219,7 @@ ufw --force enable
 # Start services
 log "Starting GridOps services..."
 cd "$INSTALL_DIR"
+docker network inspect gridops > /dev/null 2>&1 || docker network create gridops > /dev/null || error_exit "Failed to create gridops network"
 docker-compose up -d || error_exit "Failed to start services"
 
 log "Installation complete!"
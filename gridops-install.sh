@@ -104,6 +104,10 @@ fi
 # Install requirements
 sudo -u gridops "venv/bin/pip" install -r dashboard/requirements.txt
 
+# Services run from the "current" release; until the first update installs
+# one under releases/, that is the install directory itself
+ln -sfn "$INSTALL_DIR" "$INSTALL_DIR/current"
+
 # 8. Setup Ops Runner
 # (Already copied via git clone/cp)
 
@@ -0,0 +1,551 @@
+"""
+Deduplicating snapshot store for app data.
+
+Files are split into content-defined chunks, so an edit in the middle of a
+file only changes the chunks around it. Every byte value stands for a fixed
+random 2-bit symbol and a chunk ends where the symbols of the last few bytes
+spell CUT_PATTERN; finding that is a bytes.translate and a bytes.find, both C
+loops, so cutting keeps up with the disk. Chunks are stored once under their
+SHA-256, compressed, and each snapshot is a JSON manifest listing the chunks
+of every file. Files whose size and mtime match the previous snapshot are not
+read at all.
+
+Layout under STORE_DIR:
+    chunks/ab/abcdef...      compressed chunk, named by SHA-256 of the raw data
+    snapshots/<name>/<id>.json
+    snapshots/<name>/<id>.summary   id, created_at and stats, for listing
+    lock                     shared by snapshots, exclusive for garbage collection
+"""
+import fcntl
+import hashlib
+import json
+import os
+import random
+import shutil
+import stat
+import tempfile
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+STORE_DIR = "/srv/gridops/backups/store"
+
+MIN_CHUNK = 256 * 1024
+MAX_CHUNK = 4 * 1024 * 1024
+# 20 bits -> ~1 MiB average chunk past the minimum. Two bits per byte keep
+# the alphabet big enough for bytes.find to skip ahead quickly.
+CUT_BITS = 20
+SYMBOL_BITS = 2
+READ_SIZE = 8 * 1024 * 1024
+
+# Fixed seed: chunk boundaries must be identical from run to run
+_seeded = random.Random(0x67726964)
+SYMBOLS = bytes(_seeded.getrandbits(SYMBOL_BITS) for _ in range(256))
+CUT_PATTERN = bytes(_seeded.getrandbits(SYMBOL_BITS) for _ in range(CUT_BITS // SYMBOL_BITS))
+
+COMPRESSION_LEVEL = 3
+PROBE_SIZE = 64 * 1024
+# Threads hashing and compressing chunks (zlib and sha256 release the GIL)
+STORE_WORKERS = min(8, os.cpu_count() or 1)
+# Seconds before a snapshot during which file mtimes are too fresh to trust
+RACY_WINDOW = 2
+# Snapshots kept per app when pruning
+KEEP_SNAPSHOTS = 48
+
+# Threads decompressing chunks (zlib and sha256 release the GIL) and writing files
+RESTORE_WORKERS = min(8, os.cpu_count() or 1)
+
+RAW = b"R"
+ZLIB = b"Z"
+
+
+def find_cut(symbols, start, end):
+    """
+    Offset where the chunk beginning at `start` ends (at most `end`), given
+    the data translated through SYMBOLS.
+    """
+    if end - start <= MIN_CHUNK:
+        return end
+    limit = min(start + MAX_CHUNK, end)
+    # Only matches ending past the minimum chunk size count
+    found = symbols.find(CUT_PATTERN, start + MIN_CHUNK - len(CUT_PATTERN) + 1, limit)
+    return limit if found < 0 else found + len(CUT_PATTERN)
+
+
+def iter_chunks(f):
+    buf = symbols = b""
+    eof = False
+    while not eof:
+        data = f.read(READ_SIZE)
+        eof = not data
+        buf = buf + data if buf else data
+        symbols = symbols + data.translate(SYMBOLS) if symbols else data.translate(SYMBOLS)
+        pos = 0
+        # Only cut once a full max-size window is buffered (or at EOF), so
+        # cuts don't depend on how reads happened to be split
+        while len(buf) - pos >= MAX_CHUNK or (eof and pos < len(buf)):
+            cut = find_cut(symbols, pos, len(buf))
+            yield buf[pos:cut]
+            pos = cut
+        buf, symbols = buf[pos:], symbols[pos:]
+
+
+class ChunkStore:
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        self.chunks_dir = os.path.join(root, "chunks")
+        self.snapshots_dir = os.path.join(root, "snapshots")
+
+    def chunk_path(self, digest):
+        return os.path.join(self.chunks_dir, digest[:2], digest)
+
+    def has(self, digest):
+        return os.path.exists(self.chunk_path(digest))
+
+    def put(self, digest, data):
+        """Store a chunk unless present; returns the bytes written."""
+        path = self.chunk_path(digest)
+        if os.path.exists(path):
+            return 0
+        # Media and archives don't compress: a trial on the head of the chunk
+        # spares compressing all of it for nothing
+        probe = data[:PROBE_SIZE]
+        if len(zlib.compress(probe, COMPRESSION_LEVEL)) >= len(probe) * 0.97:
+            blob = RAW + data
+        else:
+            packed = zlib.compress(data, COMPRESSION_LEVEL)
+            blob = ZLIB + packed if len(packed) < len(data) else RAW + data
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(blob)
+        os.replace(tmp, path)
+        return len(blob)
+
+    def blob(self, digest):
+        """A chunk as stored (compressed), for shipping elsewhere."""
+        with open(self.chunk_path(digest), "rb") as f:
+            return f.read()
+
+    def get(self, digest):
+        return unpack_chunk(self.blob(digest))
+
+    @contextmanager
+    def lock(self, exclusive=False, blocking=True):
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, "lock"), "a") as f:
+            flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+            if not blocking:
+                flags |= fcntl.LOCK_NB
+            fcntl.flock(f, flags)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    # Manifests
+
+    def manifest_path(self, name, snapshot_id):
+        return os.path.join(self.snapshots_dir, name, f"{snapshot_id}.json")
+
+    def list_snapshots(self, name):
+        folder = os.path.join(self.snapshots_dir, name)
+        if not os.path.isdir(folder):
+            return []
+        return sorted(f[:-5] for f in os.listdir(folder) if f.endswith(".json"))
+
+    def summary_path(self, name, snapshot_id):
+        return os.path.join(self.snapshots_dir, name, f"{snapshot_id}.summary")
+
+    def load_manifest(self, name, snapshot_id):
+        with open(self.manifest_path(name, snapshot_id)) as f:
+            return json.load(f)
+
+    def write_json(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+    def save_manifest(self, manifest):
+        self.write_json(self.manifest_path(manifest["name"], manifest["id"]), manifest)
+        self.save_summary(manifest)
+
+    def save_summary(self, manifest):
+        summary = {"id": manifest["id"], "created_at": manifest["created_at"], "stats": manifest["stats"]}
+        self.write_json(self.summary_path(manifest["name"], manifest["id"]), summary)
+        return summary
+
+    def list_summaries(self, name):
+        """Summaries of the readable snapshots of `name`, oldest first, without loading manifests."""
+        summaries = []
+        for snapshot_id in self.list_snapshots(name):
+            try:
+                try:
+                    with open(self.summary_path(name, snapshot_id)) as f:
+                        summaries.append(json.load(f))
+                    continue
+                except FileNotFoundError:
+                    pass
+                # Snapshots taken before summaries existed get one now
+                summaries.append(self.save_summary(self.load_manifest(name, snapshot_id)))
+            except (OSError, ValueError, KeyError):
+                continue
+        return summaries
+
+    def remove_snapshot(self, name, snapshot_id):
+        os.remove(self.manifest_path(name, snapshot_id))
+        try:
+            os.remove(self.summary_path(name, snapshot_id))
+        except FileNotFoundError:
+            pass
+
+
+class ChecksumError(Exception):
+    pass
+
+
+def unpack_chunk(blob):
+    kind, body = blob[:1], blob[1:]
+    if kind == ZLIB:
+        return zlib.decompress(body)
+    return body
+
+
+def store_chunk(store, chunk):
+    digest = hashlib.sha256(chunk).hexdigest()
+    return digest, len(chunk), store.put(digest, chunk)
+
+
+def store_files(paths, store, workers=STORE_WORKERS):
+    """
+    Chunk, hash and store files. Returns (digests, read, written, new) per
+    path. Cutting runs here; hashing and compression go to a thread pool, so
+    one large file uses every worker as well as many small ones do.
+    """
+    results = []
+    in_flight = deque()  # (result, future), in file order
+    # A bounded window keeps the workers busy without holding whole files
+    window = workers * 2
+
+    def settle():
+        result, future = in_flight.popleft()
+        digest, size, written = future.result()
+        result[0].append(digest)
+        result[1] += size
+        if written:
+            result[2] += written
+            result[3] += 1
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for path in paths:
+            result = [[], 0, 0, 0]
+            results.append(result)
+            with open(path, "rb") as f:
+                for chunk in iter_chunks(f):
+                    if len(in_flight) >= window:
+                        settle()
+                    in_flight.append((result, pool.submit(store_chunk, store, chunk)))
+        while in_flight:
+            settle()
+    return [tuple(result) for result in results]
+
+
+def scan_tree(source_dir):
+    """Yield manifest entries (without chunks) for everything under source_dir."""
+    for dirpath, dirnames, filenames in os.walk(source_dir):
+        dirnames.sort()
+        rel_dir = os.path.relpath(dirpath, source_dir)
+        for name in dirnames + sorted(filenames):
+            full = os.path.join(dirpath, name)
+            rel = os.path.normpath(os.path.join(rel_dir, name))
+            st = os.lstat(full)
+            entry = {"path": rel, "mode": stat.S_IMODE(st.st_mode), "mtime_ns": st.st_mtime_ns}
+            if stat.S_ISLNK(st.st_mode):
+                entry.update(type="symlink", target=os.readlink(full))
+            elif stat.S_ISDIR(st.st_mode):
+                entry.update(type="dir")
+            elif stat.S_ISREG(st.st_mode):
+                entry.update(type="file", size=st.st_size)
+            else:
+                # Sockets, fifos and devices can't be restored meaningfully
+                continue
+            yield entry
+
+
+def new_snapshot_id():
+    return time.strftime("%Y%m%dT%H%M%S", time.gmtime()) + f"-{os.urandom(2).hex()}"
+
+
+def create_snapshot(source_dir, name, store=None, workers=None, progress=None):
+    """
+    Snapshot `source_dir` as a new manifest under `name`. Returns the manifest;
+    its "stats" say how much was actually read and written.
+    """
+    store = store or ChunkStore()
+    progress = progress or (lambda text: None)
+    started = time.time()
+
+    with store.lock():
+        previous = {}
+        existing = store.list_snapshots(name)
+        if existing:
+            last = store.load_manifest(name, existing[-1])
+            # A file modified in the same instant as the last scan may have
+            # changed again without its mtime moving; don't trust those.
+            racy_after = int((last["created_at"] - RACY_WINDOW) * 1e9)
+            for entry in last["files"]:
+                if entry["type"] == "file" and entry["mtime_ns"] < racy_after:
+                    previous[entry["path"]] = entry
+
+        entries = list(scan_tree(source_dir))
+        changed = []
+        reused = 0
+        for entry in entries:
+            if entry["type"] != "file":
+                continue
+            prev = previous.get(entry["path"])
+            if prev and prev["size"] == entry["size"] and prev["mtime_ns"] == entry["mtime_ns"]:
+                entry["chunks"] = prev["chunks"]
+                reused += 1
+            else:
+                changed.append(entry)
+
+        changed_bytes = sum(e["size"] for e in changed)
+        progress(f"{len(entries)} entries, {reused} unchanged files, "
+                 f"{len(changed)} to read ({changed_bytes / 1e6:.1f} MB)\n")
+
+        paths = [os.path.join(source_dir, e["path"]) for e in changed]
+        results = store_files(paths, store, workers or STORE_WORKERS)
+
+        read = written = new_chunks = 0
+        for entry, (digests, file_read, file_written, file_new) in zip(changed, results):
+            entry["chunks"] = digests
+            read += file_read
+            written += file_written
+            new_chunks += file_new
+
+        manifest = {
+            "id": new_snapshot_id(),
+            "name": name,
+            "source": source_dir,
+            "created_at": started,
+            "files": entries,
+            "stats": {
+                "entries": len(entries),
+                "files_reused": reused,
+                "files_read": len(changed),
+                "bytes_total": sum(e.get("size", 0) for e in entries),
+                "bytes_read": read,
+                "bytes_written": written,
+                "chunks_new": new_chunks,
+                "duration": round(time.time() - started, 3),
+            },
+        }
+        store.save_manifest(manifest)
+
+    progress(f"Snapshot {manifest['id']}: read {read / 1e6:.1f} MB, wrote {written / 1e6:.1f} MB "
+             f"({new_chunks} new chunks) in {manifest['stats']['duration']}s\n")
+    return manifest
+
+
+def upload_snapshot(manifest, remote, store=None, transfers=4, limiter=None, progress=None,
+                    cancelled=None):
+    """
+    Copy a snapshot's chunks and manifest to a remote. Chunk names are their
+    SHA-256, so chunks already on the remote with the expected size are skipped.
+    The manifest goes last: a manifest on the remote never points at missing chunks.
+    """
+    store = store or ChunkStore()
+    progress = progress or (lambda text: None)
+    cancelled = cancelled or (lambda: False)
+    started = time.time()
+
+    # Shared lock: garbage collection must not delete chunks mid-upload
+    with store.lock():
+        uploaded = remote.list("chunks")
+        needed = []
+        seen = set()
+        sent = 0
+        for entry in manifest["files"]:
+            for digest in entry.get("chunks", ()):
+                if digest in seen:
+                    continue
+                seen.add(digest)
+                rel = os.path.join(digest[:2], digest)
+                size = os.path.getsize(store.chunk_path(digest))
+                if uploaded.get(rel) != size:
+                    needed.append(digest)
+                    sent += size
+        progress(f"Uploading {len(needed)} of {len(seen)} chunks to {remote}\n")
+
+        # Chunk files are laid out under the store as they are on the remote,
+        # so they go out as they are, in one batch
+        remote.copy_files(store.root, [f"chunks/{digest[:2]}/{digest}" for digest in needed],
+                          limiter=limiter, transfers=transfers, cancelled=cancelled)
+        if cancelled():
+            raise InterruptedError("Upload cancelled")
+
+        manifest_path = f"snapshots/{manifest['name']}/{manifest['id']}.json"
+        remote.put(manifest_path, json.dumps(manifest).encode(), limiter)
+
+    duration = time.time() - started
+    stats = {
+        "chunks_total": len(seen),
+        "chunks_uploaded": len(needed),
+        "bytes_uploaded": sent,
+        "duration": round(duration, 3),
+        "throughput": round(sent / duration) if duration else 0,
+    }
+    progress(f"Uploaded {sent / 1e6:.1f} MB in {stats['duration']}s\n")
+    return stats
+
+
+def restore_snapshot(manifest, target_dir, store=None, workers=RESTORE_WORKERS, progress=None,
+                     cancelled=None):
+    """
+    Make `target_dir` match a snapshot. Files that already match (size and
+    mtime) are left alone, anything not in the snapshot is removed. Every chunk
+    is checked against its SHA-256 as it is decompressed; files are written to
+    a temporary name and renamed into place only once complete.
+    """
+    store = store or ChunkStore()
+    progress = progress or (lambda text: None)
+    cancelled = cancelled or (lambda: False)
+    started = time.time()
+    entries = {e["path"]: e for e in manifest["files"]}
+
+    def decode(digest):
+        data = store.get(digest)
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ChecksumError(f"Chunk {digest} is corrupt")
+        return data
+
+    def restore_file(entry):
+        if cancelled():
+            return 0
+        path = os.path.join(target_dir, entry["path"])
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".restore-")
+        written = 0
+        try:
+            with os.fdopen(fd, "wb") as f:
+                chunks = entry["chunks"]
+                # A bounded window keeps a few chunks in flight without
+                # holding a whole large file in memory
+                window = workers * 2
+                for start in range(0, len(chunks), window):
+                    for data in chunk_pool.map(decode, chunks[start:start + window]):
+                        f.write(data)
+                        written += len(data)
+            if written != entry["size"]:
+                raise ChecksumError(f"{entry['path']}: expected {entry['size']} bytes, got {written}")
+            os.chmod(tmp, entry["mode"])
+            os.utime(tmp, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return written
+
+    with store.lock():
+        os.makedirs(target_dir, exist_ok=True)
+        removed = 0
+        # Bottom-up, so directories are empty by the time they are checked
+        for dirpath, dirnames, filenames in os.walk(target_dir, topdown=False):
+            for name in filenames + dirnames:
+                full = os.path.join(dirpath, name)
+                entry = entries.get(os.path.relpath(full, target_dir))
+                is_dir = os.path.isdir(full) and not os.path.islink(full)
+                if entry is not None and (entry["type"] == "dir") == is_dir:
+                    continue
+                if is_dir:
+                    shutil.rmtree(full)
+                else:
+                    os.remove(full)
+                removed += 1
+
+        pending = []
+        skipped = 0
+        for entry in manifest["files"]:
+            path = os.path.join(target_dir, entry["path"])
+            if entry["type"] == "dir":
+                os.makedirs(path, exist_ok=True)
+            elif entry["type"] == "symlink":
+                if os.path.lexists(path):
+                    os.remove(path)
+                os.symlink(entry["target"], path)
+            else:
+                try:
+                    st = os.lstat(path)
+                except FileNotFoundError:
+                    st = None
+                if (st is not None and stat.S_ISREG(st.st_mode) and st.st_size == entry["size"]
+                        and st.st_mtime_ns == entry["mtime_ns"]):
+                    skipped += 1
+                else:
+                    pending.append(entry)
+
+        total = sum(e["size"] for e in pending)
+        progress(f"Restoring {len(pending)} files ({total / 1e6:.1f} MB), {skipped} already up to date\n")
+        with ThreadPoolExecutor(max_workers=workers) as chunk_pool, \
+                ThreadPoolExecutor(max_workers=workers) as file_pool:
+            written = sum(file_pool.map(restore_file, pending))
+        if cancelled():
+            raise InterruptedError("Restore cancelled")
+
+        # Directory metadata last: writing files inside them bumps their mtime
+        for entry in reversed(manifest["files"]):
+            if entry["type"] == "dir":
+                path = os.path.join(target_dir, entry["path"])
+                os.chmod(path, entry["mode"])
+                os.utime(path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+
+    duration = time.time() - started
+    stats = {
+        "files_restored": len(pending),
+        "files_skipped": skipped,
+        "removed": removed,
+        "bytes_written": written,
+        "duration": round(duration, 3),
+        "throughput": round(written / duration) if duration else 0,
+    }
+    progress(f"Restored {written / 1e6:.1f} MB in {stats['duration']}s "
+             f"({stats['throughput'] / 1e6:.1f} MB/s)\n")
+    return stats
+
+
+def prune(name, keep=KEEP_SNAPSHOTS, store=None):
+    """Drop all but the newest `keep` snapshots of `name`, then collect garbage."""
+    store = store or ChunkStore()
+    snapshots = store.list_snapshots(name)
+    doomed = snapshots[:-keep] if keep else snapshots
+    for snapshot_id in doomed:
+        store.remove_snapshot(name, snapshot_id)
+    removed = collect_garbage(store) if doomed else 0
+    return {"snapshots_removed": len(doomed), "chunks_removed": removed}
+
+
+def collect_garbage(store):
+    """Delete chunks no manifest references. Skipped while snapshots are running."""
+    try:
+        with store.lock(exclusive=True, blocking=False):
+            live = set()
+            if os.path.isdir(store.snapshots_dir):
+                for name in os.listdir(store.snapshots_dir):
+                    for snapshot_id in store.list_snapshots(name):
+                        for entry in store.load_manifest(name, snapshot_id)["files"]:
+                            live.update(entry.get("chunks", ()))
+            removed = 0
+            if os.path.isdir(store.chunks_dir):
+                for prefix in os.listdir(store.chunks_dir):
+                    folder = os.path.join(store.chunks_dir, prefix)
+                    for digest in os.listdir(folder):
+                        if digest not in live:
+                            os.remove(os.path.join(folder, digest))
+                            removed += 1
+            return removed
+    except BlockingIOError:
+        return 0
@@ -0,0 +1,108 @@
+import http.client
+import json
+from urllib.parse import quote
+
+CADDY_ADMIN = "localhost:2019"
+
+# Prefix of the @id GridOps puts on each app's route
+ROUTE_ID_PREFIX = "gridops-"
+
+
+class CaddyAPIError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f"Caddy admin API error {status}: {message}")
+        self.status = status
+        self.message = message
+
+
+def route_id(app_slug):
+    return f"{ROUTE_ID_PREFIX}{app_slug}"
+
+
+def route_hosts(route):
+    hosts = set()
+    for match in route.get("match") or []:
+        hosts.update(match.get("host") or [])
+    return hosts
+
+
+class CaddyAdmin:
+    """
+    Client for Caddy's admin API. Only the route of the app being changed is
+    touched, instead of re-adapting and reloading the whole Caddyfile.
+    """
+
+    def __init__(self, address=CADDY_ADMIN, timeout=10):
+        self.address = address
+        self.timeout = timeout
+
+    def request(self, method, path, body=None):
+        conn = http.client.HTTPConnection(self.address, timeout=self.timeout)
+        headers = {}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        try:
+            conn.request(method, path, body=payload, headers=headers)
+            resp = conn.getresponse()
+            data = resp.read()
+        finally:
+            conn.close()
+        if resp.status >= 400:
+            try:
+                message = json.loads(data).get("error", "")
+            except ValueError:
+                message = data.decode(errors="replace")
+            raise CaddyAPIError(resp.status, message)
+        return json.loads(data) if data.strip() else None
+
+    def servers(self):
+        return self.request("GET", "/config/apps/http/servers") or {}
+
+    def route_server(self):
+        """The HTTPS server app routes belong to (srv0 for an adapted Caddyfile)."""
+        servers = self.servers()
+        if not servers:
+            raise CaddyAPIError(404, "No HTTP servers configured")
+        for name, server in sorted(servers.items()):
+            if any(addr.endswith(":443") for addr in server.get("listen") or []):
+                return name, server
+        return sorted(servers.items())[0]
+
+    def _drop_host_routes(self, server_name, server, hosts, keep_id):
+        # Routes for the same hosts without our @id come from the Caddyfile
+        # (it can't carry ids); they'd shadow or outlive the managed route.
+        routes = server.get("routes") or []
+        for index in reversed(range(len(routes))):
+            route = routes[index]
+            if route.get("@id") != keep_id and route_hosts(route) & hosts:
+                self.request("DELETE", f"/config/apps/http/servers/{quote(server_name)}/routes/{index}")
+
+    def upsert_route(self, app_slug, route):
+        rid = route_id(app_slug)
+        route = dict(route, **{"@id": rid})
+        server_name, server = self.route_server()
+        self._drop_host_routes(server_name, server, route_hosts(route), rid)
+        try:
+            self.request("PATCH", f"/id/{quote(rid)}", route)
+            return "updated"
+        except CaddyAPIError as e:
+            if e.status != 404:
+                raise
+        # First in the list so it wins over any catch-all route
+        self.request("PUT", f"/config/apps/http/servers/{quote(server_name)}/routes/0", route)
+        return "added"
+
+    def remove_route(self, app_slug, hosts=()):
+        rid = route_id(app_slug)
+        server_name, server = self.route_server()
+        if hosts:
+            self._drop_host_routes(server_name, server, set(hosts), rid)
+        try:
+            self.request("DELETE", f"/id/{quote(rid)}")
+            return "removed"
+        except CaddyAPIError as e:
+            if e.status != 404:
+                raise
+            return "absent"
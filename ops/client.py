@@ -1,41 +1,85 @@
+import asyncio
+import itertools
 import socket
 import json
 import os
+import threading
+
+from .protocol import ProtocolError, encode_frame, read_frame, read_frame_async, write_frame
 
 SOCKET_PATH = "/srv/gridops/ops/runner.sock"
 
-class OpsClient:
-    def _send(self, payload):
-        if not os.path.exists(SOCKET_PATH):
-             # Dev mode fallback or error
-             if os.environ.get("DEBUG") == "True":
-                 return {"status": "success", "message": "Dev mode: Ops command simulated"}
-             return {"status": "error", "message": "Ops runner not available"}
+class ConnectionPool:
+    """Keeps a few connected sockets around so calls skip the connect."""
 
-        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    def __init__(self, socket_path, max_idle=4, timeout=60):
+        self.socket_path = socket_path
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Returns (sock, reused)."""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
         try:
-            client.connect(SOCKET_PATH)
-            client.sendall(json.dumps(payload).encode())
-            client.shutdown(socket.SHUT_WR)
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        return sock, False
 
-            response = b""
-            while True:
-                chunk = client.recv(4096)
-                if not chunk: break
-                response += chunk
+    def release(self, sock):
+        sock.settimeout(self.timeout)
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(sock)
+                return
+        sock.close()
 
-            return json.loads(response.decode())
-        except Exception as e:
-            return {"status": "error", "message": str(e)}
-        finally:
-            client.close()
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for sock in idle:
+            sock.close()
 
-    def install_app(self, slug, compose, env):
-        return self._send({
+class RunnerCommands:
+    """
+    Runner commands shared by the blocking and asyncio clients. Each method
+    returns whatever the client's _send returns: a dict for OpsClient, a
+    coroutine for AsyncOpsClient.
+    """
+
+    def _unavailable(self):
+        # Dev mode fallback or error
+        if os.environ.get("DEBUG") == "True":
+            return {"status": "success", "message": "Dev mode: Ops command simulated"}
+        return {"status": "error", "message": "Ops runner not available"}
+
+    # Long-running commands answer {"status": "accepted", "job_id": ...};
+    # poll job_status until the job reaches a finished state.
+
+    def install_app(self, slug, compose, env, web=None):
+        # web: {service, port, host_port, replicas} of the service the proxy targets
+        payload = {
             "command": "install_app",
             "app_slug": slug,
             "compose_content": compose,
             "env_content": env
+        }
+        if web:
+            payload["web"] = web
+        return self._send(payload)
+
+    def scale_app(self, slug, web):
+        return self._send({
+            "command": "scale_app",
+            "app_slug": slug,
+            "web": web
         })
 
     def control_app(self, slug, action):
@@ -45,16 +89,49 @@ class OpsClient:
             "app_slug": slug
         })
 
+    def batch(self, items, parallelism=None):
+        # items: [(slug, action), ...]; answered with per-item results
+        payload = {
+            "command": "batch",
+            "items": [{"app_slug": slug, "action": action} for slug, action in items]
+        }
+        if parallelism:
+            payload["parallelism"] = parallelism
+        return self._send(payload)
+
     def reload_proxy(self, caddyfile):
         return self._send({
             "command": "reload_proxy",
             "caddyfile": caddyfile
         })
 
-    def backup_app(self, slug):
+    def update_route(self, slug, host, route, caddyfile):
+        # route=None removes the app's route
         return self._send({
-            "command": "backup_app",
-            "app_slug": slug
+            "command": "update_route",
+            "app_slug": slug,
+            "host": host,
+            "route": route,
+            "caddyfile": caddyfile
+        })
+
+    def backup_app(self, slug, remote=None, bwlimit=None):
+        payload = {"command": "backup_app", "app_slug": slug}
+        if remote:
+            payload["remote"] = remote
+        if bwlimit:
+            payload["bwlimit"] = bwlimit
+        return self._send(payload)
+
+    def restore_app(self, slug, snapshot=None):
+        payload = {"command": "restore_app", "app_slug": slug}
+        if snapshot:
+            payload["snapshot"] = snapshot
+        return self._send(payload)
+
+    def system_backup(self):
+        return self._send({
+            "command": "system_backup"
         })
 
     def self_update(self):
@@ -62,6 +139,27 @@ class OpsClient:
             "command": "self_update"
         })
 
+    def rollback_release(self):
+        return self._send({
+            "command": "rollback_release"
+        })
+
+    def list_releases(self):
+        return self._send({
+            "command": "list_releases"
+        })
+
+    def restore_checkpoint(self, checkpoint):
+        return self._send({
+            "command": "restore_checkpoint",
+            "checkpoint": checkpoint
+        })
+
+    def list_checkpoints(self):
+        return self._send({
+            "command": "list_checkpoints"
+        })
+
     def save_rclone_config(self, content):
         return self._send({
             "command": "config_rclone",
@@ -73,3 +171,313 @@ class OpsClient:
             "command": "mount_rclone",
             "remote": remote
         })
+
+    def job_status(self, job_id):
+        return self._send({
+            "command": "job_status",
+            "job_id": job_id
+        })
+
+    def cancel_job(self, job_id):
+        return self._send({
+            "command": "cancel_job",
+            "job_id": job_id
+        })
+
+    def list_jobs(self):
+        return self._send({
+            "command": "list_jobs"
+        })
+
+    def inspect_app(self, slug):
+        return self._send({
+            "command": "inspect_app",
+            "app_slug": slug
+        })
+
+    def list_containers(self):
+        return self._send({
+            "command": "list_containers"
+        })
+
+    def list_status(self, slug=None):
+        payload = {"command": "list_status"}
+        if slug:
+            payload["app_slug"] = slug
+        return self._send(payload)
+
+    def list_backups(self, slug):
+        return self._send({
+            "command": "list_backups",
+            "app_slug": slug
+        })
+
+    def job_output(self, job_id, since=0):
+        return self._send({
+            "command": "job_output",
+            "job_id": job_id,
+            "since": since
+        })
+
+class OpsClient(RunnerCommands):
+    def __init__(self, socket_path=SOCKET_PATH, pool_size=4, timeout=60):
+        self.socket_path = socket_path
+        self.pool = ConnectionPool(socket_path, max_idle=pool_size, timeout=timeout)
+        self._ids = itertools.count(1)
+
+    def _exchange(self, payload):
+        """Yield the response frames for one request over a pooled connection."""
+        request = dict(payload, id=next(self._ids))
+        # A pooled connection may have been closed by a runner restart; retry
+        # once on a fresh one if it fails before any reply arrives.
+        for attempt in range(2):
+            sock, reused = self.pool.acquire()
+            try:
+                write_frame(sock, request)
+                frame = read_frame(sock)
+                if frame is None:
+                    raise ConnectionResetError("Runner closed the connection")
+            except (OSError, ProtocolError):
+                sock.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            break
+
+        clean = False
+        streamed = False
+        try:
+            while True:
+                if frame.get("id") != request["id"]:
+                    raise ProtocolError("Response for an unexpected request id")
+                more = frame.pop("more", False)
+                frame.pop("id", None)
+                if not more:
+                    clean = True
+                    # A stream ends with an empty closing frame; a plain reply
+                    # is a single frame.
+                    if not streamed:
+                        yield frame
+                    return
+                streamed = True
+                yield frame
+                frame = read_frame(sock)
+                if frame is None:
+                    raise ProtocolError("Connection closed mid-stream")
+        finally:
+            # Only a fully read exchange leaves the connection reusable
+            if clean:
+                self.pool.release(sock)
+            else:
+                sock.close()
+
+    def _send(self, payload):
+        if not os.path.exists(self.socket_path):
+            return self._unavailable()
+        try:
+            for frame in self._exchange(payload):
+                response = frame
+            return response
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+    def stream_job(self, job_id, since=0):
+        # Yields output frames as the runner produces them; the last one has "done"
+        if not os.path.exists(self.socket_path):
+            yield {"status": "error", "message": "Ops runner not available"}
+            return
+        try:
+            yield from self._exchange({
+                "command": "stream_job",
+                "job_id": job_id,
+                "since": since
+            })
+        except Exception as e:
+            yield {"status": "error", "message": str(e)}
+
+class AsyncConnection:
+    """
+    One runner connection shared by many concurrent requests. Replies are
+    routed back to their caller by request id.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.closed = False
+        self._pending = {} # request id -> asyncio.Queue of frames
+        self._loop = asyncio.get_running_loop()
+        self._reader_task = self._loop.create_task(self._read_loop())
+
+    async def _read_loop(self):
+        error = ConnectionResetError("Runner closed the connection")
+        try:
+            while True:
+                frame = await read_frame_async(self.reader)
+                if frame is None:
+                    break
+                queue = self._pending.get(frame.get("id"))
+                if queue is not None:
+                    queue.put_nowait(frame)
+        except (OSError, ProtocolError) as e:
+            error = e
+        finally:
+            self.closed = True
+            for queue in self._pending.values():
+                queue.put_nowait(error)
+            self.writer.close()
+
+    async def send(self, request):
+        """Write `request`. Raising here means the runner never got all of it."""
+        if self.closed:
+            raise ConnectionResetError("Runner closed the connection")
+        self._pending[request["id"]] = asyncio.Queue()
+        try:
+            self.writer.write(encode_frame(request))
+            await self.writer.drain()
+        except BaseException:
+            del self._pending[request["id"]]
+            raise
+
+    async def replies(self, request_id, timeout):
+        """Yield response frames for a sent request; `timeout` bounds each wait."""
+        queue = self._pending[request_id]
+        try:
+            while True:
+                frame = await asyncio.wait_for(queue.get(), timeout)
+                if isinstance(frame, Exception):
+                    raise frame
+                yield frame
+                if not frame.get("more"):
+                    return
+        finally:
+            del self._pending[request_id]
+
+    def _close(self):
+        self._reader_task.cancel()
+        self.writer.close()
+
+    def close(self):
+        self.closed = True
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        try:
+            if running is self._loop:
+                self._close()
+            else:
+                # The transport may only be touched from its own loop
+                self._loop.call_soon_threadsafe(self._close)
+            return
+        except RuntimeError:
+            pass
+        # That loop is closed and will never run the transport's callbacks:
+        # shut the socket down so the runner drops its end right away
+        sock = self.writer.get_extra_info("socket")
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+class AsyncOpsClient(RunnerCommands):
+    """
+    asyncio client for async views. A handful of connections are opened per
+    event loop and multiplexed, so hundreds of calls can be in flight without
+    a thread or socket each.
+    """
+
+    def __init__(self, socket_path=SOCKET_PATH, pool_size=2, timeout=60, retries=2, backoff=0.1):
+        self.socket_path = socket_path
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._ids = itertools.count(1)
+        self._loop = None
+        self._connections = []
+        self._next = 0
+        self._connect_lock = None
+
+    async def _connection(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Connections belong to the loop that opened them (sync views run
+            # async code in short-lived loops), so start over on a new loop.
+            stale, self._connections = self._connections, []
+            self._loop = loop
+            self._connect_lock = asyncio.Lock()
+            for conn in stale:
+                conn.close()
+
+        async with self._connect_lock:
+            self._connections = [c for c in self._connections if not c.closed]
+            if len(self._connections) < self.pool_size:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_unix_connection(self.socket_path), self.timeout)
+                self._connections.append(AsyncConnection(reader, writer))
+            self._next = (self._next + 1) % len(self._connections)
+            return self._connections[self._next]
+
+    async def _exchange(self, payload, timeout=None):
+        request = dict(payload, id=next(self._ids))
+        for attempt in range(self.retries + 1):
+            conn = None
+            try:
+                conn = await self._connection()
+                await conn.send(request)
+                break
+            except asyncio.TimeoutError:
+                # The runner may be busy rather than gone: don't pile on
+                raise
+            except (OSError, ProtocolError):
+                # The request never made it out, so sending it again can't
+                # run the command twice
+                if conn is not None:
+                    conn.close()
+                if attempt == self.retries:
+                    raise
+                await asyncio.sleep(self.backoff * (2 ** attempt))
+
+        # From here on a failure is final: the command may already be running
+        streamed = False
+        async for frame in conn.replies(request["id"], timeout):
+            more = frame.pop("more", False)
+            frame.pop("id", None)
+            if more:
+                streamed = True
+                yield frame
+            elif not streamed:
+                yield frame
+
+    async def _send(self, payload):
+        if not os.path.exists(self.socket_path):
+            return self._unavailable()
+        try:
+            async for frame in self._exchange(payload, self.timeout):
+                response = frame
+            return response
+        except asyncio.TimeoutError:
+            return {"status": "error", "message": f"Ops runner did not answer within {self.timeout}s"}
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+    async def stream_job(self, job_id, since=0):
+        if not os.path.exists(self.socket_path):
+            yield {"status": "error", "message": "Ops runner not available"}
+            return
+        try:
+            async for frame in self._exchange({
+                "command": "stream_job",
+                "job_id": job_id,
+                "since": since
+            }, timeout=None): # output may pause for longer than a reply timeout
+                yield frame
+        except Exception as e:
+            yield {"status": "error", "message": str(e)}
+
+    async def close(self):
+        for conn in self._connections:
+            conn.close()
+        self._connections = []
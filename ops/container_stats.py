@@ -0,0 +1,173 @@
+"""
+Per-app container resource usage: CPU, memory, network and block I/O.
+
+The runner follows the Docker stats stream of every running app container
+(a stream stays open for the container's lifetime instead of one request per
+container per sample) and every interval writes the totals of each app into
+a metrics file laid out like the host one, with one named series per app.
+
+The file holds MAX_APPS series of fixed-size rings; a new app takes the
+slot written to least recently once all are in use, so its size doesn't
+depend on how many apps run. Slots of running apps are never taken: apps
+beyond MAX_APPS go unrecorded until one stops. At most MAX_STREAMS streams
+(one thread and socket each) are open at a time.
+"""
+import logging
+import os
+import threading
+import time
+
+from . import metrics
+from .docker_api import DockerAPIError
+
+APP_METRICS_FILE = os.environ.get("GRIDOPS_APP_METRICS_FILE", "/dev/shm/gridops-app-metrics")
+SAMPLE_INTERVAL = metrics.SAMPLE_INTERVAL
+MAX_APPS = 64
+MAX_STREAMS = 256
+
+# Shorter raw and 1m history than the host: this file has one set per app
+APP_RINGS = (
+    ("raw", 0, 360),
+    ("1m", 60, 720),
+    ("5m", 300, 2016),
+    ("1h", 3600, 720),
+)
+# cpu in percent of the whole host, memory in bytes, I/O in bytes per second
+APP_FIELDS = ("cpu", "mem", "net_rx", "net_tx", "blk_read", "blk_write")
+APP_LAYOUT = metrics.Layout(b"GOAPPST1", APP_RINGS, APP_FIELDS, series=MAX_APPS)
+
+
+def cpu_percent(stats):
+    cpu = stats.get("cpu_stats") or {}
+    precpu = stats.get("precpu_stats") or {}
+    cpu_delta = (cpu.get("cpu_usage") or {}).get("total_usage", 0) - (precpu.get("cpu_usage") or {}).get("total_usage", 0)
+    system_delta = cpu.get("system_cpu_usage", 0) - precpu.get("system_cpu_usage", 0)
+    if cpu_delta <= 0 or system_delta <= 0:
+        return 0.0
+    # system_cpu_usage counts every core, so this is a share of the host
+    return cpu_delta / system_delta * 100
+
+
+def memory_bytes(stats):
+    memory = stats.get("memory_stats") or {}
+    details = memory.get("stats") or {}
+    # Page cache can be reclaimed; leave it out as `docker stats` does
+    cache = details.get("inactive_file", details.get("total_inactive_file", 0))
+    return max(memory.get("usage", 0) - cache, 0)
+
+
+def io_counters(stats):
+    """Cumulative (net rx, net tx, block read, block write) bytes."""
+    rx = tx = read = write = 0
+    for network in (stats.get("networks") or {}).values():
+        rx += network.get("rx_bytes", 0)
+        tx += network.get("tx_bytes", 0)
+    for entry in (stats.get("blkio_stats") or {}).get("io_service_bytes_recursive") or []:
+        op = entry.get("op", "").lower()
+        if op == "read":
+            read += entry.get("value", 0)
+        elif op == "write":
+            write += entry.get("value", 0)
+    return (rx, tx, read, write)
+
+
+def reduce_stats(stats):
+    return {"cpu": cpu_percent(stats), "mem": memory_bytes(stats), "io": io_counters(stats)}
+
+
+class StatsCollector:
+    """Keeps a stats stream open per running container and writes per-app totals."""
+
+    def __init__(self, docker, state, path=APP_METRICS_FILE, interval=SAMPLE_INTERVAL, max_streams=MAX_STREAMS):
+        self.docker = docker
+        self.state = state
+        self.path = path
+        self.interval = interval
+        self.max_streams = max_streams
+        self.writer = None
+        self._wanted = {}   # container id -> project, from the events-fed state cache
+        self._latest = {}   # container id -> (project, newest reduced sample)
+        self._written = {}  # container id -> (time, io counters) at the last write
+        self._streams = set()  # container ids with a stream open
+        self._lock = threading.Lock()
+
+    def running(self):
+        wanted = {}
+        for project, summary in self.state.snapshot().items():
+            for container in summary["containers"]:
+                if container["state"] == "running":
+                    wanted[container["id"]] = project
+        return wanted
+
+    def follow(self, container_id, project):
+        try:
+            for stats in self.docker.stream("GET", f"/containers/{container_id}/stats", {"stream": "1"}):
+                if container_id not in self._wanted:
+                    break
+                sample = reduce_stats(stats)
+                with self._lock:
+                    self._latest[container_id] = (project, sample)
+        except (OSError, ValueError, DockerAPIError) as e:
+            logging.warning(f"Stats stream of {container_id} failed: {e}")
+        finally:
+            with self._lock:
+                self._latest.pop(container_id, None)
+                self._written.pop(container_id, None)
+                self._streams.discard(container_id)
+
+    def sync(self):
+        """
+        Open streams for containers that started, up to max_streams; stopped
+        ones end on their own. Apps are taken in name order so the ones
+        followed are followed whole.
+        """
+        self._wanted = self.running()
+        for container_id, project in sorted(self._wanted.items(), key=lambda item: (item[1], item[0])):
+            with self._lock:
+                if container_id in self._streams:
+                    continue
+                if len(self._streams) >= self.max_streams:
+                    break
+                self._streams.add(container_id)
+            threading.Thread(target=self.follow, args=(container_id, project),
+                             name=f"stats-{container_id}", daemon=True).start()
+
+    def totals(self, now):
+        """Per project: [cpu, mem, net_rx, net_tx, blk_read, blk_write]."""
+        totals = {}
+        with self._lock:
+            for container_id, (project, sample) in self._latest.items():
+                values = totals.setdefault(project, [0.0] * len(APP_FIELDS))
+                values[0] += sample["cpu"]
+                values[1] += sample["mem"]
+                previous = self._written.get(container_id)
+                if previous and now > previous[0]:
+                    elapsed = now - previous[0]
+                    for i, (current, before) in enumerate(zip(sample["io"], previous[1])):
+                        # Counters restart from zero with the container
+                        values[2 + i] += max(current - before, 0) / elapsed
+                self._written[container_id] = (now, sample["io"])
+        return totals
+
+    def collect(self, now=None):
+        now = now or time.time()
+        if self.state.synced:
+            self.sync()
+        totals = self.totals(now)
+        running = set(self._wanted.values()) | set(totals)
+        for project, values in totals.items():
+            # Never take a running app's slot; with none left, skip this app
+            series = self.writer.assign(project, keep=running)
+            if series is not None:
+                self.writer.write(now, values, series)
+
+    def run(self):
+        self.writer = metrics.MetricsWriter(self.path, APP_LAYOUT)
+        next_tick = time.monotonic()
+        while True:
+            next_tick += self.interval
+            time.sleep(max(0, next_tick - time.monotonic()))
+            try:
+                self.collect()
+            except Exception as e:
+                logging.error(f"Collecting container stats failed: {e}")
@@ -0,0 +1,214 @@
+import http.client
+import json
+import socket
+from urllib.parse import quote, urlencode
+
+DOCKER_SOCKET = "/var/run/docker.sock"
+
+# Label docker compose puts on every container of a project
+PROJECT_LABEL = "com.docker.compose.project"
+SERVICE_LABEL = "com.docker.compose.service"
+NUMBER_LABEL = "com.docker.compose.container-number"
+# "service:condition:restart,..." for each dependency of the container's service
+DEPENDS_ON_LABEL = "com.docker.compose.depends_on"
+
+
+class DockerAPIError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f"Docker API error {status}: {message}")
+        self.status = status
+        self.message = message
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class DockerClient:
+    """
+    Minimal Docker Engine API client speaking HTTP over the daemon socket.
+
+    Point `socket_path` at any HTTP server on a unix socket (e.g. a fake
+    daemon in tests) to swap the backend.
+
+    Paths carry no API version: the daemon serves them at its own current
+    version, where a pinned one is refused once an engine drops it. The
+    fields read here have been stable across versions.
+    """
+
+    def __init__(self, socket_path=DOCKER_SOCKET, timeout=30):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def _connection(self, timeout):
+        return UnixHTTPConnection(self.socket_path, timeout=timeout)
+
+    def request(self, method, path, params=None, body=None, timeout=None):
+        url = path
+        if params:
+            url += "?" + urlencode(params)
+        headers = {}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+
+        conn = self._connection(timeout or self.timeout)
+        try:
+            conn.request(method, url, body=payload, headers=headers)
+            resp = conn.getresponse()
+            data = resp.read()
+        finally:
+            conn.close()
+
+        # 304: container already in the requested state
+        if resp.status >= 400:
+            try:
+                message = json.loads(data).get("message", "")
+            except ValueError:
+                message = data.decode(errors="replace")
+            raise DockerAPIError(resp.status, message)
+        if not data:
+            return None
+        return json.loads(data)
+
+    def stream(self, method, path, params=None):
+        """Yield JSON documents from a streaming endpoint (events, stats)."""
+        url = path
+        if params:
+            url += "?" + urlencode(params)
+        conn = self._connection(None)
+        try:
+            conn.request(method, url)
+            resp = conn.getresponse()
+            if resp.status >= 400:
+                raise DockerAPIError(resp.status, resp.read().decode(errors="replace"))
+            while True:
+                line = resp.readline()
+                if not line:
+                    return
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        finally:
+            conn.close()
+
+    def ping(self):
+        try:
+            conn = self._connection(2)
+            try:
+                conn.request("GET", "/_ping")
+                return conn.getresponse().status == 200
+            finally:
+                conn.close()
+        except OSError:
+            return False
+
+    def list_containers(self, project=None, all=True):
+        filters = {"label": [f"{PROJECT_LABEL}={project}" if project else PROJECT_LABEL]}
+        return self.request("GET", "/containers/json", {
+            "all": "1" if all else "0",
+            "filters": json.dumps(filters),
+        })
+
+    def inspect_container(self, container_id):
+        return self.request("GET", f"/containers/{quote(container_id)}/json")
+
+    def start_container(self, container_id):
+        return self.request("POST", f"/containers/{quote(container_id)}/start")
+
+    def stop_container(self, container_id, timeout=10):
+        # The HTTP call outlives the container's stop grace period
+        return self.request("POST", f"/containers/{quote(container_id)}/stop", {"t": timeout},
+                            timeout=timeout + self.timeout)
+
+    def restart_container(self, container_id, timeout=10):
+        return self.request("POST", f"/containers/{quote(container_id)}/restart", {"t": timeout},
+                            timeout=timeout + self.timeout)
+
+    def ensure_network(self, name):
+        """Create a bridge network unless it exists. True when it was created."""
+        try:
+            self.request("GET", f"/networks/{quote(name)}")
+            return False
+        except DockerAPIError as e:
+            if e.status != 404:
+                raise
+        try:
+            self.request("POST", "/networks/create", body={"Name": name, "Driver": "bridge"})
+        except DockerAPIError as e:
+            # Created concurrently by someone else
+            if e.status != 409:
+                raise
+            return False
+        return True
+
+
+def container_summary(container):
+    """Compact view of a /containers/json entry."""
+    labels = container.get("Labels") or {}
+    names = container.get("Names") or []
+    return {
+        "id": container.get("Id", "")[:12],
+        "name": names[0].lstrip("/") if names else "",
+        "service": labels.get(SERVICE_LABEL, ""),
+        "image": container.get("Image", ""),
+        "state": container.get("State", ""),
+        "status": container.get("Status", ""),
+    }
+
+
+def service_order(container):
+    labels = container.get("Labels") or {}
+    return (labels.get(SERVICE_LABEL, ""), int(labels.get(NUMBER_LABEL, "1") or 1))
+
+
+def depends_on(container):
+    """{service: condition} from compose's label, or None when the container has none."""
+    value = (container.get("Labels") or {}).get(DEPENDS_ON_LABEL)
+    if value is None:
+        return None
+    deps = {}
+    for entry in value.split(","):
+        service, _, rest = entry.partition(":")
+        if service:
+            deps[service] = rest.split(":")[0] or "service_started"
+    return deps
+
+
+def dependency_order(containers):
+    """
+    Containers in the order compose starts them: every service after the
+    ones it depends on, name order otherwise. None when the order can't be
+    told: a service without the depends_on label (containers created by an
+    older compose) or a dependency cycle.
+    """
+    services = {}
+    for container in sorted(containers, key=service_order):
+        services.setdefault((container.get("Labels") or {}).get(SERVICE_LABEL, ""), []).append(container)
+    if len(services) == 1:
+        return next(iter(services.values()))
+    remaining = {}
+    for service, group in services.items():
+        deps = depends_on(group[0])
+        if deps is None:
+            return None
+        # Dependencies that have no container here don't hold anything up
+        remaining[service] = set(deps) & services.keys()
+    ordered = []
+    while remaining:
+        ready = sorted(service for service, deps in remaining.items() if not deps & remaining.keys())
+        if not ready:
+            return None
+        for service in ready:
+            del remaining[service]
+            ordered.extend(services[service])
+    return ordered
@@ -0,0 +1,242 @@
+import os
+import signal
+import subprocess
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+# Seconds between SIGTERM and SIGKILL when tearing down a process tree
+KILL_GRACE = 5
+# Output kept per job for late subscribers; older chunks are dropped first
+OUTPUT_BUFFER_BYTES = 256 * 1024
+
+_local = threading.local()
+
+
+def current_job():
+    """The job the calling thread is executing, if any."""
+    return getattr(_local, "job", None)
+
+
+def emit(text, stream="stdout"):
+    """Add a progress line to the current job's output, if there is a job."""
+    job = current_job()
+    if job is not None:
+        job.output.append(stream, text)
+
+
+def kill_tree(proc, grace=KILL_GRACE):
+    # Commands are started in their own session, so the process group id is
+    # the child's pid and takes docker compose's children down with it.
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    try:
+        proc.wait(timeout=grace)
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+class JobTableFull(Exception):
+    pass
+
+
+class OutputBuffer:
+    """Bounded ring of output chunks that readers page through by sequence number."""
+
+    def __init__(self, max_bytes=OUTPUT_BUFFER_BYTES):
+        self.max_bytes = max_bytes
+        self._chunks = deque() # (seq, stream, data)
+        self._size = 0
+        self._next_seq = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def append(self, stream, data):
+        with self._cond:
+            self._chunks.append((self._next_seq, stream, data))
+            self._next_seq += 1
+            self._size += len(data)
+            while self._size > self.max_bytes and len(self._chunks) > 1:
+                _, _, dropped = self._chunks.popleft()
+                self._size -= len(dropped)
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def read(self, since=0, wait=None):
+        """
+        Chunks with seq >= since. With `wait`, block up to that many seconds
+        for new output first. Returns (chunks, next_seq, truncated, closed);
+        truncated means some requested output was already dropped.
+        """
+        with self._cond:
+            if wait and since >= self._next_seq and not self._closed:
+                self._cond.wait(wait)
+            chunks = [
+                {"seq": seq, "stream": stream, "data": data}
+                for seq, stream, data in self._chunks if seq >= since
+            ]
+            truncated = bool(self._chunks) and self._chunks[0][0] > since
+            return chunks, self._next_seq, truncated, self._closed
+
+
+class Job:
+    def __init__(self, command, app_slug=None, timeout=None):
+        self.id = uuid.uuid4().hex
+        self.command = command
+        self.app_slug = app_slug
+        self.timeout = timeout
+        self.state = QUEUED
+        self.result = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_requested = False
+        self.output = OutputBuffer()
+        self._processes = set()
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    @property
+    def finished(self):
+        return self.state in FINISHED_STATES
+
+    def remaining(self):
+        """Seconds left before the job's deadline, or None without a timeout."""
+        if self.timeout is None or self.started_at is None:
+            return self.timeout
+        return max(0.0, self.started_at + self.timeout - time.time())
+
+    def start(self):
+        with self._lock:
+            if self.cancel_requested:
+                return False
+            self.state = RUNNING
+            self.started_at = time.time()
+            return True
+
+    def finish(self, result):
+        with self._lock:
+            if self.cancel_requested:
+                self.state = CANCELLED
+            elif result.get("status") == "success":
+                self.state = SUCCEEDED
+            else:
+                self.state = FAILED
+            self.result = result
+            self.finished_at = time.time()
+        self.output.close()
+        self._done.set()
+
+    def attach(self, proc):
+        with self._lock:
+            self._processes.add(proc)
+            cancelled = self.cancel_requested
+        if cancelled:
+            kill_tree(proc)
+
+    def detach(self, proc):
+        with self._lock:
+            self._processes.discard(proc)
+
+    def cancel(self):
+        with self._lock:
+            if self.finished:
+                return False
+            self.cancel_requested = True
+            if self.state == QUEUED:
+                self.state = CANCELLED
+                self.result = {"status": "error", "message": "Cancelled before start"}
+                self.finished_at = time.time()
+                self.output.close()
+                self._done.set()
+            processes = list(self._processes)
+        for proc in processes:
+            kill_tree(proc)
+        return True
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    @contextmanager
+    def bound(self):
+        """Make this the current job of the calling thread (e.g. a helper thread)."""
+        previous = current_job()
+        _local.job = self
+        try:
+            yield self
+        finally:
+            _local.job = previous
+
+    def run(self, fn, *args):
+        """Execute fn in the calling thread with this job as the current job."""
+        if not self.start():
+            return
+        with self.bound():
+            try:
+                result = fn(*args)
+            except Exception as e:
+                result = {"status": "error", "message": str(e)}
+        self.finish(result)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "command": self.command,
+            "app_slug": self.app_slug,
+            "state": self.state,
+            "result": self.result,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "timeout": self.timeout,
+        }
+
+
+class JobTable:
+    """In-memory job registry that forgets the oldest finished jobs first."""
+
+    def __init__(self, max_jobs=200):
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, job):
+        with self._lock:
+            while len(self._jobs) >= self.max_jobs:
+                victim = next((j for j in self._jobs.values() if j.finished), None)
+                if victim is None:
+                    raise JobTableFull("Too many unfinished jobs")
+                del self._jobs[victim.id]
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._jobs)
@@ -0,0 +1,276 @@
+"""
+Host metrics sampler and the shared ring buffer it writes.
+
+One process samples CPU, memory, disk and load at a fixed interval into an
+mmap-backed file (in /dev/shm, so memory only). Every dashboard worker maps
+the same file and reads the latest sample or recent history without calling
+psutil itself: numbers are consistent across workers and a page view costs
+no syscalls beyond the first mapping.
+
+Raw samples are rolled up into 1m, 5m and 1h averages as they arrive, each
+in its own fixed-size ring, so the file never grows. The same layout with
+several named series holds per-app container stats (ops.container_stats).
+
+    python3 -m ops.metrics
+"""
+import argparse
+import mmap
+import os
+import struct
+import time
+
+METRICS_FILE = os.environ.get("GRIDOPS_METRICS_FILE", "/dev/shm/gridops-metrics")
+SAMPLE_INTERVAL = float(os.environ.get("GRIDOPS_METRICS_INTERVAL", "5"))
+# Samples older than this many intervals mean the sampler isn't running
+STALE_INTERVALS = 3
+
+# (name, seconds per slot, slots); slot 0 ("raw") holds samples as taken
+RINGS = (
+    ("raw", 0, 720),
+    ("1m", 60, 1440),
+    ("5m", 300, 2016),
+    ("1h", 3600, 8760),
+)
+FIELDS = ("cpu", "ram", "disk", "load")
+
+# Series names are stored NUL-padded in each series' slot
+NAME_SIZE = 64
+
+
+class Layout:
+    """
+    Byte layout of a metrics file: a header, then `series` independent
+    slots, each with its own name, counters and rings.
+    """
+
+    def __init__(self, magic, rings, fields, series=1):
+        self.magic = magic
+        self.rings = rings
+        self.fields = fields
+        self.series = series
+        # magic, seq (odd while a write is in progress)
+        self.header = struct.Struct("<8sQ")
+        # name, time of the last sample, samples written per ring
+        self.slot = struct.Struct(f"<{NAME_SIZE}sd{len(rings)}Q")
+        self.record = struct.Struct(f"<d{len(fields)}f")
+        self.ring_offsets = []
+        offset = self.slot.size
+        for _, _, slots in rings:
+            self.ring_offsets.append(offset)
+            offset += slots * self.record.size
+        self.series_size = offset
+        self.size = self.header.size + series * self.series_size
+        self.ring_index = {name: i for i, (name, _, _) in enumerate(rings)}
+
+    def base(self, series):
+        return self.header.size + series * self.series_size
+
+    def record_offset(self, series, ring, index):
+        _, _, slots = self.rings[ring]
+        return self.base(series) + self.ring_offsets[ring] + (index % slots) * self.record.size
+
+
+HOST_LAYOUT = Layout(b"GOMETRC2", RINGS, FIELDS)
+FILE_SIZE = HOST_LAYOUT.size
+
+
+class MetricsWriter:
+    """Single writer; readers never block it."""
+
+    def __init__(self, path=METRICS_FILE, layout=HOST_LAYOUT):
+        self.path = path
+        self.layout = layout
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            # Reuse a valid file so readers keep their mapping across restarts
+            fresh = os.fstat(fd).st_size != layout.size
+            if fresh:
+                os.ftruncate(fd, layout.size)
+            self.map = mmap.mmap(fd, layout.size)
+        finally:
+            os.close(fd)
+        magic, seq = layout.header.unpack_from(self.map, 0)
+        if fresh or magic != layout.magic:
+            self.map[:] = bytes(layout.size)
+            layout.header.pack_into(self.map, 0, layout.magic, 0)
+            seq = 0
+        self.seq = seq + (seq & 1)
+        self.names = []
+        self.last = []
+        self.counts = []
+        for series in range(layout.series):
+            name, last, *counts = layout.slot.unpack_from(self.map, layout.base(series))
+            self.names.append(name.rstrip(b"\0").decode(errors="replace"))
+            self.last.append(last)
+            self.counts.append(counts)
+        # Running sums of the bucket each rollup is filling, per series
+        self.buckets = [[None] * len(layout.rings) for _ in range(layout.series)]
+
+    def _bump(self):
+        self.seq += 1
+        self.layout.header.pack_into(self.map, 0, self.layout.magic, self.seq)
+
+    def _store_slot(self, series):
+        self.layout.slot.pack_into(self.map, self.layout.base(series), self.names[series].encode()[:NAME_SIZE],
+                                   self.last[series], *self.counts[series])
+
+    def _append(self, series, ring, timestamp, values):
+        offset = self.layout.record_offset(series, ring, self.counts[series][ring])
+        self.layout.record.pack_into(self.map, offset, timestamp, *values)
+        self.counts[series][ring] += 1
+
+    def assign(self, name, keep=()):
+        """
+        Series index for `name`. A new name takes a free slot, or the one
+        written least recently when all are taken, so the file never grows.
+        Slots of names in `keep` are never taken; None when no other is left.
+        """
+        if name in self.names:
+            return self.names.index(name)
+        free = [i for i, taken in enumerate(self.names) if not taken]
+        if free:
+            series = free[0]
+        else:
+            evictable = [i for i, taken in enumerate(self.names) if taken not in keep]
+            if not evictable:
+                return None
+            series = min(evictable, key=self.last.__getitem__)
+        self._bump()
+        self.names[series] = name
+        self.last[series] = 0.0
+        self.counts[series] = [0] * len(self.layout.rings)
+        self.buckets[series] = [None] * len(self.layout.rings)
+        self._store_slot(series)
+        self._bump()
+        return series
+
+    def write(self, timestamp, values, series=0):
+        self._bump()
+        self._append(series, 0, timestamp, values)
+        buckets = self.buckets[series]
+        for ring, (_, period, _) in enumerate(self.layout.rings):
+            if not period:
+                continue
+            start = timestamp - timestamp % period
+            bucket = buckets[ring]
+            if bucket is not None and bucket[0] != start:
+                # Bucket complete: store its average, stamped with its start
+                count = bucket[1]
+                self._append(series, ring, bucket[0], [total / count for total in bucket[2]])
+                bucket = None
+            if bucket is None:
+                bucket = buckets[ring] = [start, 0, [0.0] * len(values)]
+            bucket[1] += 1
+            bucket[2] = [total + value for total, value in zip(bucket[2], values)]
+        self.last[series] = timestamp
+        self._store_slot(series)
+        self._bump()
+
+    def close(self):
+        self.map.close()
+
+
+class MetricsReader:
+    """Maps the sampler's file once and reads it lock-free (seqlock)."""
+
+    def __init__(self, path=METRICS_FILE, interval=SAMPLE_INTERVAL, layout=HOST_LAYOUT):
+        self.path = path
+        self.interval = interval
+        self.layout = layout
+        self.map = None
+
+    def _mapping(self):
+        if self.map is None:
+            try:
+                fd = os.open(self.path, os.O_RDONLY)
+            except OSError:
+                return None
+            try:
+                if os.fstat(fd).st_size != self.layout.size:
+                    return None
+                self.map = mmap.mmap(fd, self.layout.size, prot=mmap.PROT_READ)
+            finally:
+                os.close(fd)
+        return self.map
+
+    def _consistent(self, read):
+        data = self._mapping()
+        if data is None:
+            return None
+        for _ in range(10):
+            magic, seq = self.layout.header.unpack_from(data, 0)
+            if magic != self.layout.magic:
+                return None
+            if seq & 1:
+                time.sleep(0.0001)
+                continue
+            result = read(data)
+            if self.layout.header.unpack_from(data, 0)[1] == seq:
+                return result
+        return None
+
+    def _records(self, data, series, ring, limit):
+        layout = self.layout
+        _, _, slots = layout.rings[ring]
+        count = layout.slot.unpack_from(data, layout.base(series))[2 + ring]
+        n = min(count, slots, limit or slots)
+        records = []
+        for index in range(count - n, count):
+            timestamp, *values = layout.record.unpack_from(data, layout.record_offset(series, ring, index))
+            records.append(dict(zip(layout.fields, values), timestamp=timestamp))
+        return records
+
+    def series(self):
+        """Name -> index of every series written so far."""
+        def read(data):
+            names = {}
+            for series in range(self.layout.series):
+                name = self.layout.slot.unpack_from(data, self.layout.base(series))[0].rstrip(b"\0")
+                if name:
+                    names[name.decode(errors="replace")] = series
+            return names
+        return self._consistent(read) or {}
+
+    def latest(self, series=0):
+        """The newest raw sample, or None when there is no fresh one."""
+        records = self._consistent(lambda data: self._records(data, series, 0, 1))
+        if not records or records[-1]["timestamp"] < time.time() - STALE_INTERVALS * self.interval:
+            return None
+        return records[-1]
+
+    def history(self, resolution="raw", limit=None, series=0):
+        """Samples of one ring, oldest first."""
+        ring = self.layout.ring_index[resolution]
+        return self._consistent(lambda data: self._records(data, series, ring, limit)) or []
+
+
+def sample(disk_path="/"):
+    import psutil
+    return [
+        psutil.cpu_percent(interval=None),
+        psutil.virtual_memory().percent,
+        psutil.disk_usage(disk_path).percent,
+        os.getloadavg()[0],
+    ]
+
+
+def run(path=METRICS_FILE, interval=SAMPLE_INTERVAL):
+    writer = MetricsWriter(path)
+    sample()  # primes cpu_percent's baseline
+    next_tick = time.monotonic()
+    while True:
+        next_tick += interval
+        time.sleep(max(0, next_tick - time.monotonic()))
+        writer.write(time.time(), sample())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GridOps host metrics sampler")
+    parser.add_argument("--file", default=METRICS_FILE)
+    parser.add_argument("--interval", type=float, default=SAMPLE_INTERVAL)
+    args = parser.parse_args()
+    run(args.file, args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Wire format between the dashboard and the ops runner.
+
+Every message is a JSON object in a frame: a 1-byte protocol version and a
+4-byte big-endian payload length, followed by the UTF-8 JSON payload. A
+connection carries any number of frames in both directions. Requests carry an
+"id" that the runner echoes on every response frame, so replies to requests
+issued concurrently on one connection can be told apart. Streaming replies
+set "more": true on every frame except the last.
+
+Legacy clients that send a bare JSON document and shut down their write side
+are still understood by the runner; their first byte is "{" which is never a
+valid version byte.
+"""
+import asyncio
+import json
+import struct
+
+VERSION = 1
+HEADER = struct.Struct("!BI")
+# Guard against garbage or hostile length prefixes
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def encode_frame(message, version=VERSION):
+    payload = json.dumps(message).encode()
+    if len(payload) > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame too large ({len(payload)} bytes)")
+    return HEADER.pack(version, len(payload)) + payload
+
+
+def decode_header(header):
+    version, length = HEADER.unpack(header)
+    if version != VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version}")
+    if length > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame too large ({length} bytes)")
+    return length
+
+
+def decode_payload(payload):
+    try:
+        return json.loads(payload)
+    except ValueError:
+        raise ProtocolError("Invalid JSON")
+
+
+def recv_exact(sock, size):
+    """Read exactly `size` bytes, or None if the peer closed before sending any."""
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            if received == 0:
+                return None
+            raise ProtocolError("Connection closed mid-frame")
+        received += n
+    return bytes(buf)
+
+
+def read_frame(sock):
+    """Next message from a blocking socket, or None on a clean EOF."""
+    header = recv_exact(sock, HEADER.size)
+    if header is None:
+        return None
+    length = decode_header(header)
+    payload = recv_exact(sock, length) if length else b""
+    if payload is None:
+        raise ProtocolError("Connection closed mid-frame")
+    return decode_payload(payload)
+
+
+def write_frame(sock, message):
+    sock.sendall(encode_frame(message))
+
+
+
+async def read_frame_async(reader):
+    """asyncio counterpart of read_frame for a StreamReader."""
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise ProtocolError("Connection closed mid-frame")
+    length = decode_header(header)
+    try:
+        payload = await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        raise ProtocolError("Connection closed mid-frame")
+    return decode_payload(payload)
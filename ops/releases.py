@@ -0,0 +1,237 @@
+"""
+Versioned releases of GridOps itself.
+
+An update is exported from git into its own directory under releases/ and
+gets its virtualenv, migrations and static files before anything runs from
+it. It goes live by atomically repointing the `current` symlink the services
+run from; the release it replaces stays on disk behind `previous`, so a
+rollback is one more symlink swap.
+
+    /srv/gridops/current  -> releases/20261018T120000-1a2b3c4d5e6f
+    /srv/gridops/previous -> releases/20261011T090000-0f9e8d7c6b5a
+
+Virtualenvs live in venvs/<hash of requirements.txt>, so a release whose
+requirements didn't change reuses the previous one instead of reinstalling.
+"""
+import datetime
+import hashlib
+import os
+import shutil
+import subprocess
+import tarfile
+
+GRIDOPS_DIR = "/srv/gridops"
+# The git checkout releases are exported from (the original install)
+REPO_DIR = GRIDOPS_DIR
+RELEASES_DIR = os.path.join(GRIDOPS_DIR, "releases")
+VENVS_DIR = os.path.join(GRIDOPS_DIR, "venvs")
+CURRENT_LINK = os.path.join(GRIDOPS_DIR, "current")
+PREVIOUS_LINK = os.path.join(GRIDOPS_DIR, "previous")
+ENV_FILE = os.path.join(GRIDOPS_DIR, ".env")
+UPDATE_BRANCH = os.environ.get("GRIDOPS_BRANCH", "main")
+REQUIREMENTS = os.path.join("dashboard", "requirements.txt")
+# State that outlives releases, linked into each one from GRIDOPS_DIR
+SHARED_PATHS = [os.path.join("dashboard", "db.sqlite3"), os.path.join("dashboard", "media")]
+REVISION_FILE = "REVISION"
+VENV_MARKER = ".complete"
+KEEP_RELEASES = 5
+TIMESTAMP_FORMAT = "%Y%m%dT%H%M%S"
+
+
+class ReleaseError(Exception):
+    pass
+
+
+def _run(command, cwd=None, env=None):
+    proc = subprocess.run(command, cwd=cwd, env=env, capture_output=True, text=True)
+    return {"status": "success" if proc.returncode == 0 else "error",
+            "stdout": proc.stdout, "stderr": proc.stderr}
+
+
+def check(res, what):
+    if res.get("status") != "success":
+        detail = (res.get("stderr") or res.get("message") or "").strip()
+        raise ReleaseError(f"{what} failed: {detail[-500:]}")
+    return res
+
+
+def fetch(branch=UPDATE_BRANCH, run=_run):
+    """Fetch the update branch; returns the commit it points at."""
+    check(run(["git", "fetch", "--quiet", "origin", branch], cwd=REPO_DIR), "git fetch")
+    res = check(run(["git", "rev-parse", "--verify", "FETCH_HEAD^{commit}"], cwd=REPO_DIR), "git rev-parse")
+    return res["stdout"].strip()
+
+
+def export_tree(revision, target):
+    # git archive straight into the release directory, no working tree needed
+    proc = subprocess.Popen(["git", "archive", "--format=tar", revision], cwd=REPO_DIR,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    with tarfile.open(fileobj=proc.stdout, mode="r|") as tar:
+        tar.extractall(target, filter="data")
+    stderr = proc.stderr.read().decode(errors="replace")
+    if proc.wait() != 0:
+        raise ReleaseError(f"git archive failed: {stderr.strip()}")
+    with open(os.path.join(target, REVISION_FILE), "w") as f:
+        f.write(revision + "\n")
+
+
+def link_shared(release_dir):
+    for path in SHARED_PATHS:
+        shared = os.path.join(GRIDOPS_DIR, path)
+        target = os.path.join(release_dir, path)
+        if not os.path.exists(shared):
+            continue
+        if os.path.lexists(target):
+            if os.path.isdir(target) and not os.path.islink(target):
+                shutil.rmtree(target)
+            else:
+                os.remove(target)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.symlink(shared, target)
+
+
+def requirements_digest(release_dir):
+    path = os.path.join(release_dir, REQUIREMENTS)
+    content = b""
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            content = f.read()
+    return hashlib.sha256(content).hexdigest()[:16]
+
+
+def ensure_venv(release_dir, run=_run, progress=None):
+    """The virtualenv for the release's requirements, built only if missing."""
+    progress = progress or (lambda text: None)
+    venv_dir = os.path.join(VENVS_DIR, requirements_digest(release_dir))
+    if os.path.exists(os.path.join(venv_dir, VENV_MARKER)):
+        progress(f"Reusing virtualenv {os.path.basename(venv_dir)}\n")
+        return venv_dir
+    # Built in place: a virtualenv's scripts hardcode its path, so it can't be moved
+    shutil.rmtree(venv_dir, ignore_errors=True)
+    os.makedirs(VENVS_DIR, exist_ok=True)
+    progress(f"Creating virtualenv {os.path.basename(venv_dir)}\n")
+    check(run(["python3", "-m", "venv", venv_dir]), "venv")
+    pip = os.path.join(venv_dir, "bin", "pip")
+    check(run([pip, "install", "--quiet", "-r", os.path.join(release_dir, REQUIREMENTS)]), "pip install")
+    os.makedirs(venv_dir, exist_ok=True)
+    open(os.path.join(venv_dir, VENV_MARKER), "w").close()
+    return venv_dir
+
+
+def build_release(revision, run=_run, env=None, progress=None):
+    """
+    Export `revision` and prepare it to run: shared state linked in,
+    dependencies installed, migrations applied and static files collected.
+    Nothing switches to it yet; returns the release directory.
+    """
+    progress = progress or (lambda text: None)
+    stamp = datetime.datetime.now().strftime(TIMESTAMP_FORMAT)
+    release_dir = os.path.join(RELEASES_DIR, f"{stamp}-{revision[:12]}")
+    building = release_dir + ".building"
+    shutil.rmtree(building, ignore_errors=True)
+    os.makedirs(building)
+    try:
+        progress(f"Exporting {revision[:12]}\n")
+        export_tree(revision, building)
+        link_shared(building)
+        venv_dir = ensure_venv(building, run, progress)
+        os.symlink(venv_dir, os.path.join(building, "venv"))
+
+        # Migrations run while the old release still serves, so they have to
+        # be compatible with it (additive), as with any rolling deploy
+        manage = [os.path.join(venv_dir, "bin", "python"), "manage.py"]
+        dashboard = os.path.join(building, "dashboard")
+        progress("Applying migrations\n")
+        check(run(manage + ["migrate", "--noinput"], cwd=dashboard, env=env), "migrate")
+        progress("Collecting static files\n")
+        check(run(manage + ["collectstatic", "--noinput"], cwd=dashboard, env=env), "collectstatic")
+        os.rename(building, release_dir)
+    except BaseException:
+        shutil.rmtree(building, ignore_errors=True)
+        raise
+    return release_dir
+
+
+def swap_link(link, target):
+    # rename(2) over the old symlink: readers see the old target or the new one
+    tmp = f"{link}.tmp-{os.getpid()}"
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    os.symlink(target, tmp)
+    os.replace(tmp, link)
+
+
+def current_release():
+    return os.path.realpath(CURRENT_LINK) if os.path.lexists(CURRENT_LINK) else None
+
+
+def previous_release():
+    return os.path.realpath(PREVIOUS_LINK) if os.path.lexists(PREVIOUS_LINK) else None
+
+
+def release_revision(release_dir):
+    try:
+        with open(os.path.join(release_dir, REVISION_FILE)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def release_venv(release_dir):
+    return os.path.realpath(os.path.join(release_dir, "venv")) if release_dir else None
+
+
+def activate(release_dir):
+    """Make `release_dir` current; returns the release it replaced."""
+    old = current_release()
+    swap_link(CURRENT_LINK, release_dir)
+    if old and old != os.path.realpath(release_dir):
+        swap_link(PREVIOUS_LINK, old)
+    return old
+
+
+def rollback():
+    """Switch back to the previous release; returns it."""
+    target = previous_release()
+    if not target or not os.path.isdir(target):
+        raise ReleaseError("No previous release to roll back to")
+    activate(target)
+    return target
+
+
+def list_releases():
+    current, previous = current_release(), previous_release()
+    releases = []
+    if os.path.isdir(RELEASES_DIR):
+        for name in sorted(os.listdir(RELEASES_DIR)):
+            path = os.path.join(RELEASES_DIR, name)
+            if name.endswith(".building") or not os.path.isdir(path):
+                continue
+            releases.append({
+                "id": name,
+                "revision": release_revision(path),
+                "current": path == current,
+                "previous": path == previous,
+            })
+    return releases
+
+
+def prune(keep=KEEP_RELEASES):
+    """Remove all but the newest `keep` releases, and venvs no release uses."""
+    pinned = {current_release(), previous_release()}
+    names = [r["id"] for r in list_releases()]
+    removed = []
+    for name in names[:-keep] if keep else names:
+        path = os.path.join(RELEASES_DIR, name)
+        if path not in pinned:
+            shutil.rmtree(path, ignore_errors=True)
+            removed.append(name)
+
+    used = {release_venv(os.path.join(RELEASES_DIR, r["id"])) for r in list_releases()}
+    used |= {release_venv(path) for path in pinned if path}
+    if os.path.isdir(VENVS_DIR):
+        for name in os.listdir(VENVS_DIR):
+            path = os.path.join(VENVS_DIR, name)
+            if path not in used:
+                shutil.rmtree(path, ignore_errors=True)
+    return removed
@@ -0,0 +1,206 @@
+"""
+Backup destinations. Both kinds expose the same calls:
+
+    list(prefix) -> {relative path: size} of files under prefix
+    put(path, data, limiter=None) -> upload one object
+    copy_files(source_dir, paths, ...) -> upload many local files at once
+
+RcloneRemote copies a batch of files with a single `rclone copy`, which runs
+its own parallel transfers and bandwidth limit, and streams single objects
+into `rclone rcat`. LocalRemote writes to a directory and stands in for a real
+remote in tests (or backs up to an attached disk).
+"""
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Everything GridOps uploads lives under this folder on the remote
+REMOTE_ROOT = "gridops-backups"
+# Local destinations (an attached disk mounted here, say) must be inside this
+# directory: the path comes from the web process, the runner writes as root
+LOCAL_REMOTES_DIR = os.environ.get("GRIDOPS_LOCAL_REMOTES", "/srv/gridops/backups/remotes")
+# Size of the writes fed to rclone / the bandwidth limiter
+PIECE_SIZE = 256 * 1024
+
+UNITS = {"": 1024, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "B": 1}
+
+
+class RemoteError(Exception):
+    pass
+
+
+def parse_rate(value):
+    """rclone-style bandwidth ("512", "10M", "1.5G"; bare numbers are KiB/s) -> bytes/s."""
+    if value in (None, "", 0, "0"):
+        return None
+    match = re.fullmatch(r"\s*([\d.]+)\s*([KMGB]?)i?\s*", str(value), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid bandwidth limit: {value}")
+    return int(float(match.group(1)) * UNITS[match.group(2).upper()])
+
+
+class RateLimiter:
+    """Token bucket shared by all transfer threads."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._tokens = rate
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, size):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= size
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+
+def _run(command):
+    proc = subprocess.run(command, capture_output=True, text=True)
+    return {"status": "success" if proc.returncode == 0 else "error",
+            "stdout": proc.stdout, "stderr": proc.stderr}
+
+
+def pieces(data, limiter):
+    view = memoryview(data)
+    for offset in range(0, len(view), PIECE_SIZE):
+        piece = view[offset:offset + PIECE_SIZE]
+        if limiter is not None:
+            limiter.consume(len(piece))
+        yield piece
+
+
+class LocalRemote:
+    def __init__(self, path):
+        self.root = path
+
+    def __str__(self):
+        return self.root
+
+    def list(self, prefix):
+        base = os.path.join(self.root, prefix)
+        found = {}
+        for dirpath, _, filenames in os.walk(base):
+            for name in filenames:
+                if name.startswith(".tmp-"):
+                    continue
+                full = os.path.join(dirpath, name)
+                found[os.path.relpath(full, base)] = os.path.getsize(full)
+        return found
+
+    def put(self, path, data, limiter=None):
+        target = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target), prefix=".tmp-")
+        with os.fdopen(fd, "wb") as f:
+            for piece in pieces(data, limiter):
+                f.write(piece)
+        os.replace(tmp, target)
+
+    def copy_files(self, source_dir, paths, limiter=None, transfers=4, cancelled=None):
+        cancelled = cancelled or (lambda: False)
+
+        def copy(path):
+            if cancelled():
+                return
+            with open(os.path.join(source_dir, path), "rb") as f:
+                self.put(path, f.read(), limiter)
+
+        with ThreadPoolExecutor(max_workers=transfers) as pool:
+            list(pool.map(copy, paths))
+
+
+class RcloneRemote:
+    def __init__(self, name, config_path, root=REMOTE_ROOT, timeout=300, run=_run):
+        self.name = name
+        self.config_path = config_path
+        self.root = root
+        # Single commands (list, rcat) are bounded by `timeout`; a batch copy
+        # goes through `run`, which the runner ties to the job's timeout and cancel
+        self.timeout = timeout
+        self.run = run
+
+    def __str__(self):
+        return f"{self.name}:{self.root}"
+
+    def _target(self, path):
+        return f"{self.name}:{self.root}/{path}"
+
+    def _command(self, *args):
+        return ["rclone", *args, "--config", self.config_path]
+
+    def list(self, prefix):
+        proc = subprocess.run(
+            self._command("lsf", "-R", "--files-only", "--format", "ps", "--separator", "\t",
+                          self._target(prefix)),
+            capture_output=True, text=True, timeout=self.timeout,
+        )
+        if proc.returncode == 3:
+            # Directory not found: nothing uploaded yet
+            return {}
+        if proc.returncode != 0:
+            raise RemoteError(proc.stderr.strip() or f"rclone lsf exited with {proc.returncode}")
+        found = {}
+        for line in proc.stdout.splitlines():
+            path, _, size = line.rpartition("\t")
+            if path:
+                found[path] = int(size)
+        return found
+
+    def _bwlimit(self, limiter):
+        # rclone paces itself; the limiter only carries the rate
+        return ["--bwlimit", f"{max(1, limiter.rate // 1024)}K"] if limiter is not None else []
+
+    def put(self, path, data, limiter=None):
+        proc = subprocess.Popen(
+            self._command("rcat", "--size", str(len(data)), *self._bwlimit(limiter), self._target(path)),
+            stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        )
+        try:
+            _, stderr = proc.communicate(data, timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
+            raise RemoteError(f"rclone rcat timed out after {self.timeout}s")
+        if proc.returncode != 0:
+            raise RemoteError(stderr.decode(errors="replace").strip() or f"rclone rcat exited with {proc.returncode}")
+
+    def copy_files(self, source_dir, paths, limiter=None, transfers=4, cancelled=None):
+        if not paths:
+            return
+        with tempfile.NamedTemporaryFile("w", prefix="gridops-upload-") as listing:
+            listing.write("".join(f"{path}\n" for path in paths))
+            listing.flush()
+            res = self.run(self._command(
+                "copy", source_dir, f"{self.name}:{self.root}",
+                "--files-from-raw", listing.name, "--no-traverse",
+                "--transfers", str(transfers), *self._bwlimit(limiter),
+            ))
+        if res.get("status") != "success":
+            raise RemoteError((res.get("stderr") or res.get("message") or "rclone copy failed").strip()[-500:])
+
+
+def open_remote(spec, config_path, local_root=None, run=_run):
+    """
+    An absolute path is a local directory under `local_root`; anything else
+    names an rclone remote.
+    """
+    if spec.startswith("/"):
+        base = os.path.normpath(local_root or LOCAL_REMOTES_DIR)
+        path = os.path.normpath(spec)
+        if ".." in spec.split("/") or os.path.commonpath([base, path]) != base:
+            raise ValueError(f"Local backup destinations must be under {base}")
+        return LocalRemote(path)
+    if not re.fullmatch(r"[\w.-]+", spec):
+        raise ValueError("Invalid remote name")
+    if not os.path.exists(config_path):
+        raise ValueError("No rclone config saved")
+    return RcloneRemote(spec, config_path, run=run)
@@ -1,13 +1,35 @@
+import codecs
+import hashlib
 import os
+import re
+import select
 import socket
-import struct
+import socketserver
+import sqlite3
 import json
 import subprocess
 import logging
 import signal
 import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from pathlib import Path
 
+from . import backups, releases, remotes, system_backup, update_snapshots
+from .caddy_api import CADDY_ADMIN, CaddyAdmin, CaddyAPIError
+from .docker_api import (
+    DOCKER_SOCKET, PROJECT_LABEL, DockerAPIError, DockerClient, container_summary, dependency_order, depends_on,
+    service_order,
+)
+from .jobs import Job, JobTable, JobTableFull, current_job, emit, kill_tree
+from .protocol import ProtocolError, read_frame, write_frame
+from .scheduler import Coalescer, Scheduler
+from .state import StateCache
+from .container_stats import StatsCollector
+
 # Configuration
 SOCKET_PATH = "/srv/gridops/ops/runner.sock"
 APPS_DIR = "/srv/gridops/apps"
@@ -15,31 +37,298 @@ CADDY_FILE = "/etc/caddy/Caddyfile"
 LOG_FILE = "/var/log/gridops/runner.log"
 RCLONE_CONFIG_DIR = "/srv/gridops/rclone"
 RCLONE_MOUNT_DIR = "/srv/gridops/rclone_mounts"
+BACKUP_STORE_DIR = os.environ.get("GRIDOPS_BACKUP_STORE", backups.STORE_DIR)
+# Snapshots kept per app; older ones are pruned after each backup
+BACKUP_KEEP = int(os.environ.get("GRIDOPS_BACKUP_KEEP", str(backups.KEEP_SNAPSHOTS)))
+# Parallel chunk uploads when a backup goes to a remote
+BACKUP_TRANSFERS = int(os.environ.get("GRIDOPS_BACKUP_TRANSFERS", "4"))
+DOCKER_SOCKET_PATH = os.environ.get("GRIDOPS_DOCKER_SOCKET", DOCKER_SOCKET)
+CADDY_ADMIN_ADDRESS = os.environ.get("GRIDOPS_CADDY_ADMIN", CADDY_ADMIN)
+# Docker network every app's web service joins, shared with the proxy
+GRIDOPS_NETWORK = os.environ.get("GRIDOPS_NETWORK", "gridops")
+# Compose merges this into docker-compose.yml for every command run in the app dir
+OVERRIDE_FILE = "docker-compose.override.yml"
+MAX_REPLICAS = 16
+# Upper bound on commands executing at once, across all apps
+MAX_CONCURRENCY = int(os.environ.get("GRIDOPS_RUNNER_CONCURRENCY", "4"))
+
+# Finished jobs kept for status queries before the oldest are evicted
+MAX_JOBS = int(os.environ.get("GRIDOPS_RUNNER_MAX_JOBS", "200"))
+
+# Commands that run in the background and answer with a job id right away
+JOB_COMMANDS = {
+    'install_app', 'start_app', 'stop_app', 'restart_app', 'pull_app', 'scale_app',
+    'backup_app', 'restore_app', 'system_backup', 'self_update', 'rollback_release',
+    'restore_checkpoint', 'mount_rclone', 'batch',
+}
+# Only the tail of a command's output goes into its result; the full stream
+# is available incrementally through job_output / stream_job.
+OUTPUT_TAIL_BYTES = 16 * 1024
+# How long output may keep flowing after a command exited. A grandchild that
+# inherited stdout (a daemon the command forked) can hold the pipes open forever.
+OUTPUT_DRAIN_TIMEOUT = 5
+# Per-command job timeouts in seconds; a request may lower or raise them with "timeout"
+DEFAULT_TIMEOUT = 600
+COMMAND_TIMEOUTS = {
+    'install_app': 1800,
+    'pull_app': 1800,
+    'scale_app': 1800,
+    'backup_app': 3600,
+    'restore_app': 3600,
+    'system_backup': 3600,
+    'self_update': 3600,
+    'batch': 3600,
+}
+# Apps a batch works on at once unless the request asks for something else
+BATCH_PARALLELISM = int(os.environ.get("GRIDOPS_BATCH_PARALLELISM", "2"))
+
+# Commands that write the Caddyfile or Caddy's config share one lock
+PROXY_COMMANDS = {'reload_proxy', 'update_route'}
+# Proxy reloads requested within this many seconds are folded into one
+PROXY_RELOAD_WINDOW = float(os.environ.get("GRIDOPS_PROXY_RELOAD_WINDOW", "0.5"))
+
+# Commands that switch GridOps releases never overlap
+RELEASE_COMMANDS = {'self_update', 'rollback_release', 'restore_checkpoint'}
+# Services with the database open, stopped while a checkpoint restores it
+DATABASE_SERVICES = ["gridops-web", "gridops-worker"]
+# Bringing them back is not bound by the job's deadline: a restore that ran
+# out of time must not leave the dashboard down
+SERVICE_START_TIMEOUT = 120
+# After a release switch the runner re-execs once running jobs are done;
+# it waits this long more so clients can still collect the last results
+DRAIN_GRACE = 3
+
+ENGINE_VERBS = {'start': 'Starting', 'stop': 'Stopping', 'restart': 'Restarting'}
+BATCH_ACTIONS = {'start', 'stop', 'restart', 'pull'}
 
-logging.basicConfig(filename=LOG_FILE, level=logging.INFO, format='%(asctime)s %(message)s')
+scheduler = Scheduler(MAX_CONCURRENCY)
+backup_store = backups.ChunkStore(BACKUP_STORE_DIR)
+caddy = CaddyAdmin(CADDY_ADMIN_ADDRESS)
+docker = DockerClient(DOCKER_SOCKET_PATH)
+# Fed by the Docker events stream once main() starts it
+state = StateCache(docker)
+# Per-app resource usage, following the containers the state cache knows about
+container_stats = StatsCollector(docker, state)
+jobs = JobTable(MAX_JOBS)
+# Set once a release switch is pending: new jobs are refused until the re-exec
+draining = threading.Event()
+server = None
 
-def run_command(command, cwd=None, env=None):
+class OutputTail:
+    """Keeps the last `max_bytes` of a stream for the final command result."""
+
+    def __init__(self, max_bytes=OUTPUT_TAIL_BYTES):
+        self.max_bytes = max_bytes
+        self._parts = deque()
+        self._size = 0
+
+    def append(self, data):
+        self._parts.append(data)
+        self._size += len(data)
+        while self._size > self.max_bytes and len(self._parts) > 1:
+            self._size -= len(self._parts.popleft())
+
+    def text(self):
+        return "".join(self._parts)[-self.max_bytes:]
+
+def pump_output(pipe, stream, tail, job, stop):
+    # Forward output as it arrives instead of buffering the whole run
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    fd = pipe.fileno()
+    while True:
+        if not select.select([fd], [], [], 0.2)[0]:
+            if stop.is_set():
+                data = b""
+            else:
+                continue
+        else:
+            data = os.read(fd, 65536)
+        text = decoder.decode(data, final=not data)
+        if text:
+            tail.append(text)
+            if job is not None:
+                job.output.append(stream, text)
+        if not data:
+            break
+    pipe.close()
+
+def run_command(command, cwd=None, env=None, timeout=None):
+    job = current_job()
+    if job is not None and timeout is None:
+        timeout = job.remaining()
+        if timeout is not None and timeout <= 0:
+            # The job's time ran out in an earlier step: don't start one just to kill it
+            logging.error(f"Job deadline passed before running: {command}")
+            return {"status": "error", "message": f"Timed out after {job.timeout:.0f}s", "stdout": "", "stderr": ""}
     try:
         logging.info(f"Running command: {command} in {cwd}")
-        result = subprocess.run(
+        proc = subprocess.Popen(
             command,
             cwd=cwd,
             env=env,
-            capture_output=True,
-            text=True,
-            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True, # own process group, so the whole tree can be killed
             shell=False # Security: no shell
         )
-        return {"status": "success", "stdout": result.stdout, "stderr": result.stderr}
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Command failed: {e.stderr}")
-        return {"status": "error", "stdout": e.stdout, "stderr": e.stderr}
     except Exception as e:
         logging.error(f"Exception: {str(e)}")
         return {"status": "error", "message": str(e)}
 
+    if job is not None:
+        job.attach(proc)
+    tails = {"stdout": OutputTail(), "stderr": OutputTail()}
+    stop = threading.Event()
+    pumps = [
+        threading.Thread(target=pump_output, args=(proc.stdout, "stdout", tails["stdout"], job, stop), daemon=True),
+        threading.Thread(target=pump_output, args=(proc.stderr, "stderr", tails["stderr"], job, stop), daemon=True),
+    ]
+    for pump in pumps:
+        pump.start()
+
+    timed_out = False
+    try:
+        proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        timed_out = True
+        kill_tree(proc)
+        proc.wait()
+    finally:
+        deadline = time.monotonic() + OUTPUT_DRAIN_TIMEOUT
+        for pump in pumps:
+            pump.join(max(0, deadline - time.monotonic()))
+        # Whatever still holds the pipes open doesn't get to hold the job too
+        stop.set()
+        for pump in pumps:
+            pump.join()
+        if job is not None:
+            job.detach(proc)
+
+    stdout, stderr = tails["stdout"].text(), tails["stderr"].text()
+    if timed_out:
+        logging.error(f"Command timed out after {timeout:.0f}s: {command}")
+        return {"status": "error", "message": f"Timed out after {timeout:.0f}s", "stdout": stdout, "stderr": stderr}
+    if job is not None and job.cancel_requested:
+        return {"status": "error", "message": "Cancelled", "stdout": stdout, "stderr": stderr}
+    if proc.returncode != 0:
+        logging.error(f"Command failed: {stderr}")
+        return {"status": "error", "stdout": stdout, "stderr": stderr}
+    return {"status": "success", "stdout": stdout, "stderr": stderr}
+
+def web_spec(data):
+    """
+    The request's web service: {service, port, host_port, replicas}. Returns
+    (spec, error); spec is None when the request doesn't name one.
+    """
+    web = data.get('web')
+    if not web:
+        return None, None
+    service = str(web.get('service') or "")
+    if not re.fullmatch(r"[A-Za-z0-9][\w.-]*", service):
+        return None, "Invalid web service"
+    try:
+        replicas = int(web.get('replicas') or 1)
+        port = int(web['port']) if web.get('port') else None
+        host_port = int(web['host_port']) if web.get('host_port') else None
+    except (TypeError, ValueError):
+        return None, "Invalid web service ports or replicas"
+    if not 1 <= replicas <= MAX_REPLICAS:
+        return None, f"Replicas must be between 1 and {MAX_REPLICAS}"
+    # Every port the service publishes, short syntax
+    ports = web.get('ports') or []
+    if not isinstance(ports, list) or not all(isinstance(p, str) and re.fullmatch(r"[\w.:/-]+", p) for p in ports):
+        return None, "Invalid web service ports"
+    if replicas > 1 and host_port:
+        fixed = [p for p in ports if fixed_host_port(p) not in (None, host_port)]
+        if fixed:
+            return None, (f"{service} publishes fixed host ports besides its web port ({', '.join(fixed)}), "
+                          f"so it can't run more than one replica")
+    return {"service": service, "port": port, "host_port": host_port, "replicas": replicas, "ports": ports}, None
+
+def fixed_host_port(spec):
+    """Host port of a short-syntax mapping; None when Docker picks it."""
+    mapping = spec.split("/", 1)[0].split(":")
+    if len(mapping) < 2:
+        return None
+    try:
+        return int(mapping[-2])
+    except ValueError:
+        return None
+
+def host_ports_taken(app_slug, ports):
+    """Those of `ports` something other than the app's own containers holds."""
+    own, taken = set(), set()
+    try:
+        for container in docker.list_containers():
+            project = (container.get("Labels") or {}).get(PROJECT_LABEL)
+            for binding in container.get("Ports") or []:
+                if binding.get("PublicPort") in ports:
+                    (own if project == app_slug else taken).add(binding["PublicPort"])
+    except (OSError, DockerAPIError) as e:
+        logging.info(f"Docker API unavailable, checking ports by binding only: {e}")
+    # Anything else listening (or a publish without a userland proxy) shows up on bind
+    for port in set(ports) - own - taken:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            try:
+                sock.bind(("127.0.0.1", port))
+            except OSError:
+                taken.add(port)
+    return sorted(taken)
+
+def compose_override(web):
+    """Puts the web service on the shared network and runs its replicas."""
+    lines = [
+        "# Written by GridOps: shared network and replicas of the web service",
+        "services:",
+        f"  {json.dumps(web['service'])}:",
+        "    networks:",
+        "      default: {}",
+        f"      {json.dumps(GRIDOPS_NETWORK)}: {{}}",
+        "    deploy:",
+        f"      replicas: {web['replicas']}",
+    ]
+    if web['replicas'] > 1 and web['port'] and web['host_port']:
+        # A fixed host port can only be bound once: each replica takes the
+        # next one from a range starting at the app's own
+        last = web['host_port'] + web['replicas'] - 1
+        lines += [
+            "    ports: !override",
+            f'      - "127.0.0.1:{web["host_port"]}-{last}:{web["port"]}"',
+        ]
+        # Ports whose host side Docker picks can be published by every replica
+        lines += [f"      - {json.dumps(p)}" for p in web.get('ports') or [] if fixed_host_port(p) is None]
+    lines += [
+        "networks:",
+        f"  {json.dumps(GRIDOPS_NETWORK)}:",
+        "    external: true",
+        "",
+    ]
+    return "\n".join(lines)
+
+def ensure_network():
+    """Create the shared network if needed; returns an error result or None."""
+    try:
+        if docker.ensure_network(GRIDOPS_NETWORK):
+            emit(f"Created network {GRIDOPS_NETWORK}\n")
+        return None
+    except (OSError, DockerAPIError) as e:
+        logging.info(f"Docker API unavailable, falling back to CLI: {e}")
+    res = run_command(["docker", "network", "create", GRIDOPS_NETWORK])
+    if res['status'] != 'success' and "already exists" not in res.get('stderr', ""):
+        return res
+    return None
+
+def apply_web_spec(app_dir, web):
+    error = ensure_network()
+    if error is not None:
+        return error
+    with open(os.path.join(app_dir, OVERRIDE_FILE), "w") as f:
+        f.write(compose_override(web))
+    return None
+
 def handle_install(data):
-    # data: { app_slug: str, compose_content: str, env_content: str }
+    # data: { app_slug: str, compose_content: str, env_content: str, web: {...} }
     app_slug = data.get('app_slug')
     compose_content = data.get('compose_content')
     env_content = data.get('env_content')
@@ -61,9 +350,84 @@ def handle_install(data):
         with open(os.path.join(app_dir, ".env"), "w") as f:
             f.write(env_content)
 
+    web, error = web_spec(data)
+    if error:
+        return {"status": "error", "message": error}
+    if web is not None:
+        res = apply_web_spec(app_dir, web)
+        if res is not None:
+            return res
+
     # Pull and Up
     return run_command(["docker", "compose", "up", "-d"], cwd=app_dir)
 
+def handle_scale(data):
+    # data: { app_slug: str, web: {service, port, host_port, replicas} }
+    app_slug = data.get('app_slug')
+    if not app_slug or ".." in app_slug or "/" in app_slug:
+        return {"status": "error", "message": "Invalid app_slug"}
+    app_dir = os.path.join(APPS_DIR, app_slug)
+    if not os.path.exists(app_dir):
+        return {"status": "error", "message": "App not found"}
+
+    web, error = web_spec(data)
+    if web is None:
+        return {"status": "error", "message": error or "Missing web service"}
+    if web['replicas'] > 1 and web['host_port']:
+        taken = host_ports_taken(app_slug, range(web['host_port'], web['host_port'] + web['replicas']))
+        if taken:
+            return {"status": "error", "message": f"Host port(s) {', '.join(map(str, taken))} already in use"}
+    res = apply_web_spec(app_dir, web)
+    if res is not None:
+        return res
+    emit(f"Scaling {web['service']} to {web['replicas']} replica(s)\n")
+    res = run_command(["docker", "compose", "up", "-d"], cwd=app_dir)
+    if res['status'] == 'success':
+        res['replicas'] = web['replicas']
+    return res
+
+def engine_control(app_slug, action):
+    """
+    start/stop/restart straight through the Docker Engine API, skipping the
+    compose CLI start-up. Returns None when compose has to handle it (no
+    containers yet, the daemon socket is unreachable or answers with an
+    error, or the dependency order between services can't be followed here).
+    """
+    try:
+        containers = docker.list_containers(project=app_slug)
+    except (OSError, DockerAPIError) as e:
+        logging.info(f"Docker API unavailable, falling back to CLI: {e}")
+        return None
+    if not containers:
+        return None
+
+    containers = dependency_order(containers)
+    if containers is None:
+        logging.info(f"No dependency order for {app_slug}, using compose")
+        return None
+    if action != "stop" and any(
+            condition != "service_started"
+            for container in containers for condition in (depends_on(container) or {}).values()):
+        # Waiting for a dependency to be healthy or to finish is compose's job
+        return None
+    if action == "stop":
+        containers.reverse()
+
+    job = current_job()
+    done = []
+    for container in containers:
+        if job is not None and job.cancel_requested:
+            return {"status": "error", "message": "Cancelled", "containers": done}
+        summary = container_summary(container)
+        emit(f"{ENGINE_VERBS[action]} {summary['name']}...\n")
+        try:
+            getattr(docker, f"{action}_container")(container["Id"])
+        except (OSError, DockerAPIError) as e:
+            emit(f"{summary['name']}: {e}\n", "stderr")
+            return {"status": "error", "message": str(e), "containers": done}
+        done.append(summary["name"])
+    return {"status": "success", "message": f"{action} {len(done)} container(s)", "containers": done}
+
 def handle_control(data, action):
     app_slug = data.get('app_slug')
     if not app_slug or ".." in app_slug:
@@ -73,18 +437,80 @@ def handle_control(data, action):
     if not os.path.exists(app_dir):
         return {"status": "error", "message": "App not found"}
 
-    cmd = ["docker", "compose", action]
-    if action == "restart":
-        cmd = ["docker", "compose", "restart"]
-    elif action == "stop":
-         cmd = ["docker", "compose", "stop"]
-    elif action == "start":
-         cmd = ["docker", "compose", "start"]
-    elif action == "pull":
-         cmd = ["docker", "compose", "pull"]
+    if action in ENGINE_VERBS:
+        res = engine_control(app_slug, action)
+        if res is not None:
+            return res
 
+    # pull (and anything the engine path declined) needs compose semantics
+    cmd = ["docker", "compose", action]
     return run_command(cmd, cwd=app_dir)
 
+def handle_batch(data):
+    # data: { items: [{app_slug, action}], parallelism: int }
+    items = data.get('items') or []
+    for item in items:
+        slug = item.get('app_slug') or ""
+        if not slug or ".." in slug or "/" in slug:
+            return {"status": "error", "message": f"Invalid app_slug {slug!r}"}
+        if item.get('action') not in BATCH_ACTIONS:
+            return {"status": "error", "message": f"Invalid action {item.get('action')!r}"}
+    parallelism = int(data.get('parallelism') or BATCH_PARALLELISM)
+    parallelism = max(1, min(parallelism, MAX_CONCURRENCY))
+    job = current_job()
+
+    def run_item(item):
+        slug, action = item['app_slug'], item['action']
+        with job.bound() if job is not None else nullcontext():
+            if job is not None and job.cancel_requested:
+                res = {"status": "error", "message": "Cancelled"}
+            else:
+                # Items still queue behind other work on the same app
+                with scheduler.slot(slug):
+                    res = handle_control({"app_slug": slug}, action)
+            message = res.get('message') or ""
+            emit(f"[{slug}] {action}: {res['status']}{' - ' + message if message else ''}\n")
+        return {"app_slug": slug, "action": action, "status": res['status'], "message": message}
+
+    with ThreadPoolExecutor(max_workers=parallelism) as pool:
+        results = list(pool.map(run_item, items))
+
+    failed = sum(1 for r in results if r['status'] != 'success')
+    return {
+        "status": "error" if failed else "success",
+        "message": f"{len(results) - failed}/{len(results)} succeeded",
+        "results": results,
+    }
+
+def handle_inspect_app(data):
+    app_slug = data.get('app_slug')
+    if not app_slug or ".." in app_slug:
+         return {"status": "error", "message": "Invalid app_slug"}
+    try:
+        containers = docker.list_containers(project=app_slug)
+    except (OSError, DockerAPIError) as e:
+        return {"status": "error", "message": str(e)}
+    containers.sort(key=service_order)
+    return {"status": "success", "containers": [container_summary(c) for c in containers]}
+
+def handle_list_status(data):
+    # Served from the events-fed cache: no Docker calls per query
+    app_slug = data.get('app_slug')
+    if app_slug:
+        return {"status": "success", "synced": state.synced, "app": state.project(app_slug)}
+    return {"status": "success", "synced": state.synced, "apps": state.snapshot()}
+
+def handle_list_containers(data):
+    try:
+        containers = docker.list_containers()
+    except (OSError, DockerAPIError) as e:
+        return {"status": "error", "message": str(e)}
+    projects = {}
+    for container in sorted(containers, key=service_order):
+        project = (container.get("Labels") or {}).get(PROJECT_LABEL, "")
+        projects.setdefault(project, []).append(container_summary(container))
+    return {"status": "success", "projects": projects}
+
 def handle_backup(data):
     app_slug = data.get('app_slug')
     if not app_slug or ".." in app_slug:
@@ -94,47 +520,214 @@ def handle_backup(data):
     if not os.path.exists(app_dir):
         return {"status": "error", "message": "App not found"}
 
-    # Simple volume backup: tar the app dir (naive)
-    # Better: Inspect docker-compose, find volumes, backup them.
-    # For MVP: We assume volumes are bound in ./
+    remote = None
+    limiter = None
+    if data.get('remote'):
+        try:
+            remote = remotes.open_remote(data['remote'], os.path.join(RCLONE_CONFIG_DIR, "rclone.conf"),
+                                         run=run_command)
+            rate = remotes.parse_rate(data.get('bwlimit'))
+        except ValueError as e:
+            return {"status": "error", "message": str(e)}
+        limiter = remotes.RateLimiter(rate) if rate else None
+
+    # Incremental, deduplicated snapshot of the app dir (compose file, .env
+    # and the bind-mounted volumes under it); unchanged files aren't re-read.
+    try:
+        manifest = backups.create_snapshot(app_dir, app_slug, store=backup_store, progress=emit)
+        pruned = backups.prune(app_slug, keep=BACKUP_KEEP, store=backup_store)
+    except OSError as e:
+        return {"status": "error", "message": f"Backup failed: {e}"}
 
-    backup_path = f"/srv/gridops/backups/{app_slug}_backup.tar.gz"
-    res = run_command(["tar", "-czf", backup_path, "-C", APPS_DIR, app_slug])
+    result = {
+        "status": "success",
+        "snapshot": manifest["id"],
+        "stats": manifest["stats"],
+        "pruned": pruned,
+    }
+    if remote is not None:
+        job = current_job()
+        try:
+            result["upload"] = backups.upload_snapshot(
+                manifest, remote, store=backup_store,
+                transfers=int(data.get('transfers') or BACKUP_TRANSFERS),
+                limiter=limiter, progress=emit,
+                cancelled=(lambda: job.cancel_requested) if job else None,
+            )
+        except (OSError, InterruptedError, subprocess.SubprocessError, remotes.RemoteError) as e:
+            # The local snapshot is still good; only the copy failed
+            return dict(result, status="error", message=f"Upload to {remote} failed: {e}")
+    return result
 
-    if res['status'] == 'success':
-        # Optional: Sync to Rclone remote if configured
-        # Naive check: if 'backup' remote exists in config, sync there
-        config_path = os.path.join(RCLONE_CONFIG_DIR, "rclone.conf")
-        if os.path.exists(config_path):
-             # We assume a remote named 'backup' is preferred, or we just keep local
-             # For this task, we can't easily guess the remote without UI input.
-             # So we'll leave it as local-only unless we add a 'remote' param to handle_backup.
-             pass
+def handle_restore(data):
+    app_slug = data.get('app_slug')
+    if not app_slug or ".." in app_slug or "/" in app_slug:
+         return {"status": "error", "message": "Invalid app_slug"}
 
-    return res
+    snapshots = backup_store.list_snapshots(app_slug)
+    snapshot_id = data.get('snapshot') or (snapshots[-1] if snapshots else None)
+    if snapshot_id not in snapshots:
+        return {"status": "error", "message": "Snapshot not found"}
+    manifest = backup_store.load_manifest(app_slug, snapshot_id)
+    app_dir = os.path.join(APPS_DIR, app_slug)
+
+    # Containers must not write to the volumes while they are replaced. The
+    # app dir may be gone entirely when recovering from a lost disk.
+    if os.path.exists(app_dir):
+        res = handle_control({"app_slug": app_slug}, "stop")
+        if res['status'] != 'success':
+            return dict(res, message=f"Could not stop app: {res.get('message') or res.get('stderr', '')}")
+
+    job = current_job()
+    try:
+        stats = backups.restore_snapshot(
+            manifest, app_dir, store=backup_store, progress=emit,
+            cancelled=(lambda: job.cancel_requested) if job else None,
+        )
+    except (OSError, InterruptedError, backups.ChecksumError) as e:
+        # Left stopped: a half-restored app should not come back up
+        return {"status": "error", "message": f"Restore failed: {e}"}
+
+    emit("Starting app\n")
+    res = engine_control(app_slug, "start")
+    if res is None:
+        res = run_command(["docker", "compose", "up", "-d"], cwd=app_dir)
+    if res['status'] != 'success':
+        return dict(res, message=f"Restored, but the app failed to start: {res.get('message') or res.get('stderr', '')}",
+                    snapshot=snapshot_id, stats=stats)
+    return {"status": "success", "snapshot": snapshot_id, "stats": stats}
+
+def handle_list_backups(data):
+    app_slug = data.get('app_slug')
+    if not app_slug or ".." in app_slug:
+         return {"status": "error", "message": "Invalid app_slug"}
+    # From the per-snapshot summaries: app pages list these on every view
+    return {"status": "success", "snapshots": backup_store.list_summaries(app_slug)}
+
+def handle_system_backup(data):
+    try:
+        result = system_backup.create_backup(caddy_file=CADDY_FILE, run=run_command, progress=emit)
+    except (OSError, RuntimeError, sqlite3.Error) as e:
+        return {"status": "error", "message": f"System backup failed: {e}"}
+    return dict(result, status="success", message=f"Saved {os.path.basename(result['archive'])}")
 
 def handle_self_update(data):
-    # 1. Backup System
-    backup_file = f"/srv/gridops/backups/system_pre_update.tar.gz"
-    # Backup code + db + env
-    run_command(["tar", "-czf", backup_file, "-C", "/srv", "gridops"], cwd="/srv")
-
-    # 2. Git Pull
-    # Assume /srv/gridops is a git repo
-    # If not, this will fail. The installer should have cloned it.
-    res = run_command(["git", "pull"], cwd="/srv/gridops")
-    if res['status'] == 'error':
+    env = dict(os.environ, **system_backup.read_env(releases.ENV_FILE))
+    try:
+        revision = releases.fetch(data.get('branch') or releases.UPDATE_BRANCH, run=run_command)
+        current = releases.current_release()
+        if current and releases.release_revision(current) == revision:
+            return {"status": "success", "message": f"Already up to date ({revision[:12]})"}
+
+        # 1. Checkpoint code, config and database (not app data) for rollback
+        checkpoint = update_snapshots.create(run=run_command, progress=emit)
+        update_snapshots.prune()
+
+        # 2. Build the new release next to the live one
+        release = releases.build_release(revision, run=run_command, env=env, progress=emit)
+
+        # 3. Switch: one symlink rename, the old release stays for rollback
+        previous = releases.activate(release)
+    except (OSError, RuntimeError, sqlite3.Error, releases.ReleaseError) as e:
+        return {"status": "error", "message": str(e)}
+    emit(f"Now running {os.path.basename(release)}\n")
+
+    # 4. Reload services without dropping requests or jobs
+    res = reload_services(releases.release_venv(previous) != releases.release_venv(release))
+    releases.prune()
+    schedule_reexec()
+    return dict(res, release=os.path.basename(release), revision=revision, checkpoint=checkpoint["id"])
+
+def handle_rollback(data):
+    current = releases.current_release()
+    try:
+        target = releases.rollback()
+    except (OSError, releases.ReleaseError) as e:
+        return {"status": "error", "message": str(e)}
+    emit(f"Rolled back to {os.path.basename(target)}\n")
+    res = reload_services(releases.release_venv(current) != releases.release_venv(target))
+    schedule_reexec()
+    return dict(res, release=os.path.basename(target))
+
+def handle_restore_checkpoint(data):
+    """
+    Database, config and code back to how they were before an update. The
+    web and worker services are stopped first, so no open connection reads
+    or writes the database while it is replaced, and started again on
+    whichever release is current afterwards.
+    """
+    try:
+        update_snapshots.load(data.get('checkpoint'))
+    except FileNotFoundError:
+        return {"status": "error", "message": "Checkpoint not found"}
+    # Gunicorn and Celery let running requests and tasks finish before exiting
+    res = run_command(["systemctl", "stop", *DATABASE_SERVICES])
+    if res['status'] != 'success':
+        return res
+    try:
+        release = update_snapshots.restore(data.get('checkpoint'), run=run_command, progress=emit)
+        releases.activate(release)
+    except (OSError, RuntimeError, sqlite3.Error, releases.ReleaseError) as e:
+        start_database_services()
+        return {"status": "error", "message": str(e)}
+    emit(f"Restored checkpoint {data.get('checkpoint')}, running {os.path.basename(release)}\n")
+    res = start_database_services()
+    if res['status'] != 'success':
         return res
+    res = run_command(["systemctl", "restart", "--no-block", "gridops-metrics"])
+    if res['status'] != 'success':
+        return res
+    schedule_reexec()
+    return {"status": "success", "message": "Web started, runner restarts once its jobs finish",
+            "release": os.path.basename(release)}
+
+def start_database_services():
+    return run_command(["systemctl", "start", *DATABASE_SERVICES], timeout=SERVICE_START_TIMEOUT)
+
+def handle_list_checkpoints(data):
+    return {"status": "success", "checkpoints": update_snapshots.list_checkpoints()}
 
-    # 3. Update Deps (simplified)
-    # In reality, check for requirements.txt changes
+def handle_list_releases(data):
+    return {"status": "success", "releases": releases.list_releases()}
+
+def reload_services(venv_changed):
+    """
+    Point the web and worker services at the current release. Gunicorn
+    re-reads the symlinked code on HUP, starting new workers before the old
+    ones finish their requests; a different virtualenv needs a real restart.
+    """
+    web = "restart" if venv_changed else "reload"
+    res = run_command(["systemctl", web, "gridops-web"])
+    if res['status'] != 'success':
+        return res
+    # Celery finishes the tasks it is running before exiting
+    res = run_command(["systemctl", "restart", "--no-block", "gridops-worker", "gridops-metrics"])
+    if res['status'] != 'success':
+        return res
+    return {"status": "success", "message": f"Web {web}ed, runner restarts once its jobs finish"}
 
-    # 4. Restart Services
-    # We can't restart ourselves synchronously easily without breaking connection
-    # So we schedule a restart
-    subprocess.Popen("sleep 2 && systemctl restart gridops-web gridops-runner", shell=True)
+def schedule_reexec():
+    draining.set()
+    threading.Thread(target=drain_and_reexec, name="drain", daemon=True).start()
 
-    return {"status": "success", "message": "Update started. System restarting..."}
+def drain_and_reexec():
+    while any(not job.finished for job in jobs.list()):
+        time.sleep(0.5)
+    time.sleep(DRAIN_GRACE)
+    if server is None:
+        draining.clear()
+        return
+    # The listening socket survives the exec: connections made meanwhile wait
+    # in its backlog instead of being refused
+    fd = server.socket.fileno()
+    os.set_inheritable(fd, True)
+    env = dict(os.environ, GRIDOPS_RUNNER_FD=str(fd))
+    python = os.path.join(releases.CURRENT_LINK, "venv", "bin", "python3")
+    if not os.path.exists(python):
+        python = sys.executable
+    logging.info(f"Re-executing from {releases.current_release()}")
+    os.chdir(releases.CURRENT_LINK if os.path.isdir(releases.CURRENT_LINK) else os.getcwd())
+    os.execve(python, [python, "-m", "ops.runner"], env)
 
 def handle_config_rclone(data):
     config_content = data.get('config_content')
@@ -192,59 +785,335 @@ WantedBy=multi-user.target
     else:
          return res
 
+# sha256 of the Caddyfile Caddy is known to be running; None until the first reload
+applied_caddyfile = None
+
+def caddyfile_digest(content):
+    return hashlib.sha256(content.encode()).hexdigest()
+
+def save_caddyfile(content):
+    tmp = CADDY_FILE + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(content)
+    os.replace(tmp, CADDY_FILE)
+
 def handle_reload_proxy(data):
+    global applied_caddyfile
     caddyfile_content = data.get('caddyfile')
     if not caddyfile_content:
         return {"status": "error", "message": "No content"}
 
-    with open(CADDY_FILE, "w") as f:
-        f.write(caddyfile_content)
+    digest = caddyfile_digest(caddyfile_content)
+    if digest == applied_caddyfile:
+        return {"status": "success", "message": "Caddyfile unchanged, reload skipped"}
+
+    save_caddyfile(caddyfile_content)
 
     # Reload caddy
-    return run_command(["caddy", "reload", "--config", CADDY_FILE])
+    res = run_command(["caddy", "reload", "--config", CADDY_FILE])
+    if res['status'] == 'success':
+        applied_caddyfile = digest
+    return res
 
-def handle_request(data):
+def apply_proxy_reload(data):
+    with scheduler.slot('proxy'):
+        return handle_reload_proxy(data)
+
+proxy_reloads = Coalescer(apply_proxy_reload, PROXY_RELOAD_WINDOW)
+
+def handle_update_route(data):
+    # data: { app_slug, route: Caddy JSON route or null to remove, host, caddyfile }
+    global applied_caddyfile
+    app_slug = data.get('app_slug')
+    if not app_slug or ".." in app_slug or "/" in app_slug:
+         return {"status": "error", "message": "Invalid app_slug"}
+
+    route = data.get('route')
+    try:
+        if route:
+            outcome = caddy.upsert_route(app_slug, route)
+        else:
+            outcome = caddy.remove_route(app_slug, [data['host']] if data.get('host') else [])
+    except (OSError, ValueError, CaddyAPIError) as e:
+        # Admin API down or the route was rejected: fall back to a full reload
+        logging.info(f"Caddy admin API update failed, reloading Caddyfile: {e}")
+        return handle_reload_proxy(data)
+
+    # Keep the Caddyfile in step so a Caddy restart comes back with the same routes
+    if data.get('caddyfile'):
+        save_caddyfile(data['caddyfile'])
+        # The running config now matches it, so an identical reload can be skipped
+        applied_caddyfile = caddyfile_digest(data['caddyfile'])
+    return {"status": "success", "message": f"Route for {app_slug} {outcome}"}
+
+def dispatch(data):
     command = data.get('command')
     if command == 'install_app':
         return handle_install(data)
     elif command in ['start_app', 'stop_app', 'restart_app', 'pull_app']:
         action = command.split('_')[0] # start, stop, etc
         return handle_control(data, action)
+    elif command == 'scale_app':
+        return handle_scale(data)
     elif command == 'backup_app':
         return handle_backup(data)
+    elif command == 'restore_app':
+        return handle_restore(data)
+    elif command == 'system_backup':
+        return handle_system_backup(data)
     elif command == 'reload_proxy':
         return handle_reload_proxy(data)
+    elif command == 'update_route':
+        return handle_update_route(data)
     elif command == 'self_update':
         return handle_self_update(data)
+    elif command == 'rollback_release':
+        return handle_rollback(data)
+    elif command == 'restore_checkpoint':
+        return handle_restore_checkpoint(data)
     elif command == 'config_rclone':
         return handle_config_rclone(data)
     elif command == 'mount_rclone':
         return handle_mount_rclone(data)
+    elif command == 'batch':
+        return handle_batch(data)
     else:
         return {"status": "error", "message": "Unknown command"}
 
-def main():
-    if os.path.exists(SOCKET_PATH):
-        os.remove(SOCKET_PATH)
+def lock_key(data):
+    # App commands serialize per app; everything else (proxy, rclone, update)
+    # serializes per command so e.g. two Caddyfile writes never race.
+    if data.get('command') in PROXY_COMMANDS:
+        return 'proxy'
+    if data.get('command') in RELEASE_COMMANDS:
+        return 'release'
+    return data.get('app_slug') or data.get('command')
 
-    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-    server.bind(SOCKET_PATH)
-    os.chmod(SOCKET_PATH, 0o660) # Allow group access (gridops group)
+def run_job(job, data):
+    if data.get('command') == 'batch':
+        # Each item takes its own per-app slot; holding one here as well
+        # could starve the items of global slots.
+        job.run(dispatch, data)
+        return
+    with scheduler.slot(lock_key(data)):
+        job.run(dispatch, data)
 
-    # We need to set group ownership of the socket to 'gridops' so the web app can write to it
-    import grp
+def submit_job(data):
+    command = data.get('command')
+    if draining.is_set():
+        return {"status": "error", "message": "Runner is restarting for an update, try again shortly"}
+    timeout = data.get('timeout') or COMMAND_TIMEOUTS.get(command, DEFAULT_TIMEOUT)
+    job = Job(command, app_slug=data.get('app_slug'), timeout=float(timeout))
     try:
-        gid = grp.getgrnam("gridops").gr_gid
-        os.chown(SOCKET_PATH, -1, gid)
-    except Exception as e:
-        logging.error(f"Failed to set socket group: {e}")
+        jobs.add(job)
+    except JobTableFull as e:
+        return {"status": "error", "message": str(e)}
+
+    threading.Thread(target=run_job, args=(job, data), daemon=True).start()
+    logging.info(f"Queued job {job.id}: {command}")
+
+    if data.get('wait'):
+        # Blocking callers (CLI, scripts) get the final result like before
+        job.wait()
+        return dict(job.result, job_id=job.id)
+    return {"status": "accepted", "job_id": job.id}
+
+def handle_job_status(data):
+    job = jobs.get(data.get('job_id'))
+    if job is None:
+        return {"status": "error", "message": "Unknown job"}
+    return {"status": "success", "job": job.to_dict()}
+
+def handle_cancel_job(data):
+    job = jobs.get(data.get('job_id'))
+    if job is None:
+        return {"status": "error", "message": "Unknown job"}
+    if not job.cancel():
+        return {"status": "error", "message": f"Job already {job.state}"}
+    logging.info(f"Cancelled job {job.id}")
+    return {"status": "success", "job": job.to_dict()}
 
-    server.listen(1)
-    logging.info(f"Listening on {SOCKET_PATH}")
+def handle_list_jobs(data):
+    return {"status": "success", "jobs": [job.to_dict() for job in jobs.list()]}
+
+def handle_job_output(data):
+    # Poll-style: whatever output arrived after `since`
+    job = jobs.get(data.get('job_id'))
+    if job is None:
+        return {"status": "error", "message": "Unknown job"}
+    chunks, next_seq, truncated, _ = job.output.read(int(data.get('since', 0)))
+    return {"status": "success", "job": job.to_dict(), "chunks": chunks, "next": next_seq, "truncated": truncated}
+
+def stream_job(job, since=0):
+    # Push-style: one frame per batch of new output until the job finishes
+    while True:
+        chunks, next_seq, truncated, closed = job.output.read(since, wait=1.0)
+        if chunks:
+            yield {"status": "success", "chunks": chunks, "next": next_seq, "truncated": truncated}
+        elif closed:
+            yield {"status": "success", "done": True, "job": job.to_dict()}
+            return
+        since = next_seq
+
+def handle_stream_job(data):
+    job = jobs.get(data.get('job_id'))
+    if job is None:
+        return {"status": "error", "message": "Unknown job"}
+    return stream_job(job, int(data.get('since', 0)))
+
+def handle_request(data):
+    command = data.get('command')
+    if command in JOB_COMMANDS:
+        return submit_job(data)
+    elif command == 'job_status':
+        return handle_job_status(data)
+    elif command == 'cancel_job':
+        return handle_cancel_job(data)
+    elif command == 'list_jobs':
+        return handle_list_jobs(data)
+    elif command == 'job_output':
+        return handle_job_output(data)
+    elif command == 'stream_job':
+        return handle_stream_job(data)
+    # Read-only commands answer immediately, even while the app is busy
+    elif command == 'inspect_app':
+        return handle_inspect_app(data)
+    elif command == 'list_containers':
+        return handle_list_containers(data)
+    elif command == 'list_status':
+        return handle_list_status(data)
+    elif command == 'list_backups':
+        return handle_list_backups(data)
+    elif command == 'list_releases':
+        return handle_list_releases(data)
+    elif command == 'list_checkpoints':
+        return handle_list_checkpoints(data)
+    elif command == 'reload_proxy':
+        # Coalesced before taking the proxy lock, so a burst becomes one reload
+        return proxy_reloads.submit(data)
+
+    with scheduler.slot(lock_key(data)):
+        return dispatch(data)
+
+class RequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        conn = self.request
+        first = conn.recv(1, socket.MSG_PEEK)
+        if not first:
+            return
+        if first == b"{":
+            return self.handle_legacy(conn)
+
+        # Framed protocol: many requests per connection, each answered from
+        # its own thread so a long `wait` or stream doesn't block the rest.
+        write_lock = threading.Lock()
+        in_flight = []
+        try:
+            while True:
+                try:
+                    req = read_frame(conn)
+                except ProtocolError as e:
+                    with write_lock:
+                        write_frame(conn, {"id": None, "status": "error", "message": str(e)})
+                    return
+                if req is None:
+                    return
+                in_flight = [t for t in in_flight if t.is_alive()]
+                worker = threading.Thread(target=self.respond, args=(conn, write_lock, req), daemon=True)
+                worker.start()
+                in_flight.append(worker)
+        except OSError as e:
+            logging.error(f"Connection error: {e}")
+        finally:
+            # The server closes the socket once handle() returns
+            for worker in in_flight:
+                worker.join()
+
+    def respond(self, conn, write_lock, req):
+        req_id = req.get('id')
+
+        def send(frame):
+            with write_lock:
+                write_frame(conn, dict(frame, id=req_id))
+
+        try:
+            try:
+                resp = handle_request(req)
+            except Exception as e:
+                logging.error(f"Request error: {e}")
+                resp = {"status": "error", "message": str(e)}
+
+            if isinstance(resp, dict):
+                send(resp)
+            else:
+                for frame in resp:
+                    send(dict(frame, more=True))
+                send({"status": "success", "more": False})
+        except OSError:
+            # Client went away; nothing left to tell it
+            pass
+
+    def handle_legacy(self, conn):
+        # Pre-framing clients: one JSON document, terminated by SHUT_WR
+        chunks = []
+        while True:
+            packet = conn.recv(65536)
+            if not packet: break
+            chunks.append(packet)
+        data = b"".join(chunks)
+
+        try:
+            req = json.loads(data.decode())
+            resp = handle_request(req)
+            if isinstance(resp, dict):
+                conn.sendall(json.dumps(resp).encode())
+            else:
+                # Streaming response: newline-delimited JSON frames
+                for frame in resp:
+                    conn.sendall(json.dumps(frame).encode() + b"\n")
+        except json.JSONDecodeError:
+            conn.sendall(json.dumps({"status": "error", "message": "Invalid JSON"}).encode())
+        except Exception as e:
+            logging.error(f"Connection error: {e}")
+            conn.sendall(json.dumps({"status": "error", "message": str(e)}).encode())
+
+class RunnerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # One thread per connection; the scheduler decides what actually runs
+    daemon_threads = True
+    request_queue_size = 64
+
+def main():
+    global server
+    logging.basicConfig(filename=LOG_FILE, level=logging.INFO, format='%(asctime)s %(message)s')
+
+    inherited = os.environ.pop("GRIDOPS_RUNNER_FD", None)
+    if inherited:
+        # Re-exec'd after a release switch: keep serving the same socket
+        server = RunnerServer(SOCKET_PATH, RequestHandler, bind_and_activate=False)
+        server.socket = socket.socket(fileno=int(inherited))
+    else:
+        if os.path.exists(SOCKET_PATH):
+            os.remove(SOCKET_PATH)
+
+        server = RunnerServer(SOCKET_PATH, RequestHandler)
+        os.chmod(SOCKET_PATH, 0o660) # Allow group access (gridops group)
+
+        # We need to set group ownership of the socket to 'gridops' so the web app can write to it
+        import grp
+        try:
+            gid = grp.getgrnam("gridops").gr_gid
+            os.chown(SOCKET_PATH, -1, gid)
+        except Exception as e:
+            logging.error(f"Failed to set socket group: {e}")
+
+    threading.Thread(target=state.run, name="docker-events", daemon=True).start()
+    threading.Thread(target=container_stats.run, name="container-stats", daemon=True).start()
+
+    logging.info(f"Listening on {SOCKET_PATH} (max concurrency {MAX_CONCURRENCY})")
 
     def signal_handler(sig, frame):
         logging.info("Shutting down...")
-        server.close()
+        server.server_close()
         if os.path.exists(SOCKET_PATH):
             os.remove(SOCKET_PATH)
         sys.exit(0)
@@ -252,27 +1121,7 @@ def main():
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
 
-    while True:
-        try:
-            conn, _ = server.accept()
-            with conn:
-                data = b""
-                while True:
-                    packet = conn.recv(4096)
-                    if not packet: break
-                    data += packet
-
-                if data:
-                    try:
-                        req = json.loads(data.decode())
-                        resp = handle_request(req)
-                        conn.sendall(json.dumps(resp).encode())
-                    except json.JSONDecodeError:
-                        conn.sendall(json.dumps({"status": "error", "message": "Invalid JSON"}).encode())
-                    except Exception as e:
-                        conn.sendall(json.dumps({"status": "error", "message": str(e)}).encode())
-        except Exception as e:
-            logging.error(f"Connection error: {e}")
+    server.serve_forever()
 
 if __name__ == "__main__":
     main()
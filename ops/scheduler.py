@@ -0,0 +1,93 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Scheduler:
+    """
+    Decides when a runner command may execute.
+
+    Commands that share a key (usually the app slug) never interleave, while
+    commands for different keys run side by side up to `max_concurrency`.
+    """
+
+    def __init__(self, max_concurrency=4):
+        self.max_concurrency = max_concurrency
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._guard = threading.Lock()
+        # key -> [lock, number of holders/waiters]
+        self._locks = {}
+
+    def _acquire_key(self, key):
+        with self._guard:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = [threading.Lock(), 0]
+            entry[1] += 1
+        entry[0].acquire()
+
+    def _release_key(self, key):
+        with self._guard:
+            entry = self._locks[key]
+            entry[0].release()
+            entry[1] -= 1
+            # Drop idle locks so the table doesn't grow with every app ever seen
+            if entry[1] == 0:
+                del self._locks[key]
+
+    @contextmanager
+    def slot(self, key=None):
+        # Take the per-key lock first: a second command for a busy app must not
+        # sit on a global slot while it waits for its turn.
+        if key is not None:
+            self._acquire_key(key)
+        try:
+            with self._slots:
+                yield
+        finally:
+            if key is not None:
+                self._release_key(key)
+
+    def active_keys(self):
+        with self._guard:
+            return sorted(self._locks)
+
+
+class Coalescer:
+    """
+    Folds calls arriving within `window` seconds into one. The first caller
+    waits out the window and then applies the latest value submitted; every
+    caller in the batch gets that one result (or exception).
+    """
+
+    def __init__(self, apply, window):
+        self.apply = apply
+        self.window = window
+        self._lock = threading.Lock()
+        self._batch = None
+
+    def submit(self, value):
+        with self._lock:
+            batch = self._batch
+            leader = batch is None
+            if leader:
+                batch = self._batch = {"value": value, "done": threading.Event(), "result": None, "error": None}
+            else:
+                batch["value"] = value
+
+        if leader:
+            time.sleep(self.window)
+            with self._lock:
+                # Later submissions start a new batch from here on
+                self._batch = None
+            try:
+                batch["result"] = self.apply(batch["value"])
+            except Exception as e:
+                batch["error"] = e
+            batch["done"].set()
+        else:
+            batch["done"].wait()
+
+        if batch["error"] is not None:
+            raise batch["error"]
+        return batch["result"]
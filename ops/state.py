@@ -0,0 +1,164 @@
+import json
+import logging
+import threading
+import time
+
+from .docker_api import PROJECT_LABEL, DockerAPIError
+
+# Seconds to wait before resubscribing after the events stream drops
+RECONNECT_DELAY = 5
+
+# Events that change a container's state, health or restart count
+STATE_EVENTS = {
+    "create", "start", "restart", "die", "stop", "kill", "oom",
+    "pause", "unpause", "health_status",
+}
+
+
+def container_state(details):
+    """Reduce a /containers/{id}/json document to what the dashboard needs."""
+    state = details.get("State") or {}
+    labels = (details.get("Config") or {}).get("Labels") or {}
+    return {
+        "id": details.get("Id", "")[:12],
+        "name": details.get("Name", "").lstrip("/"),
+        "service": labels.get("com.docker.compose.service", ""),
+        "state": state.get("Status", "unknown"),
+        "health": (state.get("Health") or {}).get("Status", ""),
+        "restarts": details.get("RestartCount", 0),
+        "started_at": state.get("StartedAt", ""),
+    }
+
+
+def project_summary(containers):
+    """Aggregate container states into one state for the app."""
+    states = [c["state"] for c in containers]
+    if any(s == "restarting" for s in states):
+        state = "restarting"
+    elif all(s == "running" for s in states):
+        state = "running"
+    elif any(s == "running" for s in states):
+        state = "partial"
+    else:
+        state = "stopped"
+    if state == "running" and any(c["health"] == "unhealthy" for c in containers):
+        state = "unhealthy"
+    return {
+        "state": state,
+        "restarts": sum(c["restarts"] for c in containers),
+        "containers": sorted(containers, key=lambda c: (c["service"], c["name"])),
+    }
+
+
+class StateCache:
+    """
+    Compose project -> container states, kept current from the Docker events
+    stream so status queries never have to touch the daemon.
+    """
+
+    def __init__(self, docker):
+        self.docker = docker
+        self.synced = False
+        self.last_event_at = None
+        self._projects = {} # project -> {container id: state dict}
+        self._owners = {} # container id -> project
+        self._summaries = {} # project -> summary
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def _refresh(self, container_id):
+        try:
+            details = self.docker.inspect_container(container_id)
+        except DockerAPIError as e:
+            if e.status == 404:
+                self._forget(container_id)
+                return
+            raise
+        labels = (details.get("Config") or {}).get("Labels") or {}
+        project = labels.get(PROJECT_LABEL)
+        if project:
+            self._store(container_id, project, container_state(details))
+
+    def _store(self, container_id, project, state):
+        with self._lock:
+            previous = self._owners.get(container_id)
+            if previous is not None and previous != project:
+                self._projects[previous].pop(container_id, None)
+                self._rebuild(previous)
+            self._owners[container_id] = project
+            self._projects.setdefault(project, {})[container_id] = state
+            self._rebuild(project)
+
+    def _forget(self, container_id):
+        with self._lock:
+            project = self._owners.pop(container_id, None)
+            if project is not None:
+                self._projects[project].pop(container_id, None)
+                self._rebuild(project)
+
+    def _rebuild(self, project):
+        # Called with the lock held; only the touched project is recomputed
+        containers = self._projects.get(project)
+        if containers:
+            self._summaries[project] = project_summary(list(containers.values()))
+        else:
+            self._projects.pop(project, None)
+            self._summaries.pop(project, None)
+        self._snapshot = None
+
+    def resync(self):
+        projects = {}
+        owners = {}
+        for container in self.docker.list_containers(all=True):
+            project = (container.get("Labels") or {}).get(PROJECT_LABEL)
+            details = self.docker.inspect_container(container["Id"])
+            projects.setdefault(project, {})[container["Id"]] = container_state(details)
+            owners[container["Id"]] = project
+        with self._lock:
+            self._projects = projects
+            self._owners = owners
+            self._summaries = {}
+            for project in list(projects):
+                self._rebuild(project)
+            self.synced = True
+
+    def apply_event(self, event):
+        action = event.get("Action", "")
+        # health_status events look like "health_status: healthy"
+        base_action = action.split(":", 1)[0]
+        container_id = event.get("id") or (event.get("Actor") or {}).get("ID")
+        if not container_id:
+            return
+        self.last_event_at = time.time()
+        if base_action == "destroy":
+            self._forget(container_id)
+        elif base_action in STATE_EVENTS:
+            self._refresh(container_id)
+
+    def watch(self):
+        """Follow the events stream once; returns when it ends."""
+        # Subscribe from just before the resync so nothing falls in between
+        since = int(time.time()) - 1
+        self.resync()
+        filters = {"type": ["container"], "label": [PROJECT_LABEL]}
+        for event in self.docker.stream("GET", "/events", {"since": since, "filters": json.dumps(filters)}):
+            self.apply_event(event)
+
+    def run(self):
+        while True:
+            try:
+                self.watch()
+            except (OSError, ValueError, DockerAPIError) as e:
+                logging.error(f"Docker events stream failed: {e}")
+            self.synced = False
+            time.sleep(RECONNECT_DELAY)
+
+    def snapshot(self):
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = dict(self._summaries)
+            return self._snapshot
+
+    def project(self, project):
+        with self._lock:
+            return self._summaries.get(project)
@@ -0,0 +1,230 @@
+"""
+Backup of GridOps itself: the dashboard database, .env and the Caddyfile.
+
+Postgres is dumped with a parallel directory-format pg_dump; SQLite through
+the online backup API, so a live database is copied consistently. The dump
+and the config files are then streamed as one tar through a multi-threaded
+compressor (zstd -T0, else pigz) straight into the archive. Old archives are
+thinned out grandfather-father-son style.
+
+    python3 -m ops.system_backup
+"""
+import datetime
+import os
+import shutil
+import sqlite3
+import subprocess
+import tarfile
+import tempfile
+import time
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+from . import releases
+
+GRIDOPS_DIR = "/srv/gridops"
+ENV_FILE = os.path.join(GRIDOPS_DIR, ".env")
+SQLITE_DB = os.path.join(GRIDOPS_DIR, "dashboard", "db.sqlite3")
+CADDY_FILE = "/etc/caddy/Caddyfile"
+BACKUP_DIR = os.path.join(GRIDOPS_DIR, "backups", "system")
+PREFIX = "gridops-"
+TIMESTAMP_FORMAT = "%Y%m%dT%H%M%S"
+DUMP_JOBS = min(4, os.cpu_count() or 1)
+
+# Archives kept: the newest per day, ISO week and month for this many periods
+RETENTION = {"daily": 7, "weekly": 4, "monthly": 12}
+
+# Connection URL parameters and the libpq variables that carry them
+PG_PARAMETERS = {
+    "host": "PGHOST", "port": "PGPORT", "sslmode": "PGSSLMODE", "sslrootcert": "PGSSLROOTCERT",
+    "sslcert": "PGSSLCERT", "sslkey": "PGSSLKEY", "connect_timeout": "PGCONNECT_TIMEOUT",
+    "application_name": "PGAPPNAME", "options": "PGOPTIONS",
+}
+
+
+def read_env(path=ENV_FILE):
+    """KEY=VALUE pairs from a dotenv file (quotes stripped, comments ignored)."""
+    values = {}
+    if not os.path.exists(path):
+        return values
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#") or "=" not in line:
+                continue
+            key, value = line.split("=", 1)
+            values[key.strip()] = value.strip().strip("'\"")
+    return values
+
+
+def compressor():
+    """(command writing stdin to stdout, archive suffix); None means Python's gzip."""
+    if shutil.which("zstd"):
+        return ["zstd", "-T0", "-q", "-c"], ".tar.zst"
+    if shutil.which("pigz"):
+        return ["pigz", "-c"], ".tar.gz"
+    return None, ".tar.gz"
+
+
+def postgres_args(url):
+    """
+    (connection flags, environment) for pg_dump and pg_restore. The password
+    only goes into the environment: on the command line any local user could
+    read it through ps or /proc/<pid>/cmdline.
+    """
+    parts = urlsplit(url)
+    env = dict(os.environ)
+    for key, value in parse_qsl(parts.query):
+        if key in PG_PARAMETERS:
+            env[PG_PARAMETERS[key]] = value
+    if parts.password is not None:
+        env["PGPASSWORD"] = unquote(parts.password)
+    args = []
+    if parts.hostname:
+        args.append(f"--host={unquote(parts.hostname)}")
+    if parts.port:
+        args.append(f"--port={parts.port}")
+    if parts.username:
+        args.append(f"--username={unquote(parts.username)}")
+    args.append(f"--dbname={unquote(parts.path.lstrip('/'))}")
+    return args, env
+
+
+def check_pg(res, what):
+    if res.get("status") != "success":
+        raise RuntimeError(f"{what} failed: {(res.get('stderr') or res.get('message') or '').strip()}")
+
+
+def dump_postgres(url, target, jobs=DUMP_JOBS, run=releases._run):
+    # Uncompressed: the archive stream is compressed once, in parallel
+    args, env = postgres_args(url)
+    check_pg(run(["pg_dump", "--format=directory", f"--jobs={jobs}", "--compress=0",
+                  f"--file={target}", *args], env=env), "pg_dump")
+
+
+def dump_sqlite(path, target):
+    source = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    dest = sqlite3.connect(target)
+    try:
+        source.backup(dest)
+    finally:
+        dest.close()
+        source.close()
+
+
+def write_archive(path, members):
+    """Stream (source path, name in archive) pairs into one compressed tar."""
+    command, _ = compressor()
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            if command is None:
+                with tarfile.open(fileobj=out, mode="w|gz") as tar:
+                    for source, name in members:
+                        tar.add(source, arcname=name)
+            else:
+                proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=out)
+                try:
+                    with tarfile.open(fileobj=proc.stdin, mode="w|") as tar:
+                        for source, name in members:
+                            tar.add(source, arcname=name)
+                finally:
+                    proc.stdin.close()
+                    if proc.wait() != 0:
+                        raise RuntimeError(f"{command[0]} exited with {proc.returncode}")
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def gfs_keep(stamps, retention=RETENTION):
+    """The timestamps a GFS policy keeps: newest per day, week and month."""
+    periods = {
+        "daily": lambda t: t.date(),
+        "weekly": lambda t: t.isocalendar()[:2],
+        "monthly": lambda t: (t.year, t.month),
+    }
+    keep = set()
+    for name, count in retention.items():
+        seen = []
+        for stamp in sorted(stamps, reverse=True):
+            period = periods[name](stamp)
+            if period in seen:
+                continue
+            if len(seen) == count:
+                break
+            seen.append(period)
+            keep.add(stamp)
+    return keep
+
+
+def list_archives(backup_dir=BACKUP_DIR):
+    archives = {}
+    if not os.path.isdir(backup_dir):
+        return archives
+    for name in os.listdir(backup_dir):
+        if not name.startswith(PREFIX):
+            continue
+        stamp = name[len(PREFIX):].split(".", 1)[0]
+        try:
+            archives[datetime.datetime.strptime(stamp, TIMESTAMP_FORMAT)] = name
+        except ValueError:
+            continue
+    return archives
+
+
+def apply_retention(backup_dir=BACKUP_DIR, retention=RETENTION):
+    archives = list_archives(backup_dir)
+    keep = gfs_keep(archives, retention)
+    removed = []
+    for stamp, name in archives.items():
+        if stamp not in keep:
+            os.remove(os.path.join(backup_dir, name))
+            removed.append(name)
+    return sorted(removed)
+
+
+def create_backup(backup_dir=BACKUP_DIR, env_file=ENV_FILE, caddy_file=CADDY_FILE,
+                  sqlite_db=SQLITE_DB, run=releases._run, progress=None):
+    progress = progress or (lambda text: None)
+    started = time.time()
+    os.makedirs(backup_dir, exist_ok=True)
+    stamp = datetime.datetime.now().strftime(TIMESTAMP_FORMAT)
+    archive = os.path.join(backup_dir, PREFIX + stamp + compressor()[1])
+
+    database_url = os.environ.get("DATABASE_URL") or read_env(env_file).get("DATABASE_URL")
+    # The dump lives next to the archives so it stays on the same disk
+    staging = tempfile.mkdtemp(dir=backup_dir, prefix=".dump-")
+    try:
+        members = []
+        if database_url and database_url.startswith(("postgres://", "postgresql://")):
+            progress(f"Dumping Postgres ({DUMP_JOBS} jobs)\n")
+            dump_postgres(database_url, os.path.join(staging, "db"), run=run)
+            members.append((os.path.join(staging, "db"), "db"))
+        elif os.path.exists(sqlite_db):
+            progress("Copying SQLite database\n")
+            dump_sqlite(sqlite_db, os.path.join(staging, "db.sqlite3"))
+            members.append((os.path.join(staging, "db.sqlite3"), "db.sqlite3"))
+        for path in (env_file, caddy_file):
+            if os.path.exists(path):
+                members.append((path, os.path.basename(path)))
+
+        progress(f"Writing {os.path.basename(archive)}\n")
+        write_archive(archive, members)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    removed = apply_retention(backup_dir)
+    size = os.path.getsize(archive)
+    duration = round(time.time() - started, 3)
+    progress(f"Backup complete: {archive} ({size / 1e6:.1f} MB in {duration}s), "
+             f"{len(removed)} old archive(s) removed\n")
+    return {"archive": archive, "size": size, "duration": duration, "removed": removed}
+
+
+def main():
+    create_backup(progress=lambda text: print(text, end="", flush=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Checkpoints taken right before a self-update: the code that was live, its
+config (.env, Caddyfile) and a database dump. App volumes and earlier
+backups are left out, so a checkpoint takes seconds instead of tarring all
+of /srv/gridops.
+
+The code is a hardlinked copy of the live release, so it costs no data
+blocks. Postgres is dumped with the same parallel pg_dump as the system
+backup, SQLite through the online backup API.
+
+    backups/pre-update/20261018T120000/
+        meta.json  code/  .env  Caddyfile  db/ | db.sqlite3
+"""
+import datetime
+import json
+import os
+import shutil
+import sqlite3
+import time
+
+from . import releases, system_backup
+
+CHECKPOINT_DIR = os.path.join(releases.GRIDOPS_DIR, "backups", "pre-update")
+CADDY_FILE = system_backup.CADDY_FILE
+SQLITE_DB = system_backup.SQLITE_DB
+KEEP_CHECKPOINTS = 3
+TIMESTAMP_FORMAT = "%Y%m%dT%H%M%S"
+RESTORE_JOBS = system_backup.DUMP_JOBS
+
+# Entries of the live tree that are state, not code
+SKIP_NAMES = {".git", "venv", "apps", "backups", "releases", "venvs", "current", "previous",
+              "rclone", "rclone_mounts", ".env", "db.sqlite3", "media"}
+
+
+def link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        # Another filesystem (or no hardlink support): fall back to a copy
+        shutil.copy2(src, dst)
+
+
+def copy_code(source, target):
+    shutil.copytree(source, target, symlinks=True, copy_function=link_or_copy,
+                    ignore=lambda path, names: [n for n in names if n in SKIP_NAMES])
+
+
+def database_url(env_file):
+    return os.environ.get("DATABASE_URL") or system_backup.read_env(env_file).get("DATABASE_URL")
+
+
+def is_postgres(url):
+    return bool(url) and url.startswith(("postgres://", "postgresql://"))
+
+
+def create(checkpoint_dir=CHECKPOINT_DIR, env_file=releases.ENV_FILE, caddy_file=CADDY_FILE,
+           sqlite_db=SQLITE_DB, run=releases._run, progress=None):
+    """Checkpoint the live release, config and database; returns its metadata."""
+    progress = progress or (lambda text: None)
+    started = time.time()
+    stamp = datetime.datetime.now().strftime(TIMESTAMP_FORMAT)
+    path = os.path.join(checkpoint_dir, stamp)
+    building = path + ".partial"
+    shutil.rmtree(building, ignore_errors=True)
+    os.makedirs(building)
+    try:
+        release = releases.current_release() or releases.GRIDOPS_DIR
+        progress(f"Checkpointing code of {os.path.basename(release)}\n")
+        copy_code(release, os.path.join(building, "code"))
+        for source in (env_file, caddy_file):
+            if os.path.exists(source):
+                shutil.copy2(source, os.path.join(building, os.path.basename(source)))
+
+        url = database_url(env_file)
+        if is_postgres(url):
+            progress("Dumping Postgres\n")
+            system_backup.dump_postgres(url, os.path.join(building, "db"), run=run)
+            database = "postgres"
+        elif os.path.exists(sqlite_db):
+            progress("Copying SQLite database\n")
+            system_backup.dump_sqlite(sqlite_db, os.path.join(building, "db.sqlite3"))
+            database = "sqlite"
+        else:
+            database = None
+
+        meta = {
+            "id": stamp,
+            "created_at": started,
+            "release": release,
+            "revision": releases.release_revision(release),
+            "venv": releases.release_venv(release),
+            "database": database,
+            "duration": round(time.time() - started, 3),
+        }
+        with open(os.path.join(building, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        os.rename(building, path)
+    except BaseException:
+        shutil.rmtree(building, ignore_errors=True)
+        raise
+    progress(f"Checkpoint {stamp} taken in {meta['duration']}s\n")
+    return meta
+
+
+def load(checkpoint_id, checkpoint_dir=CHECKPOINT_DIR):
+    if not checkpoint_id or "/" in checkpoint_id or checkpoint_id.startswith("."):
+        raise FileNotFoundError(checkpoint_id)
+    with open(os.path.join(checkpoint_dir, checkpoint_id, "meta.json")) as f:
+        return json.load(f)
+
+
+def list_checkpoints(checkpoint_dir=CHECKPOINT_DIR):
+    checkpoints = []
+    if not os.path.isdir(checkpoint_dir):
+        return checkpoints
+    for name in sorted(os.listdir(checkpoint_dir)):
+        try:
+            checkpoints.append(load(name, checkpoint_dir))
+        except (OSError, ValueError):
+            continue
+    return checkpoints
+
+
+def prune(keep=KEEP_CHECKPOINTS, checkpoint_dir=CHECKPOINT_DIR):
+    removed = []
+    if not os.path.isdir(checkpoint_dir):
+        return removed
+    names = sorted(os.listdir(checkpoint_dir))
+    complete = [n for n in names if not n.endswith(".partial")]
+    for name in complete[:-keep] if keep else complete:
+        shutil.rmtree(os.path.join(checkpoint_dir, name), ignore_errors=True)
+        removed.append(name)
+    return removed
+
+
+def restore_database(path, meta, env_file=releases.ENV_FILE, sqlite_db=SQLITE_DB, run=releases._run):
+    # Writes over the live database: the caller stops the services using it
+    if meta["database"] == "postgres":
+        # Same as the dump: the password travels in the environment, not argv
+        args, env = system_backup.postgres_args(database_url(env_file))
+        system_backup.check_pg(run(
+            ["pg_restore", "--clean", "--if-exists", "--no-owner", f"--jobs={RESTORE_JOBS}",
+             *args, os.path.join(path, "db")], env=env,
+        ), "pg_restore")
+    elif meta["database"] == "sqlite":
+        source = sqlite3.connect(os.path.join(path, "db.sqlite3"))
+        dest = sqlite3.connect(sqlite_db)
+        try:
+            source.backup(dest)
+        finally:
+            dest.close()
+            source.close()
+
+
+def restore(checkpoint_id, checkpoint_dir=CHECKPOINT_DIR, env_file=releases.ENV_FILE,
+            caddy_file=CADDY_FILE, sqlite_db=SQLITE_DB, run=releases._run, progress=None):
+    """
+    Put the database, config and code back as they were at the checkpoint.
+    Returns the release directory to activate.
+    """
+    progress = progress or (lambda text: None)
+    meta = load(checkpoint_id, checkpoint_dir)
+    path = os.path.join(checkpoint_dir, checkpoint_id)
+
+    progress("Restoring database\n")
+    restore_database(path, meta, env_file, sqlite_db, run=run)
+    for target in (env_file, caddy_file):
+        saved = os.path.join(path, os.path.basename(target))
+        if os.path.exists(saved):
+            shutil.copy2(saved, target)
+
+    # The release is normally still on disk; otherwise it is rebuilt from
+    # the hardlinked code
+    release = meta["release"]
+    if os.path.isdir(release):
+        return release
+    progress("Release gone, reinstating it from the checkpoint\n")
+    release = os.path.join(releases.RELEASES_DIR, f"{checkpoint_id}-restored")
+    shutil.rmtree(release, ignore_errors=True)
+    copy_code(os.path.join(path, "code"), release)
+    releases.link_shared(release)
+    venv = meta.get("venv")
+    if not venv or not os.path.exists(os.path.join(venv, releases.VENV_MARKER)):
+        venv = releases.ensure_venv(release, run, progress)
+    os.symlink(venv, os.path.join(release, "venv"))
+    return release